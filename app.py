@@ -1,4 +1,5 @@
 import os
+import json
 import base64
 import requests
 import streamlit as st
@@ -6,11 +7,40 @@ import streamlit as st
 #======配置区======
 API_BASE = os.getenv("API_BASE", "http://127.0.0.1:8000")
 API_EVALUATE_URL = f"{API_BASE}/api/v1/evaluate"
+API_EVALUATE_STREAM_URL = f"{API_BASE}/api/v1/evaluate/stream"
 API_HISTORY_URL = f"{API_BASE}/api/v1/history"
 API_MODELS_URL = f"{API_BASE}/api/v1/models"
 API_BATCH_URL = f"{API_BASE}/api/v1/evaluate/batch"
 API_TASK_URL = f"{API_BASE}/api/v1/task"
 
+#======工具函数======
+def iter_sse(url: str, payload: dict | None = None, params: dict | None = None):
+    """
+    按行读 SSE，逐个产出 (event, data)。带 payload 时 POST，否则 GET。
+    """
+    method = "POST" if payload is not None else "GET"
+    with requests.request(method, url, json=payload, params=params, stream=True, timeout=(5, 60)) as resp:
+        resp.raise_for_status()
+        event = None
+        for line in resp.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:") and event:
+                yield event, json.loads(line[5:].strip())
+                event = None
+
+
+def show_answer(box, ans: str, answer_type: str) -> None:
+    if answer_type == "open":
+        box.success(f"最终答案：{ans}")
+    elif ans == "yes":
+        box.success(f"最终答案：{ans}")
+    elif ans == "no":
+        box.info(f"最终答案：{ans}")
+    else:
+        box.error(f"最终答案：{ans}（拒答）")
+
+
 #======页面骨架======
 st.set_page_config(page_title="MM-TrustBench", layout="wide")
 st.title("MM-TrustBench：视觉大模型幻觉评测台")
@@ -49,34 +79,45 @@ if run_btn:
         img_b64 = base64.b64encode(img_bytes).decode("utf-8")
         payload = {"question": question.strip(), "image_base64": img_b64, "answer_type": answer_type, "model_id": current_model_id}
 
-        with st.spinner("评测中..."):
-            try:
-                resp = requests.post(API_EVALUATE_URL, json=payload, timeout=60)
-                resp.raise_for_status()
-                data = resp.json()
-            except requests.RequestException as e:
-                st.error(f"请求失败：{e}")
-                st.stop()
-
-        # 左右分栏：左图右结果
+        # 左右分栏：左图右结果；走 SSE 流式接口，证据、自检、答案各自一到就显示，不用干等整段生成完
         col_left, col_right = st.columns(2)
         with col_left:
             uploaded_file.seek(0)
             st.image(uploaded_file, use_container_width=True)
         with col_right:
-            ans = data.get("final_answer", "")
-            if answer_type == "open":
-                st.success(f"最终答案：{ans}")
-            elif ans == "yes":
-                st.success(f"最终答案：{ans}")
-            elif ans == "no":
-                st.info(f"最终答案：{ans}")
-            else:
-                st.error(f"最终答案：{ans}（拒答）")
-            with st.expander("证据链 (Evidence)"):
-                st.text(data.get("evidence", ""))
-            with st.expander("自检过程 (Self-check)"):
-                st.text(data.get("self_check", ""))
+            answer_box = st.empty()
+            answer_box.info("评测中...")
+            live_box = st.empty()
+            evidence_exp = st.expander("证据链 (Evidence)")
+            evidence_box = evidence_exp.empty()
+            self_check_exp = st.expander("自检过程 (Self-check)")
+            self_check_box = self_check_exp.empty()
+            streamed = ""
+            data = None
+            try:
+                for event, ev_data in iter_sse(API_EVALUATE_STREAM_URL, payload):
+                    if event == "delta":
+                        streamed += ev_data.get("text", "")
+                        live_box.caption(streamed[-400:])
+                    elif event == "evidence":
+                        evidence_box.text(ev_data.get("text", ""))
+                    elif event == "self_check":
+                        self_check_box.text(ev_data.get("text", ""))
+                    elif event == "answer":
+                        show_answer(answer_box, ev_data.get("final_answer", ""), answer_type)
+                    elif event == "done":
+                        data = ev_data
+                    elif event == "error":
+                        answer_box.error(f"评测失败：{ev_data.get('message', '')}")
+                        st.stop()
+            except requests.RequestException as e:
+                answer_box.error(f"请求失败：{e}")
+                st.stop()
+            live_box.empty()
+            if data is not None:
+                show_answer(answer_box, data.get("final_answer", ""), answer_type)
+                evidence_box.text(data.get("evidence", ""))
+                self_check_box.text(data.get("self_check", ""))
 
 #======批量评测======
 st.divider()
@@ -113,38 +154,84 @@ if batch_btn:
         except requests.RequestException as e:
             st.error(f"提交失败：{e}")
 
-# 查看任务结果（轮询）
+# 查看任务结果：订阅任务事件流，进度和每条完成的记录实时推过来，不再反复轮询；
+# 已收到的记录和游标存在 session_state 里，再点一次只补新记录
 if "last_batch_task_id" in st.session_state:
     st.caption("查看刚提交的批量任务结果：")
     view_btn = st.button("查看任务结果")
     if view_btn:
         tid = st.session_state["last_batch_task_id"]
+        poll = st.session_state.get("batch_poll")
+        if not poll or poll.get("task_id") != tid:
+            poll = {"task_id": tid, "since": 0, "records": []}
+            st.session_state["batch_poll"] = poll
+        status_box = st.empty()
+        progress_bar = st.progress(0.0)
+        records_box = st.container()
+        for rec in poll["records"]:
+            records_box.write(f"Q: {(rec.get('question') or '')[:80]}… → **{rec.get('final_answer', '')}**")
         try:
-            tr = requests.get(f"{API_TASK_URL}/{tid}", timeout=10)
-            tr.raise_for_status()
-            task_data = tr.json()
-            status = task_data.get("status", "")
-            st.write(f"**状态**：{status}")
-            if status == "completed":
-                for rec in task_data.get("records") or []:
-                    ans = rec.get("final_answer", "")
-                    st.write(f"Q: {(rec.get('question') or '')[:80]}… → **{ans}**")
-            elif status == "processing":
-                st.info("仍在处理中，请稍后再点「查看任务结果」。")
+            for event, ev_data in iter_sse(f"{API_TASK_URL}/{tid}/events", params={"since": poll["since"]}):
+                if event == "record":
+                    poll["records"].append(ev_data)
+                    poll["since"] = ev_data.get("id") or poll["since"]
+                    records_box.write(f"Q: {(ev_data.get('question') or '')[:80]}… → **{ev_data.get('final_answer', '')}**")
+                elif event in ("progress", "done"):
+                    total = ev_data.get("total_items") or 0
+                    done = (ev_data.get("done_items") or 0) + (ev_data.get("failed_items") or 0)
+                    if total:
+                        progress_bar.progress(min(1.0, done / total))
+                    eta = ev_data.get("eta_sec")
+                    eta_text = f"，预计还需 {eta} 秒" if eta and ev_data.get("status") == "processing" else ""
+                    status_box.write(
+                        f"**状态**：{ev_data.get('status', '')}（完成 {ev_data.get('done_items') or 0} / {total or '?'}，"
+                        f"失败 {ev_data.get('failed_items') or 0}{eta_text}）"
+                    )
         except requests.RequestException as e:
             st.warning(f"查询失败：{e}")
 
 #======历史记录======
+# 用 summary 模式只拉每个任务的答案计数，记录点开再按页取；「加载更多」带上 next_cursor 往后翻
 st.divider()
 st.subheader("历史评测记录")
-history_limit = st.selectbox("显示条数", [5, 10, 20, 50], index=1, key="history_limit")
+history_limit = st.selectbox("每页条数", [5, 10, 20, 50], index=1, key="history_limit")
 if st.button("刷新历史"):
+    st.session_state.pop("history_pages", None)
+    # 各任务已加载的记录也一并丢掉，展开时按最新数据重新拉
+    for k in [k for k in st.session_state if str(k).startswith("history_records_")]:
+        del st.session_state[k]
     st.rerun()
+
+
+def render_record(r: dict) -> None:
+    ans = r.get("final_answer", "")
+    q = (r.get("question") or "")[:60]
+    if len(r.get("question") or "") > 60:
+        q += "…"
+    if ans == "yes":
+        st.success(f"Q: {q} → {ans}")
+    elif ans == "no":
+        st.info(f"Q: {q} → {ans}")
+    elif ans == "refused":
+        st.error(f"Q: {q} → {ans}（拒答）")
+    else:
+        # 开放回答（数字或短句），直接展示答案
+        st.success(f"Q: {q} → {ans}")
+    ev = r.get("evidence") or ""
+    st.caption("证据: " + (ev[:200] + "…" if len(ev) > 200 else ev))
+
+
 try:
-    resp = requests.get(API_HISTORY_URL, params={"limit": history_limit}, timeout=10)
-    resp.raise_for_status()
-    history = resp.json()
-    tasks = history.get("tasks") or []
+    pages = st.session_state.get("history_pages")
+    if pages is None or pages.get("limit") != history_limit:
+        pages = {"limit": history_limit, "tasks": [], "next_cursor": None, "loaded": False}
+        st.session_state["history_pages"] = pages
+    if not pages["loaded"]:
+        resp = requests.get(API_HISTORY_URL, params={"limit": history_limit, "mode": "summary"}, timeout=10)
+        resp.raise_for_status()
+        history = resp.json()
+        pages.update(tasks=history.get("tasks") or [], next_cursor=history.get("next_cursor"), loaded=True)
+    tasks = pages["tasks"]
     if not tasks:
         st.info("暂无历史记录，完成一次评测后会出现在这里。")
     else:
@@ -152,23 +239,33 @@ try:
             started = t.get("started_at") or ""
             if len(started) > 19:
                 started = started[:19]
-            with st.expander(f"任务 {t.get('task_id', '')[:8]}… | {t.get('status', '')} | {started}"):
-                st.caption(f"状态: {t.get('status')} | 模型: {t.get('model_name') or '-'} | 耗时: {t.get('total_duration_sec') or '-'} 秒")
-                for r in t.get("records") or []:
-                    ans = r.get("final_answer", "")
-                    q = (r.get("question") or "")[:60]
-                    if len(r.get("question") or "") > 60:
-                        q += "…"
-                    if ans == "yes":
-                        st.success(f"Q: {q} → {ans}")
-                    elif ans == "no":
-                        st.info(f"Q: {q} → {ans}")
-                    elif ans == "refused":
-                        st.error(f"Q: {q} → {ans}（拒答）")
-                    else:
-                        # 开放回答（数字或短句），直接展示答案
-                        st.success(f"Q: {q} → {ans}")
-                    ev = r.get("evidence") or ""
-                    st.caption("证据: " + (ev[:200] + "…" if len(ev) > 200 else ev))
+            tid = t.get("task_id", "")
+            with st.expander(f"任务 {tid[:8]}… | {t.get('status', '')} | {started}"):
+                counts = t.get("answer_counts") or {}
+                st.caption(
+                    f"状态: {t.get('status')} | 模型: {t.get('model_name') or '-'} | 耗时: {t.get('total_duration_sec') or '-'} 秒 | "
+                    f"共 {t.get('record_count') or 0} 条：yes {counts.get('yes', 0)} / no {counts.get('no', 0)} / "
+                    f"拒答 {counts.get('refused', 0)} / 开放 {counts.get('open', 0)}"
+                )
+                rec_state = st.session_state.setdefault(f"history_records_{tid}", {"records": [], "next_after": 0})
+                for r in rec_state["records"]:
+                    render_record(r)
+                if rec_state["next_after"] is not None and t.get("record_count"):
+                    if st.button("加载记录", key=f"history_more_{tid}"):
+                        rr = requests.get(f"{API_TASK_URL}/{tid}/records", params={"after": rec_state["next_after"], "limit": 20}, timeout=10)
+                        rr.raise_for_status()
+                        page = rr.json()
+                        rec_state["records"].extend(page.get("records") or [])
+                        rec_state["next_after"] = page.get("next_after")
+                        st.rerun()
+        if pages["next_cursor"] and st.button("加载更多任务"):
+            resp = requests.get(
+                API_HISTORY_URL, params={"limit": history_limit, "mode": "summary", "cursor": pages["next_cursor"]}, timeout=10
+            )
+            resp.raise_for_status()
+            history = resp.json()
+            pages["tasks"].extend(history.get("tasks") or [])
+            pages["next_cursor"] = history.get("next_cursor")
+            st.rerun()
 except requests.RequestException as e:
     st.warning(f"获取历史失败（请确认后端已启动）: {e}")
@@ -0,0 +1,168 @@
+"""
+SQLite 查询压测：造一个大的合成库，对比「默认配置 + 无索引」与「性能参数 + 升级后索引」下
+history 分页与任务轮询的耗时。
+
+用法（项目根目录）：
+    python benchmarks/bench_db.py --tasks 5000 --records 300000
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import sessionmaker, joinedload
+from src.database import create_sqlite_engine, upgrade_schema
+from src.models import EvaluationTask, EvaluationRecord
+
+# 无索引的老表结构，模拟升级前的 data/trustbench.db；后来加的列照样带上，ORM 查询才能跑，只比索引和参数
+_OLD_SCHEMA = """
+CREATE TABLE evaluation_tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, task_id VARCHAR(36) NOT NULL UNIQUE,
+    started_at DATETIME, status VARCHAR(32) NOT NULL, model_name VARCHAR(128), total_duration_sec INTEGER,
+    total_items INTEGER, done_items INTEGER, failed_items INTEGER, eta_sec INTEGER
+);
+CREATE TABLE evaluation_records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, task_id INTEGER REFERENCES evaluation_tasks(id),
+    question VARCHAR(512) NOT NULL, image_base64 TEXT, final_answer VARCHAR(32) NOT NULL,
+    evidence TEXT, self_check TEXT, created_at DATETIME
+);
+"""
+
+
+def build_db(path: str, n_tasks: int, n_records: int, seed: int = 0) -> None:
+    """
+    直接用 sqlite3 批量灌数据，比走 ORM 快两个数量级。records 随机分到各 task 上。
+    """
+    rnd = random.Random(seed)
+    con = sqlite3.connect(path)
+    con.executescript(_OLD_SCHEMA)
+    t0 = datetime(2026, 1, 1)
+    con.executemany(
+        "INSERT INTO evaluation_tasks (task_id, started_at, status, model_name, total_duration_sec) VALUES (?, ?, ?, ?, ?)",
+        (
+            (f"{i:08d}-0000-0000-0000-000000000000", (t0 + timedelta(seconds=rnd.randint(0, 10**7))).isoformat(" "),
+             "completed", "bench-model", rnd.randint(1, 100))
+            for i in range(n_tasks)
+        ),
+    )
+    answers = ["yes", "no", "refused"]
+    con.executemany(
+        "INSERT INTO evaluation_records (task_id, question, image_base64, final_answer, evidence, self_check, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            (rnd.randint(1, n_tasks), f"Is there a thing {i} in the image?", "[base64, len=1000]",
+             rnd.choice(answers), "I see some things." * 3, "Supported.", t0.isoformat(" "))
+            for i in range(n_records)
+        ),
+    )
+    con.commit()
+    con.close()
+
+
+def _time(fn, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+    }
+
+
+def run_queries(engine, task_ids: list[str], repeat: int) -> dict:
+    """
+    history（最近 10 个任务连带记录）、history summary 模式翻页（keyset + 按答案计数）和 task 轮询（按 task_id 取任务全部记录）。
+    history / task_poll 保留改造前的写法作基线，history_summary 与 api.py 现在的查询一致。
+    """
+    Session = sessionmaker(bind=engine)
+    rnd = random.Random(1)
+
+    def history():
+        db = Session()
+        try:
+            (db.query(EvaluationTask).options(joinedload(EvaluationTask.records))
+             .order_by(EvaluationTask.started_at.desc()).limit(10).all())
+        finally:
+            db.close()
+
+    def task_poll():
+        db = Session()
+        try:
+            (db.query(EvaluationTask).options(joinedload(EvaluationTask.records))
+             .filter(EvaluationTask.task_id == rnd.choice(task_ids)).first())
+        finally:
+            db.close()
+
+    def history_summary():
+        # summary 模式翻到中间一页：keyset 定位 + 这一页任务的 GROUP BY 计数，与页深、任务大小无关
+        db = Session()
+        try:
+            mid = (db.query(EvaluationTask.started_at, EvaluationTask.id)
+                   .order_by(EvaluationTask.started_at.desc(), EvaluationTask.id.desc())
+                   .offset(len(task_ids) // 2).first())
+            tasks = (db.query(EvaluationTask).filter(tuple_(EvaluationTask.started_at, EvaluationTask.id) < tuple(mid))
+                     .order_by(EvaluationTask.started_at.desc(), EvaluationTask.id.desc()).limit(11).all())
+            (db.query(EvaluationRecord.task_id, EvaluationRecord.final_answer, func.count())
+             .filter(EvaluationRecord.task_id.in_([t.id for t in tasks]))
+             .group_by(EvaluationRecord.task_id, EvaluationRecord.final_answer).all())
+        finally:
+            db.close()
+
+    return {
+        "history": _time(history, repeat),
+        "history_summary": _time(history_summary, repeat),
+        "task_poll": _time(task_poll, repeat),
+    }
+
+
+def main(argv: list | None = None) -> dict:
+    parser = argparse.ArgumentParser(description="SQLite 性能参数与索引压测")
+    parser.add_argument("--tasks", type=int, default=5000)
+    parser.add_argument("--records", type=int, default=300000)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--json", default=None, help="结果另存为 json")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        t = time.perf_counter()
+        build_db(path, args.tasks, args.records)
+        print(f"造库: {args.tasks} tasks / {args.records} records, {time.perf_counter() - t:.1f}s")
+        task_ids = [f"{i:08d}-0000-0000-0000-000000000000" for i in range(0, args.tasks, max(1, args.tasks // 200))]
+
+        before_engine = create_sqlite_engine(path, pragmas=None)
+        before = run_queries(before_engine, task_ids, args.repeat)
+        before_engine.dispose()
+
+        after_engine = create_sqlite_engine(path)
+        changes = upgrade_schema(after_engine)
+        after = run_queries(after_engine, task_ids, args.repeat)
+        after_engine.dispose()
+
+    result = {"tasks": args.tasks, "records": args.records, "upgrade": changes, "before": before, "after": after}
+    print(f"升级: {changes}")
+    print(f"{'query':<16} {'before p50':>12} {'after p50':>12} {'before p95':>12} {'after p95':>12}")
+    for q in ("history", "history_summary", "task_poll"):
+        print(f"{q:<16} {before[q]['p50_ms']:>10.2f}ms {after[q]['p50_ms']:>10.2f}ms "
+              f"{before[q]['p95_ms']:>10.2f}ms {after[q]['p95_ms']:>10.2f}ms")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+回复解析压测：TrustPipeline 的段解析与 analysis 的 yes/no 归一化，在合成 + 真实语料上跑吞吐，
+并和改写前的实现对比。
+
+两种跑法（项目根目录）：
+    # 装了 pytest-benchmark 时，用它的 fixture 统计并可 --benchmark-compare 追回归
+    python -m pytest benchmarks/bench_parser.py --benchmark-only
+    # 不装也能独立跑，打印每条耗时与加速比，可存 JSON
+    python benchmarks/bench_parser.py --n 20000 --json /tmp/bench_parser.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+from benchmarks.parser_corpus import build_corpus, reference_parse_response, reference_extract_yes_no
+from src.trust_pipeline import parse_response
+from src.analysis import extract_yes_no
+
+CORPUS_SIZE = 5000
+
+_corpus_cache: dict = {}
+
+
+def _corpus(n: int = CORPUS_SIZE) -> list[str]:
+    if n not in _corpus_cache:
+        _corpus_cache[n] = build_corpus(n)
+    return _corpus_cache[n]
+
+
+def parse_all(corpus: list[str], answer_type: str = "yes_no", fn=parse_response) -> int:
+    n = 0
+    for raw in corpus:
+        fn(raw, answer_type)
+        n += 1
+    return n
+
+
+def score_all(corpus: list[str], fn=extract_yes_no) -> int:
+    n = 0
+    for raw in corpus:
+        fn(raw)
+        n += 1
+    return n
+
+
+#======pytest-benchmark======
+def test_parse_yes_no(benchmark):
+    corpus = _corpus()
+    assert benchmark(parse_all, corpus, "yes_no") == len(corpus)
+
+
+def test_parse_open(benchmark):
+    corpus = _corpus()
+    assert benchmark(parse_all, corpus, "open") == len(corpus)
+
+
+def test_extract_yes_no(benchmark):
+    corpus = _corpus()
+    assert benchmark(score_all, corpus) == len(corpus)
+
+
+#======独立运行======
+def _time(fn, *args, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples)
+
+
+def main(argv: list | None = None) -> dict:
+    parser = argparse.ArgumentParser(description="回复解析吞吐压测")
+    parser.add_argument("--n", type=int, default=CORPUS_SIZE, help="合成语料条数（另加 data/ 下真实回复）")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", default=None, help="结果另存为 JSON")
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus(args.n)
+    cases = [
+        ("parse yes_no", lambda c: parse_all(c, "yes_no"), lambda c: parse_all(c, "yes_no", reference_parse_response)),
+        ("parse open", lambda c: parse_all(c, "open"), lambda c: parse_all(c, "open", reference_parse_response)),
+        ("extract_yes_no", score_all, lambda c: score_all(c, reference_extract_yes_no)),
+    ]
+    results = {"corpus_size": len(corpus), "repeat": args.repeat, "cases": {}}
+    print(f"语料 {len(corpus)} 条，每项取 {args.repeat} 次中位数")
+    print(f"{'case':<16}{'new us/row':>12}{'old us/row':>12}{'rows/s':>12}{'speedup':>10}")
+    for name, new_fn, old_fn in cases:
+        new_t = _time(new_fn, corpus, repeat=args.repeat)
+        old_t = _time(old_fn, corpus, repeat=args.repeat)
+        row = {
+            "new_us_per_row": new_t / len(corpus) * 1e6,
+            "old_us_per_row": old_t / len(corpus) * 1e6,
+            "rows_per_sec": len(corpus) / new_t if new_t else 0.0,
+            "speedup": old_t / new_t if new_t else 0.0,
+        }
+        results["cases"][name] = row
+        print(f"{name:<16}{row['new_us_per_row']:>12.2f}{row['old_us_per_row']:>12.2f}"
+              f"{row['rows_per_sec']:>12.0f}{row['speedup']:>9.2f}x")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
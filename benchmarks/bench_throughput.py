@@ -0,0 +1,342 @@
+"""
+端到端吞吐压测：对着本地模拟接口（mock_server.py）跑三条路径，每条在几档并发下报 items/s 与 p50/p95/p99 延迟：
+    main      离线批量评测 src/main.py 的 run_benchmark（进程内，线程池并发）
+    evaluate  在线单条 POST /api/v1/evaluate（起一个 uvicorn 子进程，客户端按并发数同时发）
+    batch     在线批量 POST /api/v1/evaluate/batch（子进程的 BATCH_CONCURRENCY 设为并发数，轮询到任务完成）
+batch 的单条延迟按「提交时刻 → 该条记录落库时刻」算。结果存 JSON，带上配置，便于跨版本比较。
+
+用法（项目根目录）：
+    python benchmarks/bench_throughput.py --n 200 --concurrency 1,4,16 --latency-ms 300
+    # 注入故障，看重试与熔断下的吞吐；和上次结果对比
+    python benchmarks/bench_throughput.py --rate-429 0.02 --rate-5xx 0.01 --compare data/bench/throughput-上次.json
+"""
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+import httpx
+from benchmarks.mock_server import create_app, add_mock_args, mock_conf
+from src.analysis import percentile
+
+#======配置区======
+TARGETS = ("main", "evaluate", "batch")
+DEFAULT_LEVELS = "1,4,16"
+# 压测时的请求超时，配合模拟服务的卡死注入，不用等满默认的 60 秒
+BENCH_REQUEST_TIMEOUT_SEC = 10
+RESULTS_DIR = os.path.join(_ROOT, "data", "bench")
+# batch 轮询任务状态的间隔：只影响总耗时的结束时刻（最多晚这么久），单条延迟按记录的落库时间算
+BATCH_POLL_SEC = 0.1
+
+
+#======模拟服务（进程内线程）======
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class MockServer:
+    """
+    在后台线程里跑 uvicorn，退出时优雅关掉。
+    """
+
+    def __init__(self, conf: dict) -> None:
+        import uvicorn
+
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}/v1/chat/completions"
+        config = uvicorn.Config(create_app(**conf), host="127.0.0.1", port=self.port, log_level="warning")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, name="mock-vision-api", daemon=True)
+
+    def __enter__(self) -> "MockServer":
+        self._thread.start()
+        deadline = time.time() + 10
+        while not self._server.started:
+            if time.time() > deadline:
+                raise RuntimeError("模拟服务没起来")
+            time.sleep(0.02)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+    def stats(self) -> dict:
+        return httpx.get(f"http://127.0.0.1:{self.port}/stats").json()
+
+
+def _delta(after: dict, before: dict) -> dict:
+    return {k: after[k] - before.get(k, 0) for k in after}
+
+
+#======统计======
+def summarize(latencies: list[float], wall: float, n: int, errors: int) -> dict:
+    s = sorted(latencies)
+    return {
+        "n": n,
+        "ok": n - errors,
+        "errors": errors,
+        "wall_sec": round(wall, 3),
+        "items_per_sec": round(n / wall, 2) if wall else 0.0,
+        "mean_ms": round(sum(s) / len(s) * 1000, 1) if s else None,
+        **{f"p{q}_ms": (round(percentile(s, q) * 1000, 1) if s else None) for q in (50, 95, 99)},
+    }
+
+
+def _make_images(workdir: str, n: int, image_kb: int) -> list[str]:
+    """
+    造 n 个不同的「图片」文件：随机字节，只为让上传大小和编码开销接近真实，模拟服务不解码。
+    """
+    paths = []
+    for i in range(n):
+        path = os.path.join(workdir, f"img_{i:05d}.jpg")
+        with open(path, "wb") as f:
+            f.write(os.urandom(image_kb * 1024))
+        paths.append(path)
+    return paths
+
+
+def _questions(n: int) -> list[str]:
+    objects = ["cat", "dog", "person", "car", "traffic light", "dining table", "bicycle", "umbrella"]
+    return [f"Is there a {objects[i % len(objects)]} in the image?" for i in range(n)]
+
+
+#======main：离线批量======
+def bench_main(api_url: str, images: list[str], level: int, workdir: str) -> dict:
+    # src/main.py 按顶层模块导入 wrapper / trust_pipeline，这里借它自己的导入拿同一套类
+    from src import main as main_mod
+    from cache import ImageCache
+
+    items = [{"question_id": i, "image": os.path.basename(p), "local_path": p, "question": q}
+             for i, (p, q) in enumerate(zip(images, _questions(len(images))))]
+    wrapper = main_mod.ModelWrapper(
+        api_key="bench", api_url=api_url, model="mock-vl",
+        pool_size=max(main_mod.POOL_SIZE, level), image_cache=ImageCache(),
+    )
+    pipeline = main_mod.TrustPipeline(wrapper)
+    latencies: list[float] = []
+    lock = threading.Lock()
+
+    class Timed:
+        # 只包一层计时，run_benchmark 的并发、落盘逻辑原样跑
+        def process(self, image_path, question):
+            t0 = time.perf_counter()
+            out = pipeline.process(image_path, question)
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+            return out
+
+    output = os.path.join(workdir, f"main_c{level}.jsonl")
+    t0 = time.perf_counter()
+    main_mod.run_benchmark(Timed(), items, output, concurrency=level)
+    wall = time.perf_counter() - t0
+    with open(output, "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    errors = sum(1 for r in rows if r.get("model_answer") == "Error") + (len(items) - len(rows))
+    return summarize(latencies, wall, len(items), errors)
+
+
+#======evaluate / batch：在线服务======
+class ApiServer:
+    """
+    起一个 uvicorn 子进程跑 src.api:app，用临时库、进程内限速状态，指向模拟接口。
+    """
+
+    def __init__(self, api_url: str, workdir: str, batch_concurrency: int) -> None:
+        self.port = _free_port()
+        self.base = f"http://127.0.0.1:{self.port}"
+        self.env = dict(
+            os.environ,
+            API_KEY="bench",
+            API_URL=api_url,
+            MODEL_NAME="mock-vl",
+            MM_TRUSTBENCH_DB=os.path.join(workdir, f"api_c{batch_concurrency}.db"),
+            MM_TRUSTBENCH_RATELIMIT_DB="memory",
+            BATCH_CONCURRENCY=str(batch_concurrency),
+            REQUEST_TIMEOUT_SEC=os.getenv("REQUEST_TIMEOUT_SEC") or str(BENCH_REQUEST_TIMEOUT_SEC),
+        )
+        self.env.pop("MM_TRUSTBENCH_TEST", None)
+        self.env.pop("MM_TRUSTBENCH_CACHE", None)
+        # 服务日志写到临时目录，不刷屏；起不来时看它
+        self.log_path = os.path.join(workdir, f"api_c{batch_concurrency}.log")
+        self._proc = None
+
+    def __enter__(self) -> "ApiServer":
+        with open(self.log_path, "wb") as log:
+            self._proc = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "src.api:app", "--port", str(self.port), "--log-level", "warning"],
+                cwd=_ROOT, env=self.env, stdout=log, stderr=subprocess.STDOUT,
+            )
+        deadline = time.time() + 30
+        while True:
+            try:
+                if httpx.get(f"{self.base}/ping", timeout=1).status_code == 200:
+                    return self
+            except httpx.HTTPError:
+                pass
+            if self._proc.poll() is not None or time.time() > deadline:
+                with open(self.log_path, "r", encoding="utf-8", errors="replace") as f:
+                    raise RuntimeError("API 子进程没起来:\n" + f.read()[-2000:])
+            time.sleep(0.1)
+
+    def __exit__(self, *exc) -> None:
+        self._proc.terminate()
+        try:
+            self._proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+
+
+def _b64(path: str) -> str:
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("ascii")
+
+
+async def _bench_evaluate(base: str, payloads: list[dict], level: int) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    sem = asyncio.Semaphore(level)
+    limits = httpx.Limits(max_connections=level, max_keepalive_connections=level)
+
+    async with httpx.AsyncClient(base_url=base, timeout=None, limits=limits) as client:
+        async def one(payload: dict) -> None:
+            nonlocal errors
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    resp = await client.post("/api/v1/evaluate", json=payload)
+                    ok = resp.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - t0)
+                errors += not ok
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(p) for p in payloads))
+        wall = time.perf_counter() - t0
+    return summarize(latencies, wall, len(payloads), errors)
+
+
+async def _bench_batch(base: str, payloads: list[dict]) -> dict:
+    async with httpx.AsyncClient(base_url=base, timeout=None) as client:
+        submitted = datetime.utcnow()
+        t0 = time.perf_counter()
+        resp = await client.post("/api/v1/evaluate/batch", json={"items": payloads})
+        resp.raise_for_status()
+        task_id = resp.json()["task_id"]
+        since, latencies = 0, []
+        while True:
+            status = (await client.get(f"/api/v1/task/{task_id}", params={"since": since})).json()
+            for r in status["records"]:
+                latencies.append((datetime.fromisoformat(r["created_at"]) - submitted).total_seconds())
+            since = status["next_since"]
+            if status["status"] != "processing":
+                break
+            await asyncio.sleep(BATCH_POLL_SEC)
+        wall = time.perf_counter() - t0
+    return summarize(latencies, wall, len(payloads), status.get("failed_items") or 0)
+
+
+def bench_api(target: str, api_url: str, images: list[str], level: int, workdir: str) -> dict:
+    payloads = [{"question": q, "image_base64": _b64(p)} for p, q in zip(images, _questions(len(images)))]
+    # batch 的并发在服务端（BATCH_CONCURRENCY），evaluate 的在客户端
+    with ApiServer(api_url, workdir, batch_concurrency=level) as api:
+        if target == "evaluate":
+            return asyncio.run(_bench_evaluate(api.base, payloads, level))
+        return asyncio.run(_bench_batch(api.base, payloads))
+
+
+#======对比======
+def compare(current: dict, previous: dict) -> None:
+    """
+    和上次的结果并排打印 items/s 与 p95 的变化。
+    """
+    print(f"\n对比 {previous.get('started_at', '?')}:")
+    print(f"{'target':<10}{'c':>5}{'items/s':>12}{'before':>10}{'Δ':>9}{'p95 ms':>10}{'before':>10}")
+    for target, levels in current["results"].items():
+        for level, row in levels.items():
+            old = (previous.get("results") or {}).get(target, {}).get(level)
+            if not old:
+                continue
+            ratio = row["items_per_sec"] / old["items_per_sec"] - 1 if old["items_per_sec"] else 0.0
+            p95, old_p95 = row["p95_ms"], old["p95_ms"]
+            print(f"{target:<10}{level:>5}{row['items_per_sec']:>12.2f}{old['items_per_sec']:>10.2f}{ratio:>+9.1%}"
+                  f"{(p95 or 0):>10.1f}{(old_p95 or 0):>10.1f}")
+
+
+#======入口======
+def main(argv: list | None = None) -> dict:
+    parser = argparse.ArgumentParser(description="对着本地模拟接口压 main / evaluate / batch 的端到端吞吐")
+    parser.add_argument("--targets", default=",".join(TARGETS), help=f"逗号分隔，可选 {','.join(TARGETS)}")
+    parser.add_argument("--concurrency", default=DEFAULT_LEVELS, help="逗号分隔的并发档位")
+    parser.add_argument("--n", type=int, default=100, help="每档跑多少条")
+    parser.add_argument("--image-kb", type=int, default=32, help="每张图多大（KB）")
+    parser.add_argument("--json", default=None, help=f"结果 JSON 路径，默认 {RESULTS_DIR}/throughput-时间戳.json")
+    parser.add_argument("--compare", default=None, help="上次的结果 JSON，打印对比")
+    add_mock_args(parser)
+    args = parser.parse_args(argv)
+
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    unknown = [t for t in targets if t not in TARGETS]
+    if unknown:
+        parser.error(f"未知 target: {', '.join(unknown)}")
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    os.environ.setdefault("REQUEST_TIMEOUT_SEC", str(BENCH_REQUEST_TIMEOUT_SEC))
+    os.environ["MM_TRUSTBENCH_RATELIMIT_DB"] = "memory"
+
+    conf = mock_conf(args)
+    results: dict = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "n": args.n,
+        "image_kb": args.image_kb,
+        "concurrency": levels,
+        "mock": conf,
+        "results": {},
+    }
+    print(f"每档 {args.n} 条，图片 {args.image_kb} KB，模拟延迟中位数 {args.latency_ms:.0f} ms")
+    print(f"{'target':<10}{'c':>5}{'items/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}  upstream")
+    with tempfile.TemporaryDirectory(prefix="mm_bench_") as workdir, MockServer(conf) as mock:
+        images = _make_images(workdir, args.n, args.image_kb)
+        for target in targets:
+            for level in levels:
+                before = mock.stats()
+                if target == "main":
+                    row = bench_main(mock.url, images, level, workdir)
+                else:
+                    row = bench_api(target, mock.url, images, level, workdir)
+                row["upstream"] = _delta(mock.stats(), before)
+                results["results"].setdefault(target, {})[str(level)] = row
+                up = row["upstream"]
+                print(f"{target:<10}{level:>5}{row['items_per_sec']:>10.2f}{(row['p50_ms'] or 0):>10.1f}"
+                      f"{(row['p95_ms'] or 0):>10.1f}{(row['p99_ms'] or 0):>10.1f}{row['errors']:>8}  "
+                      f"{up['requests']} req / {up['429']}×429 / {up['5xx']}×5xx / {up['timeout']}×hang")
+
+    path = args.json or os.path.join(RESULTS_DIR, f"throughput-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写: {path}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+本地模拟的 OpenAI 兼容视觉接口：POST /v1/chat/completions，回复带 Evidence / Self-check / Answer 三段，
+形状与 ModelWrapper 期望的一致（非流式 choices[0].message.content + usage；流式 SSE 的 delta，[DONE] 结束）。
+延迟、429 / 5xx / 卡死比例、流式分块节奏都可配，用来在不花钱、不受配额限制的情况下压吞吐。
+
+用法（项目根目录）：
+    python benchmarks/mock_server.py --port 8900 --latency-ms 800 --rate-429 0.02 --rate-5xx 0.01
+    # 然后 .env 里 API_URL=http://127.0.0.1:8900/v1/chat/completions，API_KEY 随便填
+"""
+import re
+import math
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+import threading
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+#======配置区======
+DEFAULTS = {
+    # 整段回复生成耗时：对数正态，中位数 latency_ms，sigma 越大长尾越长（0.5 时 p99 约为中位数的 3 倍）
+    "latency_ms": 800.0,
+    "latency_sigma": 0.5,
+    # 每 KB 图片额外的处理耗时，模拟大图更慢
+    "ms_per_image_kb": 0.0,
+    # 注入的故障比例（按请求掷骰）：429 带 Retry-After；5xx 回 503；timeout 卡住 hang_sec 秒再回 504
+    "rate_429": 0.0,
+    "rate_5xx": 0.0,
+    "rate_timeout": 0.0,
+    "retry_after_sec": 1.0,
+    "hang_sec": 120.0,
+    # 答案分布：yes 的比例、拒答（Unsupported）的比例
+    "yes_ratio": 0.5,
+    "refuse_ratio": 0.05,
+    # 流式：首块在整段耗时的 ttft_ratio 处到达，之后每块 chunk_chars 个字符，均匀摊完剩下的时间
+    "ttft_ratio": 0.3,
+    "chunk_chars": 16,
+    # 流式请求没带 stream_options.include_usage 时也在最后一块带 usage
+    "stream_usage": False,
+    "seed": None,
+}
+# 低 detail 图片按固定 token 计（OpenAI 口径），文本按 4 字符一个 token 粗估
+IMAGE_TOKENS = 85
+CHARS_PER_TOKEN = 4
+
+_OBJECT_RE = re.compile(r"is there (?:a |an )?(.+?) in the (?:image|picture)", re.IGNORECASE)
+_QUESTION_RE = re.compile(r"Question:\s*(.+?)\n", re.DOTALL)
+_SCENES = ["a kitchen", "a busy street", "a living room", "a park", "an office", "a beach", "a snowy slope"]
+
+
+#======回复生成======
+def _question_of(prompt: str) -> str:
+    m = _QUESTION_RE.search(prompt)
+    return (m.group(1) if m else prompt).strip()
+
+
+def build_reply(prompt: str, image_key: str, conf: dict) -> str:
+    """
+    按问题和图片生成一段三段式回复；同一 (图片, 问题) 总是同一个答案，重跑时结果稳定。
+    prompt 里要求「只答 yes/no」时按 yes_no 出，否则出开放题的短答案。
+    """
+    question = _question_of(prompt)
+    digest = hashlib.sha1((image_key + "\0" + question).encode("utf-8")).digest()
+    roll = int.from_bytes(digest[:4], "big") / 2**32
+    scene = _SCENES[digest[4] % len(_SCENES)]
+    m = _OBJECT_RE.search(question)
+    obj = m.group(1).strip().lower() if m else "object"
+    yes_no = "yes, no, or Unsupported" in prompt
+    if roll < conf["refuse_ratio"]:
+        evidence = f"The image shows {scene}, but it is blurry and small details are hard to make out."
+        self_check = "Unsupported. The evidence is not clear enough to answer."
+        answer = "Unsupported"
+    elif roll < conf["refuse_ratio"] + (1 - conf["refuse_ratio"]) * conf["yes_ratio"]:
+        evidence = f"The image shows {scene}. A {obj} is clearly visible near the center of the frame."
+        self_check = "The evidence directly supports the answer."
+        answer = "yes" if yes_no else f"a {obj} in {scene}"
+    else:
+        evidence = f"The image shows {scene}. I do not see any {obj} anywhere in the picture."
+        self_check = "The evidence supports the answer; nothing resembling a " + obj + " is present."
+        answer = "no" if yes_no else "none"
+    return f"1) Evidence: {evidence}\n2) Self-check: {self_check}\n3) Answer: {answer}"
+
+
+def _usage(prompt: str, reply: str, n_images: int) -> dict:
+    prompt_tokens = math.ceil(len(prompt) / CHARS_PER_TOKEN) + IMAGE_TOKENS * n_images
+    completion_tokens = math.ceil(len(reply) / CHARS_PER_TOKEN)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+
+def _split_message(body: dict) -> tuple[str, str, int]:
+    """
+    从 messages 里取出文本 prompt、图片（data URL 或链接）和图片大小（KB）。
+    """
+    text, image = "", ""
+    for msg in body.get("messages") or []:
+        content = msg.get("content")
+        if isinstance(content, str):
+            text += content
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                text += part.get("text", "")
+            elif part.get("type") == "image_url":
+                image = (part.get("image_url") or {}).get("url", "")
+    return text, image, len(image) // 1024
+
+
+#======服务======
+def create_app(**overrides) -> FastAPI:
+    """
+    建模拟服务。参数见 DEFAULTS；GET /stats 返回各类结果的请求计数，压测脚本用它核对注入的故障数。
+    """
+    conf = dict(DEFAULTS, **{k: v for k, v in overrides.items() if v is not None})
+    rnd = random.Random(conf["seed"])
+    lock = threading.Lock()
+    counts = {"requests": 0, "ok": 0, "stream": 0, "429": 0, "5xx": 0, "timeout": 0}
+    app = FastAPI(title="MM-TrustBench mock vision API")
+    app.state.conf = conf
+
+    def bump(key: str) -> None:
+        with lock:
+            counts[key] += 1
+
+    def draw() -> tuple[str, float]:
+        # 掷骰决定这次的结果与耗时；random.Random 不是线程安全的，加锁
+        with lock:
+            r = rnd.random()
+            latency = conf["latency_ms"] * math.exp(conf["latency_sigma"] * rnd.gauss(0.0, 1.0)) / 1000
+        if r < conf["rate_429"]:
+            return "429", 0.0
+        r -= conf["rate_429"]
+        if r < conf["rate_5xx"]:
+            return "5xx", 0.0
+        r -= conf["rate_5xx"]
+        if r < conf["rate_timeout"]:
+            return "timeout", 0.0
+        return "ok", latency
+
+    @app.get("/stats")
+    def stats():
+        with lock:
+            return dict(counts)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        bump("requests")
+        outcome, latency = draw()
+        if outcome == "429":
+            bump("429")
+            return JSONResponse(
+                {"error": {"message": "rate limit exceeded", "type": "rate_limit"}},
+                status_code=429, headers={"Retry-After": str(conf["retry_after_sec"])},
+            )
+        if outcome == "5xx":
+            bump("5xx")
+            return JSONResponse({"error": {"message": "upstream overloaded"}}, status_code=503)
+        if outcome == "timeout":
+            bump("timeout")
+            await asyncio.sleep(conf["hang_sec"])
+            return JSONResponse({"error": {"message": "gateway timeout"}}, status_code=504)
+
+        prompt, image, image_kb = _split_message(body)
+        latency += conf["ms_per_image_kb"] * image_kb / 1000
+        reply = build_reply(prompt, image[-64:], conf)
+        usage = _usage(prompt, reply, 1 if image else 0)
+        model = body.get("model") or "mock-vl"
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            bump("ok")
+            return {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        with_usage = conf["stream_usage"] or bool((body.get("stream_options") or {}).get("include_usage"))
+        step = max(1, int(conf["chunk_chars"]))
+        chunks = [reply[i:i + step] for i in range(0, len(reply), step)]
+        ttft = latency * conf["ttft_ratio"]
+        interval = (latency - ttft) / max(1, len(chunks) - 1)
+
+        def sse(payload: dict) -> str:
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        async def events():
+            await asyncio.sleep(ttft)
+            for i, piece in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(interval)
+                yield sse({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                           "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+            if with_usage:
+                yield sse({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model, "choices": [], "usage": usage})
+            yield "data: [DONE]\n\n"
+            bump("ok")
+
+        bump("stream")
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+#======命令行入口======
+def add_mock_args(parser: argparse.ArgumentParser) -> None:
+    """
+    模拟服务的可调参数，压测脚本复用同一套。
+    """
+    g = parser.add_argument_group("模拟服务")
+    g.add_argument("--latency-ms", type=float, default=DEFAULTS["latency_ms"], help="回复耗时中位数（毫秒）")
+    g.add_argument("--latency-sigma", type=float, default=DEFAULTS["latency_sigma"], help="对数正态的 sigma，控制长尾")
+    g.add_argument("--ms-per-image-kb", type=float, default=DEFAULTS["ms_per_image_kb"], help="每 KB 图片额外耗时（毫秒）")
+    g.add_argument("--rate-429", type=float, default=DEFAULTS["rate_429"], help="回 429 的比例")
+    g.add_argument("--rate-5xx", type=float, default=DEFAULTS["rate_5xx"], help="回 503 的比例")
+    g.add_argument("--rate-timeout", type=float, default=DEFAULTS["rate_timeout"], help="卡住不回的比例")
+    g.add_argument("--hang-sec", type=float, default=DEFAULTS["hang_sec"], help="卡住多久后回 504")
+    g.add_argument("--retry-after", type=float, default=DEFAULTS["retry_after_sec"], help="429 的 Retry-After 秒数")
+    g.add_argument("--yes-ratio", type=float, default=DEFAULTS["yes_ratio"])
+    g.add_argument("--refuse-ratio", type=float, default=DEFAULTS["refuse_ratio"])
+    g.add_argument("--ttft-ratio", type=float, default=DEFAULTS["ttft_ratio"], help="流式首块到达时刻占整段耗时的比例")
+    g.add_argument("--chunk-chars", type=int, default=DEFAULTS["chunk_chars"], help="流式每块字符数")
+    g.add_argument("--stream-usage", action="store_true", help="流式总在最后一块带 usage")
+    g.add_argument("--seed", type=int, default=None)
+
+
+def mock_conf(args: argparse.Namespace) -> dict:
+    return {
+        "latency_ms": args.latency_ms,
+        "latency_sigma": args.latency_sigma,
+        "ms_per_image_kb": args.ms_per_image_kb,
+        "rate_429": args.rate_429,
+        "rate_5xx": args.rate_5xx,
+        "rate_timeout": args.rate_timeout,
+        "hang_sec": args.hang_sec,
+        "retry_after_sec": args.retry_after,
+        "yes_ratio": args.yes_ratio,
+        "refuse_ratio": args.refuse_ratio,
+        "ttft_ratio": args.ttft_ratio,
+        "chunk_chars": args.chunk_chars,
+        "stream_usage": args.stream_usage,
+        "seed": args.seed,
+    }
+
+
+def main(argv: list | None = None) -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI 兼容视觉接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_mock_args(parser)
+    args = parser.parse_args(argv)
+    print(f"API_URL=http://{args.host}:{args.port}/v1/chat/completions")
+    uvicorn.run(create_app(**mock_conf(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+解析器压测/对拍用的语料：合成的「证据-自检」格式回复 + data/ 下真实结果文件里的 model_answer。
+另外保留了改写前的解析实现（reference_*），只作对照：测试里逐条对拍，压测里算加速比。
+
+用法（项目根目录）：
+    python benchmarks/parser_corpus.py --n 20000 --output /tmp/parser_corpus.jsonl
+"""
+import os
+import re
+import sys
+import json
+import random
+import argparse
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+from src.trust_pipeline import EVIDENCE_HEAD, SELF_CHECK_HEAD, ANSWER_HEAD
+
+REAL_FILES = [
+    os.path.join(_ROOT, "data", "prediction_results.jsonl"),
+    os.path.join(_ROOT, "data", "prediction_baseline.jsonl"),
+]
+
+_OBJECTS = ["cat", "dog", "person", "car", "traffic light", "dining table", "bicycle", "umbrella", "bottle", "chair"]
+_SCENES = ["a kitchen", "a busy street", "a snowy slope", "a living room", "a park", "a beach", "an office"]
+_ANSWERS = ["yes", "no", "Yes", "NO", "Yes.", "no,", "Unsupported", "unsupported", "maybe", "", "3", "two people"]
+_FREE_TEXT = [
+    "Yes, there is a {o} in the image.",
+    "No, there is no {o} in the image.",
+    "There are several {o}s near the window.",
+    "I cannot determine whether a {o} is present; the image is unclear.",
+    "The {o} appears to be partially hidden behind {s}.",
+    "A {o} is visible in the image, next to {s}.",
+    "There isn't any {o} here, only {s}.",
+    "Not visible. The picture shows {s}.",
+    "Nope, nothing like that.",
+    "Error",
+]
+
+
+def _case(rnd: random.Random, head: str) -> str:
+    # 标题大小写混用，模型经常这么写
+    return rnd.choice([head, head.lower(), head.upper(), head.title()])
+
+
+def _sentence(rnd: random.Random) -> str:
+    o = rnd.choice(_OBJECTS)
+    s = rnd.choice(_SCENES)
+    return rnd.choice([
+        f"The image shows {s} with a {o} in the foreground.",
+        f"I can see {s}; no {o} is visible.",
+        f"There is a {o} on the left side.",
+        f"Objects: {o}, {rnd.choice(_OBJECTS)}.",
+        f"The {o} appears to be red (see item 2).",
+    ])
+
+
+def synth_response(rnd: random.Random) -> str:
+    """
+    造一条「证据-自检」格式的回复：段序、编号、空行、标题大小写、缺段、重复段都随机。
+    """
+    if rnd.random() < 0.1:
+        o = rnd.choice(_OBJECTS)
+        return rnd.choice(_FREE_TEXT).format(o=o, s=rnd.choice(_SCENES))
+    numbered = rnd.random() < 0.5
+    sep = rnd.choice(["\n", "\n\n", " ", "\n \n"])
+    parts = []
+    sections = ["ev", "sc", "ans"]
+    if rnd.random() < 0.15:
+        rnd.shuffle(sections)
+    if rnd.random() < 0.15:
+        sections.remove(rnd.choice(sections))
+    if rnd.random() < 0.1:
+        sections.append(rnd.choice(["ev", "sc", "ans"]))
+    for i, sec in enumerate(sections, 1):
+        prefix = f"{i}) " if numbered else ""
+        if sec == "ev":
+            body = " ".join(_sentence(rnd) for _ in range(rnd.randint(0, 6)))
+            parts.append(prefix + _case(rnd, EVIDENCE_HEAD) + rnd.choice([" ", "", "\n"]) + body)
+        elif sec == "sc":
+            body = rnd.choice(["All claims are supported by the image.", "Unsupported: the object is not clearly seen.",
+                               "The evidence supports the answer.", ""])
+            parts.append(prefix + _case(rnd, SELF_CHECK_HEAD) + rnd.choice([" ", "", "\n"]) + body)
+        else:
+            ans = rnd.choice(_ANSWERS)
+            tail = rnd.choice(["", "\n\nNote: based on the visible region.", "\nextra line"])
+            parts.append(prefix + _case(rnd, ANSWER_HEAD) + rnd.choice([" ", "", "\n", "  "]) + ans + tail)
+    text = sep.join(parts)
+    if numbered and rnd.random() < 0.2:
+        # 段尾残留下一段编号
+        text += f"\n{len(sections) + 1})"
+    if rnd.random() < 0.1:
+        text = "  \n" + text + "\n "
+    return text
+
+
+def synth_corpus(n: int, seed: int = 0) -> list[str]:
+    rnd = random.Random(seed)
+    return [synth_response(rnd) for _ in range(n)]
+
+
+def load_real(paths: list[str] | None = None) -> list[str]:
+    """
+    从已有结果文件里取 model_answer；文件不存在就跳过。
+    """
+    out = []
+    for path in paths or REAL_FILES:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                ans = json.loads(line).get("model_answer")
+                if isinstance(ans, str):
+                    out.append(ans)
+    return out
+
+
+def build_corpus(n: int = 10000, seed: int = 0, real: bool = True) -> list[str]:
+    """
+    合成 n 条 + 真实回复全部；真实回复条数少，不做重复放大。
+    """
+    corpus = synth_corpus(n, seed)
+    if real:
+        corpus.extend(load_real())
+    return corpus
+
+
+#======改写前的实现，仅作对照======
+def reference_parse_response(raw: str, answer_type: str = "yes_no") -> dict:
+    evidence = ""
+    self_check = ""
+    answer = "refused"
+
+    if not raw or raw.strip() == "Error":
+        return {"answer": "refused", "evidence": evidence, "self_check": self_check, "raw": raw or ""}
+
+    text = raw.strip()
+    ev_pat = re.escape(EVIDENCE_HEAD) + r"\s*(.*?)(?=" + re.escape(SELF_CHECK_HEAD) + r"|$)"
+    ev_match = re.search(ev_pat, text, re.DOTALL | re.IGNORECASE)
+    if ev_match:
+        evidence = ev_match.group(1).strip()
+        evidence = re.sub(r"\n+\s*\d+\)\s*$", "", evidence)
+    sc_pat = re.escape(SELF_CHECK_HEAD) + r"\s*(.*?)(?=" + re.escape(ANSWER_HEAD) + r"\s*|$)"
+    sc_match = re.search(sc_pat, text, re.DOTALL | re.IGNORECASE)
+    if sc_match:
+        self_check = sc_match.group(1).strip()
+        self_check = re.sub(r"\n+\s*\d+\)\s*$", "", self_check)
+
+    if answer_type == "open":
+        ans_pat = re.escape(ANSWER_HEAD) + r"\s*(.+?)(?=\n\n|$)"
+        ans_match = re.search(ans_pat, text, re.DOTALL | re.IGNORECASE)
+        if ans_match:
+            a = ans_match.group(1).strip()
+            if re.search(r"\bunsupported\b", a, re.IGNORECASE):
+                answer = "refused"
+            else:
+                answer = a.split("\n")[0].strip() or "refused"
+        return {"answer": answer, "evidence": evidence, "self_check": self_check, "raw": raw}
+
+    ans_pat = re.escape(ANSWER_HEAD) + r"\s*(\w+)"
+    ans_match = re.search(ans_pat, text, re.IGNORECASE)
+    if ans_match:
+        a = ans_match.group(1).strip().lower()
+        if a == "yes":
+            answer = "yes"
+        elif a == "no":
+            answer = "no"
+    if answer not in ("yes", "no"):
+        answer = "refused"
+    elif "unsupported" in self_check.lower():
+        answer = "refused"
+    return {"answer": answer, "evidence": evidence, "self_check": self_check, "raw": raw}
+
+
+def reference_extract_yes_no(text: str) -> str:
+    if not text or text.strip() == "Error":
+        return "unknown"
+    text_lower = text.strip().lower()
+    if re.search(r"\byes\b", text_lower):
+        return "yes"
+    if re.search(r"\bno\b", text_lower):
+        return "no"
+    if re.search(r"cannot determine|cannot tell|unclear|I cannot (see|tell|determine)", text_lower):
+        return "unknown"
+    if re.search(r"there is no|there are no|no \w+ (visible|in the image)|not visible|cannot see|isn't (a |any )|aren't (any )?", text_lower):
+        return "no"
+    if re.search(r"there (is|are) (a |an |one |some |two |several )?\w+", text_lower):
+        return "yes"
+    if re.search(r"appears to be (a |an )?\w+|visible in the image|(is|are) visible", text_lower):
+        return "yes"
+    return "unknown"
+
+
+def main(argv: list | None = None) -> None:
+    parser = argparse.ArgumentParser(description="生成解析器压测语料")
+    parser.add_argument("--n", type=int, default=10000, help="合成条数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-real", action="store_true", help="不混入 data/ 下的真实回复")
+    parser.add_argument("--output", required=True, help="输出 jsonl，每行 {\"raw\": ...}")
+    args = parser.parse_args(argv)
+    corpus = build_corpus(args.n, args.seed, real=not args.no_real)
+    with open(args.output, "w", encoding="utf-8") as f:
+        for raw in corpus:
+            f.write(json.dumps({"raw": raw}, ensure_ascii=False) + "\n")
+    print(f"写出 {len(corpus)} 条 -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
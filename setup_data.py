@@ -1,12 +1,25 @@
 import os
+import sys
 import json
 import time
+import random
+import shutil
+import hashlib
+import tarfile
+import zipfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from urllib.request import url2pathname
 import requests
+from requests.adapters import HTTPAdapter
 
 #======配置区======
 #POPE是一个COCO的子数据集，存储着对应COCO图片的题库，用于大模型幻觉测试
-#这里用的国内镜像站
-POPE_JSON_URL = "https://raw.githubusercontent.com/RUCAIBox/POPE/main/output/coco/coco_pope_random.json"
+#三个 split 问法一样，区别在负样本（答案为 no 的物体）怎么挑：random 随机、popular 高频物体、adversarial 常共现物体
+POPE_BASE_URL = "https://raw.githubusercontent.com/RUCAIBox/POPE/main/output/coco/"
+POPE_SPLITS = ("random", "popular", "adversarial")
+POPE_FILE = "coco_pope_{split}.json"
 
 #COCO图片官方图床，分图片库与官方标注文件，每张图都会带一个数据标注
 #比如"Image_001": ["person", "car", "dog"]  // 官方认证：这张图里有这些东西
@@ -22,6 +35,20 @@ ANNO_DIR = os.path.join(DATA_DIR,"annotations")     #存标注
 #JSONL 的全称是 JSON Lines（按行分布的 JSON）。没有 [ 和 ]，没有行尾逗号。每一行都是一个独立的、合法的 JSON 对象。
 OUTPUT_JSONL = os.path.join(ANNO_DIR,"mini_pope.jsonl")
 
+#默认每个 split 取多少题；0 表示全要（每个 split 3000 题、500 张图）
+DEFAULT_LIMIT = 50
+#并发下载数，连接池大小跟着它走
+DOWNLOAD_WORKERS = 16
+#每次从网络 / 压缩包读多少字节写盘，太小了系统调用次数爆炸
+CHUNK_SIZE = 256 * 1024
+#单个文件的下载重试次数（不含首次）与超时秒数
+DOWNLOAD_RETRIES = 3
+REQUEST_TIMEOUT = 60
+#这些状态码视为临时故障，值得重试；其余直接算失败
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+#图片校验和清单（sha256sum 格式）的文件名，默认放在图片目录下；有记录的图下载后对一遍，没记录的下完补上
+CHECKSUM_NAME = "SHA256SUMS"
+
 
 
 #======工具函数区======
@@ -33,113 +60,385 @@ def ensure_dir(path):
         os.makedirs(path)
         print(f"Created directory:{path}")
 
-def download_file(url,save_path):
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _copy_stream(src, save_path):
     """
-    通用下载函数。
-    相当于封装了一个简单的 HttpClient。
+    把一个可读流按 CHUNK_SIZE 写到 save_path：先写 .part 再改名，下到一半断掉不会留下半张图被当成已下载。
     """
-    # 1. 断点续传简化版：如果文件有了，就不下了
-    if os.path.exists(save_path):
-        print(f"File allready exsists:{save_path}")
-        return True
-    
-    try:
-        # 2. 发起请求
-        # stream=True 是关键！表示像水管一样一点点流数据，而不是把整个水库(文件)倒进内存
-        response = requests.get(url,stream=True)
-        # 检查 HTTP 状态码
-        if response.status_code == 200:
-            # 'wb' = Write Binary (二进制写入)，图片必须要用这个模式
-            # with open(...) 是上下文管理器，打开文件，代码块结束自动关闭文件
-            with open(save_path,'wb')as f:
-                # 每次只下载 1KB (1024 字节)，避免内存溢出
-                for chunk in response.iter_content(chunk_size=1024):
-                    if chunk:
-                        f.write(chunk)
-            print(f"Downloaded:{save_path}")
-            return True
+    tmp_path = save_path + ".part"
+    with open(tmp_path, "wb") as f:
+        shutil.copyfileobj(src, f, CHUNK_SIZE)
+    os.replace(tmp_path, save_path)
+
+
+class TruncatedDownload(IOError):
+    """
+    下到的字节数和 Content-Length 对不上，连接中途断了，值得重试。
+    """
+
+
+#======数据源======
+# 同一套接口取文件：fetch(name, save_path) 取一个，fetch_many 批量取（默认线程池并发）。
+# 官方图床 / 镜像站走 HTTP；本地镜像目录或 file:// 直接拷；tar / zip 包只扫一遍解出要的文件，离线和 CI 都能用。
+class Source:
+    def __init__(self, location):
+        self.location = location
+
+    def fetch(self, name, save_path):
+        raise NotImplementedError
+
+    def fetch_many(self, names, dest_dir, workers=DOWNLOAD_WORKERS):
+        """
+        批量取，返回 {name: 失败原因}，成功的不在里面。
+        """
+        def one(name):
+            try:
+                self.fetch(name, os.path.join(dest_dir, name))
+                return name, None
+            except Exception as e:
+                return name, str(e) or type(e).__name__
+
+        failed = {}
+        done = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for name, err in pool.map(one, names):
+                done += 1
+                if err:
+                    failed[name] = err
+                    print(f"Failed: {name}: {err}")
+                if done % 100 == 0 or done == len(names):
+                    print(f"[{done}/{len(names)}] fetched from {self.location}")
+        return failed
+
+    def close(self):
+        pass
+
+
+class HttpSource(Source):
+    """
+    HTTP(S) 基地址。整个下载共用一个 keep-alive 会话（连接池 = 并发数），不再每张图重新握手；
+    429 / 5xx / 超时按指数退避重试，校验 Content-Length，防止截断的图混进来。
+    """
+
+    def __init__(self, base_url, workers=DOWNLOAD_WORKERS):
+        super().__init__(base_url)
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, workers), max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, name, save_path):
+        url = self.base_url + name
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            try:
+                # stream=True 是关键！表示像水管一样一点点流数据，而不是把整个水库(文件)倒进内存
+                with self.session.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                    status = response.status_code
+                    if status == 200:
+                        self._save(response, save_path)
+                        return
+            except (requests.Timeout, requests.ConnectionError, requests.exceptions.ChunkedEncodingError, TruncatedDownload):
+                if attempt >= DOWNLOAD_RETRIES:
+                    raise
+            else:
+                if status not in RETRY_STATUS or attempt >= DOWNLOAD_RETRIES:
+                    raise IOError(f"HTTP {status}")
+            # full jitter 指数退避，并发下载时别一起撞上去
+            time.sleep(random.uniform(0, min(10.0, 0.5 * 2 ** attempt)))
+
+    @staticmethod
+    def _save(response, save_path):
+        tmp_path = save_path + ".part"
+        # iter_content 会按 Content-Encoding 解压；块大一点，大图也就几十次写盘
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+        except Exception:
+            # 中途断流：半截文件不留，重试时重新下
+            os.remove(tmp_path)
+            raise
+        expected = response.headers.get("Content-Length")
+        size = os.path.getsize(tmp_path)
+        if expected and not response.headers.get("Content-Encoding") and size != int(expected):
+            os.remove(tmp_path)
+            raise TruncatedDownload(f"expected {expected} bytes, got {size}")
+        os.replace(tmp_path, save_path)
+
+    def close(self):
+        self.session.close()
+
+
+class DirSource(Source):
+    """
+    本地镜像目录（file:// 地址也落到这里）。名字找不到时再到 val2014/ 子目录找一次，直接放 COCO 原始目录结构也行。
+    """
+
+    def fetch(self, name, save_path):
+        for candidate in (os.path.join(self.location, name), os.path.join(self.location, "val2014", name)):
+            if os.path.isfile(candidate):
+                with open(candidate, "rb") as src:
+                    _copy_stream(src, save_path)
+                return
+        raise FileNotFoundError(f"{name} not in {self.location}")
+
+
+class ArchiveSource(Source):
+    """
+    tar(.gz/.bz2/.xz) 或 zip 包，按文件名（不管包里的目录层级）取。
+    压缩 tar 不能随机读，fetch_many 顺序扫一遍包，遇到要的就解出来，不会一张图解压一次整个包。
+    """
+
+    def fetch(self, name, save_path):
+        failed = self.fetch_many([name], os.path.dirname(save_path) or ".")
+        if failed:
+            raise FileNotFoundError(failed[name])
+
+    def fetch_many(self, names, dest_dir, workers=DOWNLOAD_WORKERS):
+        wanted = set(names)
+        done = 0
+        if zipfile.is_zipfile(self.location):
+            with zipfile.ZipFile(self.location) as zf:
+                for info in zf.infolist():
+                    base = os.path.basename(info.filename)
+                    if base in wanted and not info.is_dir():
+                        with zf.open(info) as src:
+                            _copy_stream(src, os.path.join(dest_dir, base))
+                        wanted.discard(base)
+                        done += 1
         else:
-            print(f"Failed to download.Status code:{response.status_code}")
-            return False
-    except Exception as e:
-        #捕获所有异常
-        print(f"Error downloading {url}:{e}")
-        return False
-    
+            with tarfile.open(self.location, "r:*") as tf:
+                for member in tf:
+                    base = os.path.basename(member.name)
+                    if base in wanted and member.isfile():
+                        with tf.extractfile(member) as src:
+                            _copy_stream(src, os.path.join(dest_dir, base))
+                        wanted.discard(base)
+                        done += 1
+                    if not wanted:
+                        break
+        print(f"Extracted {done} files from {self.location}")
+        return {name: f"not in {self.location}" for name in wanted}
+
+
+def make_source(location, workers=DOWNLOAD_WORKERS):
+    """
+    按写法认数据源：http(s):// 地址、file:// 地址、本地目录、tar / zip 包。
+    """
+    scheme = urlparse(location).scheme
+    if scheme in ("http", "https"):
+        return HttpSource(location, workers=workers)
+    if scheme == "file":
+        location = url2pathname(urlparse(location).path)
+    if os.path.isdir(location):
+        return DirSource(location)
+    if os.path.isfile(location) and (zipfile.is_zipfile(location) or tarfile.is_tarfile(location)):
+        return ArchiveSource(location)
+    raise ValueError(f"认不出的数据源（要 http(s)/file:// 地址、目录或 tar/zip 包）: {location}")
+
+
+#======校验和======
+def load_checksums(path):
+    """
+    读 sha256sum 格式的清单（每行 "<sha256>  <文件名>"），返回 {文件名: sha256}。没有文件返回空。
+    """
+    sums = {}
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.strip().split(None, 1)
+                if len(parts) == 2:
+                    sums[parts[1].lstrip("*")] = parts[0].lower()
+    return sums
+
+
+def save_checksums(path, sums):
+    ensure_dir(os.path.dirname(path) or ".")
+    with open(path, "w", encoding="utf-8") as f:
+        for name in sorted(sums):
+            f.write(f"{sums[name]}  {name}\n")
+
+
+def verify_images(names, img_dir, sums, recheck=False):
+    """
+    核对已在本地的图：清单里有记录的，recheck 时重算 sha256，对不上就删掉等重下；没记录的算一遍补进清单。
+    返回对不上被删掉的文件名。
+    """
+    bad = []
+    for name in names:
+        path = os.path.join(img_dir, name)
+        if not os.path.exists(path):
+            continue
+        if name in sums and not recheck:
+            continue
+        digest = sha256_file(path)
+        if name in sums and sums[name] != digest:
+            print(f"Checksum mismatch, removed: {name}")
+            os.remove(path)
+            bad.append(name)
+        else:
+            sums[name] = digest
+    return bad
+
+
+#======题库======
+def load_pope_split(split, source, anno_dir=ANNO_DIR):
+    """
+    取一个 split 的 POPE 题库（本地已有就不再取），返回题目 list，每题补上 split 字段。
+    """
+    file_name = POPE_FILE.format(split=split)
+    raw_json_path = os.path.join(anno_dir, file_name)
+    if not os.path.exists(raw_json_path):
+        source.fetch(file_name, raw_json_path)
+    items = []
+    with open(raw_json_path, 'r', encoding='utf-8') as f:
+        # pope 官方数据集不是一个大json对象，实际上它是以json为尾缀的jsonl，不能读一整个
+        for line in f:
+            if line.strip(): # strip是清洗函数，去除首尾空格，防止读到空行报错
+                item = json.loads(line)
+                item["split"] = split
+                items.append(item)
+    return items
+
+
+def sample_items(items, n, mode="head", seed=0):
+    """
+    从一个 split 里挑 n 题（n <= 0 或不少于总数时全要）。
+    head 取前 n 题（原来的行为）；random 随机抽；stratified 按标准答案（yes/no）分层按比例抽，小样本也不会偏到一边。
+    抽出来的题按原顺序排，同样的 seed 结果固定。
+    """
+    if n <= 0 or n >= len(items):
+        return list(items)
+    if mode == "head":
+        return items[:n]
+    rnd = random.Random(seed)
+    if mode == "random":
+        picked = rnd.sample(range(len(items)), n)
+    elif mode == "stratified":
+        groups = {}
+        for i, item in enumerate(items):
+            groups.setdefault(str(item.get("label", "")).strip().lower(), []).append(i)
+        # 最大余数法分名额，总数正好是 n
+        quotas = {k: n * len(v) / len(items) for k, v in groups.items()}
+        alloc = {k: int(q) for k, q in quotas.items()}
+        for k in sorted(quotas, key=lambda k: quotas[k] - alloc[k], reverse=True)[: n - sum(alloc.values())]:
+            alloc[k] += 1
+        picked = [i for k in sorted(groups) for i in rnd.sample(groups[k], alloc[k])]
+    else:
+        raise ValueError(f"未知抽样方式: {mode}")
+    return [items[i] for i in sorted(picked)]
+
+
 # ======主逻辑区======
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="下载 POPE 题库与 COCO 图片，生成评测用的 jsonl")
+    parser.add_argument("--splits", default="random", help=f"逗号分隔的 split（{','.join(POPE_SPLITS)}），all 为全部")
+    parser.add_argument("--n", type=int, default=DEFAULT_LIMIT, help="每个 split 取多少题，0 为全部")
+    parser.add_argument("--sample", default="head", choices=["head", "random", "stratified"], help="怎么挑题")
+    parser.add_argument("--seed", type=int, default=0, help="random / stratified 抽样的随机种子")
+    parser.add_argument("--workers", type=int, default=DOWNLOAD_WORKERS, help="并发下载数")
+    parser.add_argument("--pope-source", default=POPE_BASE_URL, help="POPE 题库来源：基地址、file:// 地址、目录或 tar/zip 包")
+    parser.add_argument("--image-source", default=COCO_IMAGE_BASE_URL, help="COCO 图片来源：基地址、file:// 地址、目录或 tar/zip 包")
+    parser.add_argument("--checksums", default=None, help=f"sha256sum 格式的图片校验和清单，下载后核对并补全（默认 <img-dir>/{CHECKSUM_NAME}）")
+    parser.add_argument("--verify", action="store_true", help="本地已有的图也重算 sha256 与清单核对")
+    parser.add_argument("--output", default=OUTPUT_JSONL, help="生成的题库 jsonl")
+    parser.add_argument("--img-dir", default=IMG_DIR, help="图片存放目录")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    splits = list(POPE_SPLITS) if args.splits.strip() == "all" else [s.strip() for s in args.splits.split(",") if s.strip()]
+    unknown = [s for s in splits if s not in POPE_SPLITS]
+    if unknown or not splits:
+        print(f"Error: 未知 split: {', '.join(unknown) or '(空)'}，可选: {', '.join(POPE_SPLITS)}")
+        return 1
+    t0 = time.perf_counter()
+
     # 1. 准备目录
-    # 调用工具函数，先把 data/images 和 data/annotations 建好
-    ensure_dir(IMG_DIR)
-    ensure_dir(ANNO_DIR)
-
-    # 2. 下载 POPE 原始考卷 (JSON) (题库)
-    raw_json_path = os.path.join(ANNO_DIR, "pope_raw.json")
-    print(">>> Step 1: Downloading POPE metadata...")
-    
-    # 下载，若失败，报错
-    if not download_file(POPE_JSON_URL, raw_json_path):
-        print("Error: 无法下载 JSON，请检查网络")
-        return
-
-    # 3. 读取并解析 图片标注JSON (只取原始考卷的前 50 条)
-    print(">>> Step 2: Parsing data...")
+    ensure_dir(args.img_dir)
+    ensure_dir(os.path.dirname(args.output) or ".")
+    anno_dir = os.path.dirname(args.output) or "."
+
+    # 2. 取 POPE 题库（题目），按 split 抽样
+    print(">>> Step 1: Loading POPE metadata...")
+    pope_source = make_source(args.pope_source)
+    selected = []
     try:
-        with open(raw_json_path, 'r', encoding='utf-8') as f:
-            # data_list = json.load(f)      //我以为pope官方数据集是一个大json对象，实际上它是以json为尾缀的jsonl，不能读一整个
-            data_list = []
-            for line in f:
-                if line.strip(): # strip是清洗函数，去除首尾空格，防止读到空行报错
-                    data_list.append(json.loads(line))
+        for split in splits:
+            items = load_pope_split(split, pope_source, anno_dir)
+            picked = sample_items(items, args.n, args.sample, args.seed)
+            print(f"{split}: {len(picked)}/{len(items)} items ({args.sample})")
+            selected.extend(picked)
     except Exception as e:
-        print(f"Error reading JSON: {e}")
-        return
-    
-    # [Python 特性] 切片操作:50
-    # 只取前 50 个考题
-    mini_data = data_list[:50]
-    print(f"Loaded {len(mini_data)} items from POPE.")
-
-    # 4. 循环下载每道题对应的图片
-    print("\n>>> Step 3: Downloading images...")
-    
-    valid_items = [] # 用来存那些成功下载了图片的数据
-    
-    # [Python 特性] enumerate
-    # 同时拿到 索引(i) 和 元素(item)，省得写 int i=0; i++
-    for i, item in enumerate(mini_data):
-        image_name = item['image'] # 读取标注json对象(考题)的图片名
-        
-        # 拼下载链接 (去 COCO 官网找图)
-        img_url = COCO_IMAGE_BASE_URL + image_name
-        # 拼本地保存路径
-        save_path = os.path.join(IMG_DIR, image_name)
-        
-        print(f"[{i+1}/50] Processing: {image_name}")
-        
-        # 调用工具函数下载
-        if download_file(img_url, save_path):
-            # 关键点：把本地路径记录进考题，方便后面给大模型看
-            item['local_path'] = save_path
-            valid_items.append(item)
-        
-        # 礼貌性延时，防止请求太快被封 IP
-        time.sleep(0.2)
-
-    # 5. 生成最终的“50题试卷” (mini_pope.jsonl)
-    print(f"\n>>> Step 4: Saving mini dataset to {OUTPUT_JSONL}...")
-    with open(OUTPUT_JSONL, 'w', encoding='utf-8') as f:
-        for item in valid_items:
-            # json.dumps 把json标注转成字符串，所有行的字符串组成jsonl文件
+        print(f"Error: 无法获取 POPE 题库，请检查网络或 --pope-source: {e}")
+        return 1
+    finally:
+        pope_source.close()
+    # 各 split 的 question_id 都从 1 起，多个 split 混在一起时加上 split 前缀，断点续传的 key 才不会撞
+    if len(splits) > 1:
+        for item in selected:
+            item["pope_question_id"] = item.get("question_id")
+            item["question_id"] = f"{item['split']}-{item.get('question_id')}"
+
+    # 3. 下图：同一张图被多道题引用时只下一次；已在本地且校验通过的跳过
+    print("\n>>> Step 2: Fetching images...")
+    names = sorted({item['image'] for item in selected})
+    checksums = args.checksums or os.path.join(args.img_dir, CHECKSUM_NAME)
+    sums = load_checksums(checksums)
+    known = set(sums)
+    verify_images(names, args.img_dir, sums, recheck=args.verify)
+    todo = [name for name in names if not os.path.exists(os.path.join(args.img_dir, name))]
+    print(f"{len(names)} unique images, {len(names) - len(todo)} already present, {len(todo)} to fetch")
+    failed = {}
+    if todo:
+        image_source = make_source(args.image_source, workers=args.workers)
+        try:
+            failed = image_source.fetch_many(todo, args.img_dir, workers=args.workers)
+        finally:
+            image_source.close()
+        # 新取到的图：清单里有记录的必须对得上，没记录的记下来
+        for name in todo:
+            if name in failed:
+                continue
+            path = os.path.join(args.img_dir, name)
+            digest = sha256_file(path)
+            if name in known and sums[name] != digest:
+                os.remove(path)
+                failed[name] = "checksum mismatch"
+                print(f"Checksum mismatch, removed: {name}")
+            else:
+                sums[name] = digest
+    save_checksums(checksums, sums)
+
+    # 4. 生成最终题库，只留图片到手的题；local_path 记进去，方便后面给大模型看
+    print(f"\n>>> Step 3: Saving dataset to {args.output}...")
+    written = 0
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for item in selected:
+            if item['image'] in failed:
+                continue
+            item['local_path'] = os.path.join(args.img_dir, item['image'])
             # ensure_ascii=False 保证如果有中文不乱码
             f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            written += 1
 
-    print("\n Data preparation complete!")
-    print(f"Images: {IMG_DIR}")
-    print(f"Annotations: {OUTPUT_JSONL}")
+    print(f"\n Data preparation complete in {time.perf_counter() - t0:.1f}s!")
+    print(f"Items: {written} ({len(selected) - written} dropped, {len(failed)} images failed)")
+    print(f"Images: {args.img_dir}")
+    print(f"Annotations: {args.output}")
+    return 0 if not failed else 1
 
 # [Python 特性] 程序入口保护
 # 只有直接运行这个脚本时，才会执行 main()
-# 相当于 Java 的 public static void main
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
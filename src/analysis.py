@@ -1,7 +1,11 @@
 import os
 import re
+import gzip
 import json
 import sys
+import argparse
+import math
+from typing import Iterator
 
 # 保证从项目根或 src 下执行都能找到模块
 _src_dir = os.path.dirname(os.path.abspath(__file__))
@@ -14,19 +18,52 @@ _PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 PREDICTION_JSONL = os.path.join(_PROJECT_ROOT, "data", "prediction_results.jsonl")
 # 阅卷明细写这里，方便开 Excel 或 jsonl 人肉挑错
 ANALYSIS_JSONL = os.path.join(_PROJECT_ROOT, "data", "analysis_results.jsonl")
+# main 每行带的分阶段统计里，出分位数的耗时项
+LATENCY_FIELDS = ("encode_sec", "upstream_sec", "parse_sec")
+PERCENTILES = (50, 90, 99)
+# 耗时分位数用对数分桶直方图估：相邻桶边界之比，取桶的几何中点时相对误差不超过约 1%
+LATENCY_BUCKET_RATIO = 1.02
 
 
 #======工具函数======
+def open_text(path: str, mode: str = "r"):
+    """
+    按扩展名打开文本文件：.gz 走 gzip，其余普通打开，统一 utf-8。
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def iter_jsonl(paths) -> Iterator[dict]:
+    """
+    逐行产出一个或多个 jsonl（可 .gz）里的 json，不整体读进内存。
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    for path in paths:
+        with open_text(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
 def load_jsonl(path: str) -> list:
     """
     读 jsonl，每行一个 json，返回 list。
     """
-    rows = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.strip():
-                rows.append(json.loads(line))
-    return rows
+    return list(iter_jsonl(path))
+
+
+# 阅卷正则预编译；输入已转小写，不必再开 IGNORECASE
+_YES_NO_RE = re.compile(r"\b(?:(yes)|no)\b")
+_UNCERTAIN_RE = re.compile(r"cannot determine|cannot tell|unclear")
+_NEGATIVE_RE = re.compile(
+    r"there is no|there are no|no \w+ (?:visible|in the image)|not visible|cannot see|isn't (?:a |any )|aren't (?:any )?"
+)
+_POSITIVE_RE = re.compile(
+    r"there (?:is|are) (?:a |an |one |some |two |several )?\w+|appears to be (?:a |an )?\w+|visible in the image|(?:is|are) visible"
+)
 
 
 def extract_yes_no(text: str) -> str:
@@ -37,21 +74,22 @@ def extract_yes_no(text: str) -> str:
     if not text or text.strip() == "Error":
         return "unknown"
     text_lower = text.strip().lower()
-    # 1. 显式 yes/no 优先
-    if re.search(r"\byes\b", text_lower):
-        return "yes"
-    if re.search(r"\bno\b", text_lower):
+    # 1. 显式 yes/no 优先：一遍扫描，见到 yes 立即返回，只见过 no 则判 no
+    seen_no = False
+    for m in _YES_NO_RE.finditer(text_lower):
+        if m.group(1):
+            return "yes"
+        seen_no = True
+    if seen_no:
         return "no"
     # 2. 模型明确说不确定，不强行判 yes/no
-    if re.search(r"cannot determine|cannot tell|unclear|I cannot (see|tell|determine)", text_lower):
+    if _UNCERTAIN_RE.search(text_lower):
         return "unknown"
     # 3. 明确否定表述：没看见、没有、不可见
-    if re.search(r"there is no|there are no|no \w+ (visible|in the image)|not visible|cannot see|isn't (a |any )|aren't (any )?", text_lower):
+    if _NEGATIVE_RE.search(text_lower):
         return "no"
     # 4. 肯定表述：有、可见、appears to be
-    if re.search(r"there (is|are) (a |an |one |some |two |several )?\w+", text_lower):
-        return "yes"
-    if re.search(r"appears to be (a |an )?\w+|visible in the image|(is|are) visible", text_lower):
+    if _POSITIVE_RE.search(text_lower):
         return "yes"
     return "unknown"
 
@@ -71,88 +109,338 @@ def normalize_label(val: str) -> str:
 
 
 #======阅卷与指标======
-def run_analysis() -> None:
-    if not os.path.exists(PREDICTION_JSONL):
-        print(f"Error: 找不到 {PREDICTION_JSONL}，请先跑 main.py 生成预测结果")
-        return
-
-    rows = load_jsonl(PREDICTION_JSONL)
-    total = len(rows)
-    if total == 0:
-        print("Error: 预测结果为空")
-        return
-
-    # 标准答案字段：POPE 用 answer
-    label_key = "answer" if "answer" in rows[0] else "label"
-
-    correct = 0
-    fp = 0  # 标准 no，模型 yes —— 幻觉
-    fn = 0  # 标准 yes，模型 no —— 漏检
-    unknown_count = 0  # 洗不出 yes/no，算错但不归入 FP/FN
-    label_no_count = 0  # 标准答案为 no 的题数，用于算幻觉率
-
-    detail_rows = []
-
-    for row in rows:
-        gt_raw = row.get(label_key, "")
-        gt = normalize_label(gt_raw)
-        raw_answer = row.get("model_answer", "")
-        # main 若走了 TrustPipeline 会写 final_answer（yes/no/refused），直接用；否则从 model_answer 洗
-        if "final_answer" in row:
-            fa = row["final_answer"]
-            pred = "unknown" if fa == "refused" else fa
+def score_row(row: dict) -> dict:
+    """
+    给一行预测打分，返回明细行：原题 + 清洗结果 + 是否对、是否幻觉、是否漏检，方便人肉挑典型。
+    """
+    # 标准答案字段：POPE 用 answer，有的导出是 label
+    label_key = "answer" if "answer" in row else "label"
+    gt = normalize_label(row.get(label_key, ""))
+    # main 若走了 TrustPipeline 会写 final_answer（yes/no/refused），直接用；否则从 model_answer 洗
+    if "final_answer" in row:
+        fa = row["final_answer"]
+        pred = "unknown" if fa == "refused" else fa
+    else:
+        pred = extract_yes_no(row.get("model_answer", ""))
+    return {
+        **row,
+        "extracted_pred": pred,
+        "correct": (pred != "unknown" and pred == gt),
+        "is_fp": (gt == "no" and pred == "yes"),
+        "is_fn": (gt == "yes" and pred == "no"),
+    }
+
+
+class SummaryCounter:
+    """
+    指标计数器，逐行 update，不留任何行在内存里，多大的文件都是常数内存。
+    """
+
+    def __init__(self) -> None:
+        self.total = 0
+        self.correct = 0
+        self.fp = 0  # 标准 no，模型 yes —— 幻觉
+        self.fn = 0  # 标准 yes，模型 no —— 漏检
+        self.unknown = 0  # 洗不出 yes/no，算错但不归入 FP/FN
+        self.label_no = 0  # 标准答案为 no 的题数，用于算幻觉率
+
+    def update(self, detail: dict) -> None:
+        self.total += 1
+        if detail["correct"]:
+            self.correct += 1
+        elif detail["extracted_pred"] == "unknown":
+            self.unknown += 1
+        label_key = "answer" if "answer" in detail else "label"
+        if normalize_label(detail.get(label_key, "")) == "no":
+            self.label_no += 1
+        if detail["is_fp"]:
+            self.fp += 1
+        if detail["is_fn"]:
+            self.fn += 1
+
+    @property
+    def accuracy(self) -> float:
+        return self.correct / self.total if self.total else 0
+
+    @property
+    def hallucination_rate(self) -> float:
+        return self.fp / self.label_no if self.label_no else 0
+
+    def as_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "correct": self.correct,
+            "accuracy": self.accuracy,
+            "fp": self.fp,
+            "fn": self.fn,
+            "unknown": self.unknown,
+            "label_no": self.label_no,
+            "hallucination_rate": self.hallucination_rate,
+        }
+
+
+#======耗时与用量======
+def percentile(sorted_vals, q: float) -> float | None:
+    """
+    已排序序列的第 q 百分位（线性插值，与 numpy 默认口径一致）；空序列为 None。
+    """
+    n = len(sorted_vals)
+    if not n:
+        return None
+    pos = (n - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, n - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (pos - lo)
+
+
+class LatencyHistogram:
+    """
+    固定对数分桶的耗时直方图：每个值只给所在桶计数，内存只和取值跨度有关（微秒到小时也就一千来个桶），与行数无关。
+    分位数按 percentile 的线性插值口径取相邻两个排位，排位上的值用桶的几何中点近似，再夹到实测的 min / max 之间。
+    """
+
+    __slots__ = ("n", "total", "min", "max", "zeros", "buckets")
+
+    _LOG_RATIO = math.log(LATENCY_BUCKET_RATIO)
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.zeros = 0
+        self.buckets: dict[int, int] = {}
+
+    def add(self, v: float) -> None:
+        self.n += 1
+        self.total += v
+        self.min = min(self.min, v)
+        self.max = max(self.max, v)
+        if v <= 0:
+            self.zeros += 1
+            return
+        i = math.floor(math.log(v) / self._LOG_RATIO)
+        self.buckets[i] = self.buckets.get(i, 0) + 1
+
+    def _value_at(self, rank: int) -> float:
+        if rank < self.zeros:
+            v = 0.0
         else:
-            pred = extract_yes_no(raw_answer)
-
-        is_correct = (pred != "unknown" and pred == gt)
-        if is_correct:
-            correct += 1
-        elif pred == "unknown":
-            unknown_count += 1
-
-        if gt == "no":
-            label_no_count += 1
-            if pred == "yes":
-                fp += 1
-        elif gt == "yes":
-            if pred == "no":
-                fn += 1
-
-        # 明细行：原题 + 清洗结果 + 是否对、是否幻觉、是否漏检，方便人肉挑典型
-        detail = {
-            **row,
-            "extracted_pred": pred,
-            "correct": is_correct,
-            "is_fp": (gt == "no" and pred == "yes"),
-            "is_fn": (gt == "yes" and pred == "no"),
+            seen = self.zeros
+            for i in sorted(self.buckets):
+                seen += self.buckets[i]
+                if rank < seen:
+                    v = math.exp((i + 0.5) * self._LOG_RATIO)
+                    break
+        return min(self.max, max(self.min, v))
+
+    def percentile(self, q: float) -> float | None:
+        if not self.n:
+            return None
+        pos = (self.n - 1) * q / 100
+        lo = int(pos)
+        lo_v = self._value_at(lo)
+        if pos == lo:
+            return lo_v
+        return lo_v + (self._value_at(min(lo + 1, self.n - 1)) - lo_v) * (pos - lo)
+
+    def as_dict(self) -> dict:
+        return {
+            "n": self.n,
+            "mean": self.total / self.n if self.n else None,
+            **{f"p{q}": self.percentile(q) for q in PERCENTILES},
+        }
+
+
+class _UsageGroup:
+    __slots__ = ("items", "latency", "token_items", "prompt_tokens", "completion_tokens", "bytes_items", "request_bytes")
+
+    def __init__(self) -> None:
+        self.items = 0
+        self.latency = {f: LatencyHistogram() for f in LATENCY_FIELDS}
+        self.token_items = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.bytes_items = 0
+        self.request_bytes = 0
+
+    def update(self, row: dict) -> None:
+        self.items += 1
+        for f in LATENCY_FIELDS:
+            v = row.get(f)
+            if v is not None:
+                self.latency[f].add(v)
+        if row.get("prompt_tokens") is not None or row.get("completion_tokens") is not None:
+            self.token_items += 1
+            self.prompt_tokens += row.get("prompt_tokens") or 0
+            self.completion_tokens += row.get("completion_tokens") or 0
+        if row.get("request_bytes") is not None:
+            self.bytes_items += 1
+            self.request_bytes += row["request_bytes"]
+
+    def as_dict(self) -> dict:
+        latency = {f: hist.as_dict() for f, hist in self.latency.items()}
+
+        def per(total: int, n: int):
+            return total / n if n else None
+
+        return {
+            "items": self.items,
+            "latency": latency,
+            "prompt_tokens_per_item": per(self.prompt_tokens, self.token_items),
+            "completion_tokens_per_item": per(self.completion_tokens, self.token_items),
+            "tokens_per_item": per(self.prompt_tokens + self.completion_tokens, self.token_items),
+            "request_bytes_per_item": per(self.request_bytes, self.bytes_items),
         }
-        detail_rows.append(detail)
 
-    # 指标
-    accuracy = correct / total if total else 0
-    hallucination_rate = fp / label_no_count if label_no_count else 0
+
+class UsageCounter:
+    """
+    按 (模型, prompt 变体) 汇总各阶段耗时分位数与每条 token 数。只收带了分阶段统计的行（旧结果文件没有就全跳过）；
+    每组每个耗时项一个对数分桶直方图（见 LatencyHistogram），分位数相对误差约 1%，内存与行数无关。
+    """
+
+    def __init__(self) -> None:
+        self.overall = _UsageGroup()
+        self.groups: dict[str, _UsageGroup] = {}
+
+    @staticmethod
+    def group_label(row: dict) -> str:
+        model = row.get("model") or row.get("model_name") or row.get("model_id") or "-"
+        return f"{model} / {row.get('prompt_variant') or '-'}"
+
+    def update(self, row: dict) -> None:
+        if not any(row.get(f) is not None for f in LATENCY_FIELDS + ("request_bytes", "prompt_tokens", "completion_tokens")):
+            return
+        self.overall.update(row)
+        label = self.group_label(row)
+        group = self.groups.get(label)
+        if group is None:
+            group = self.groups[label] = _UsageGroup()
+        group.update(row)
+
+    def as_dict(self) -> dict | None:
+        if not self.overall.items:
+            return None
+        return {"overall": self.overall.as_dict(), "by": {k: g.as_dict() for k, g in self.groups.items()}}
+
+
+def format_usage_table(usage: dict, limit: int = 30) -> str:
+    """
+    耗时与用量表：每组上游耗时 p50/p90/p99、编码与解析 p50、每条 token 数，按条数从多到少。
+    """
+    head = (
+        f"{'model / prompt_variant':<32} {'n':>7} {'up p50':>8} {'up p90':>8} {'up p99':>8} "
+        f"{'enc p50':>8} {'parse p50':>10} {'tok/item':>9} {'KB/item':>8}"
+    )
+    lines = [head, "-" * len(head)]
+
+    def num(v, width: int, scale: float = 1.0, digits: int = 3) -> str:
+        return f"{v * scale:>{width}.{digits}f}" if v is not None else f"{'-':>{width}}"
+
+    rows = [("(overall)", usage["overall"])] + sorted(usage["by"].items(), key=lambda kv: -kv[1]["items"])[:limit]
+    for label, r in rows:
+        lat = r["latency"]
+        up, enc, parse = lat["upstream_sec"], lat["encode_sec"], lat["parse_sec"]
+        lines.append(
+            f"{str(label)[:32]:<32} {r['items']:>7} {num(up['p50'], 8)} {num(up['p90'], 8)} {num(up['p99'], 8)} "
+            f"{num(enc['p50'], 8)} {num(parse['p50'], 8, 1000, 2)}ms "
+            f"{num(r['tokens_per_item'], 9, digits=1)} {num(r['request_bytes_per_item'], 8, 1 / 1024, 1)}"
+        )
+    return "\n".join(lines)
+
+
+def run_analysis(
+    inputs: list | None = None,
+    output: str = ANALYSIS_JSONL,
+    charts: bool = True,
+    group_by: list | None = None,
+    bootstrap: int = 0,
+    metrics_json: str | None = None,
+) -> dict | None:
+    """
+    单遍流式阅卷：逐行读预测（可多个文件、可 .gz）→ 打分 → 立刻写明细 → 累加计数，内存占用与文件大小无关。
+    group_by / bootstrap 任一给了就顺带收集编码数组，交给 metrics.py 做分组指标与 bootstrap 置信区间（需要 NumPy）。
+    结果行带分阶段统计时，另按 (模型, prompt 变体) 汇总耗时分位数与每条 token 数，放在 "usage" 键下。
+    返回汇总指标 dict（有分组指标时在 "metrics" 键下）；输入缺失或为空返回 None。
+    """
+    inputs = inputs or [PREDICTION_JSONL]
+    missing = [p for p in inputs if not os.path.exists(p)]
+    if missing:
+        print(f"Error: 找不到 {', '.join(missing)}，请先跑 main.py 生成预测结果")
+        return None
+
+    counter = SummaryCounter()
+    usage = UsageCounter()
+    collector = None
+    if group_by or bootstrap:
+        try:
+            from .metrics import MetricsCollector
+        except ImportError:
+            from metrics import MetricsCollector
+        collector = MetricsCollector(group_by or ())
+    # 明细边算边写 jsonl，方便开 Excel 或直接翻着找典型反例
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open_text(output, "w") as f:
+        for path in inputs:
+            for row in iter_jsonl(path):
+                detail = score_row(row)
+                counter.update(detail)
+                usage.update(row)
+                if collector is not None:
+                    collector.add(row, source=path)
+                f.write(json.dumps(detail, ensure_ascii=False) + "\n")
+
+    if counter.total == 0:
+        print("Error: 预测结果为空")
+        return None
 
     # 打印
     print("========== 阅卷结果 ==========")
-    print(f"总题数: {total}")
-    print(f"正确: {correct}  准确率 (Accuracy): {accuracy:.2%}")
-    print(f"幻觉 (FP, 标准 no 却说 yes): {fp}  幻觉率: {hallucination_rate:.2%} (FP / 标准答案为 no 的题数)")
-    print(f"漏检 (FN, 标准 yes 却说 no): {fn}")
-    print(f"无法判定 (unknown): {unknown_count}  （模型未给出明确 yes/no，算错题）")
+    print(f"总题数: {counter.total}")
+    print(f"正确: {counter.correct}  准确率 (Accuracy): {counter.accuracy:.2%}")
+    print(f"幻觉 (FP, 标准 no 却说 yes): {counter.fp}  幻觉率: {counter.hallucination_rate:.2%} (FP / 标准答案为 no 的题数)")
+    print(f"漏检 (FN, 标准 yes 却说 no): {counter.fn}")
+    print(f"无法判定 (unknown): {counter.unknown}  （模型未给出明确 yes/no，算错题）")
     print("==============================")
-
-    # 明细写 jsonl，方便开 Excel 或直接翻着找典型反例
-    os.makedirs(os.path.dirname(ANALYSIS_JSONL), exist_ok=True)
-    with open(ANALYSIS_JSONL, "w", encoding="utf-8") as f:
-        for d in detail_rows:
-            f.write(json.dumps(d, ensure_ascii=False) + "\n")
-    print(f"\n明细已写: {ANALYSIS_JSONL}（可据此人肉挑 3～5 个典型错例，记下图文件名）")
+    print(f"\n明细已写: {output}（可据此人肉挑 3～5 个典型错例，记下图文件名）")
+    summary = counter.as_dict()
+
+    # 耗时与用量
+    usage_summary = usage.as_dict()
+    if usage_summary is not None:
+        summary["usage"] = usage_summary
+        print("\n========== 耗时与用量（秒；up=上游请求，enc=图片编码）==========")
+        print(format_usage_table(usage_summary))
+
+    # 分组指标 + 置信区间
+    if collector is not None:
+        try:
+            from .metrics import compute_metrics, format_table
+        except ImportError:
+            from metrics import compute_metrics, format_table
+        metrics = compute_metrics(collector, n_boot=bootstrap)
+        summary["metrics"] = metrics
+        overall = metrics["overall"]
+        if bootstrap:
+            ci = overall["hallucination_rate_ci"]
+            if None not in ci:
+                print(f"幻觉率 95% CI（bootstrap {bootstrap} 次）: [{ci[0]:.2%}, {ci[1]:.2%}]")
+        for dim, rows in metrics["by"].items():
+            print()
+            print(format_table(dim, rows))
+        if metrics_json:
+            with open(metrics_json, "w", encoding="utf-8") as mf:
+                json.dump(metrics, mf, ensure_ascii=False, indent=2)
+            print(f"\n分组指标已写: {metrics_json}")
 
     #画图
-    try:
-        _draw_charts(total, correct, fp, fn, label_no_count)
-    except ImportError:
-        pass
+    if charts:
+        try:
+            _draw_charts(counter.total, counter.correct, counter.fp, counter.fn, counter.label_no)
+        except ImportError:
+            pass
+    return summary
 
 
 def _draw_charts(total: int, correct: int, fp: int, fn: int, label_no_count: int) -> None:
@@ -216,5 +504,27 @@ def _draw_charts(total: int, correct: int, fp: int, fn: int, label_no_count: int
 
     print(f"图表已保存: {out_path}")
 
+def parse_args(argv: list | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="MM-TrustBench 阅卷与指标")
+    parser.add_argument("inputs", nargs="*", help=f"预测结果 jsonl，可多个、可 .gz（默认 {PREDICTION_JSONL}）")
+    parser.add_argument("--output", default=ANALYSIS_JSONL, help="明细输出路径，以 .gz 结尾则压缩写")
+    parser.add_argument("--no-charts", action="store_true", help="不画图")
+    parser.add_argument(
+        "--group-by", default="",
+        help="分组维度，逗号分隔：split,object,model,prompt_variant（需要 NumPy）",
+    )
+    parser.add_argument("--bootstrap", type=int, default=0, help="bootstrap 重抽次数，给出 95%% 置信区间，0 为不算")
+    parser.add_argument("--metrics-json", default=None, help="分组指标另存为 json")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    run_analysis()
+    _args = parse_args()
+    run_analysis(
+        _args.inputs or None,
+        output=_args.output,
+        charts=not _args.no_charts,
+        group_by=[g.strip() for g in _args.group_by.split(",") if g.strip()],
+        bootstrap=_args.bootstrap,
+        metrics_json=_args.metrics_json,
+    )
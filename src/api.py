@@ -1,8 +1,16 @@
+import os
+import json
+import base64
+import asyncio
 import logging
 import time
 import uuid
-from fastapi import FastAPI, HTTPException, Request, Query, BackgroundTasks
-from fastapi.responses import JSONResponse
+from functools import partial
+from datetime import datetime
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response, Query, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 from .schemas import (
     EvaluateRequest,
@@ -14,14 +22,25 @@ from .schemas import (
     BatchEvaluateResponse,
     TaskStatusResponse,
     TaskRecordItem,
+    TaskRecordsResponse,
     ModelsResponse,
     ModelItem,
+    CompareRequest,
+    CompareItem,
+    CompareResponse,
 )
-from .wrapper import ModelWrapper, get_available_wrappers
-from .trust_pipeline import TrustPipeline
-from sqlalchemy.orm import joinedload
-from .database import get_engine, SessionLocal, Base
-from .models import EvaluationTask, EvaluationRecord
+from .wrapper import aclose_async_client
+from .trust_pipeline import TrustPipeline, afan_out
+from .cache import default_image_cache
+from .batch_executor import BatchExecutor
+from sqlalchemy import text, func, case, literal, tuple_, DateTime
+from .database import SessionLocal, init_db
+from .models import EvaluationTask, EvaluationRecord, EvaluationJob
+from .persistence import create_writer
+from .task_events import TaskEventHub, TASK_EVENTS_HEARTBEAT_SEC
+from .job_queue import op_enqueue
+from .worker import JobRunner, load_pipelines
+from .telemetry import REGISTRY, CONTENT_TYPE, STAT_FIELDS, Gauge, MetricsMiddleware, round_stats
 
 #======日志======
 logger = logging.getLogger("mm_trustbench")
@@ -32,7 +51,22 @@ if not logger.handlers:
     logger.addHandler(h)
 
 #======应用入口======
-app = FastAPI(title="MM-TrustBench API", version="0.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    stop = asyncio.Event()
+    serving = asyncio.create_task(_job_runner.serve(stop)) if _batch_worker_mode == "inline" else None
+    yield
+    if serving is not None:
+        stop.set()
+        await serving
+    # 退出时关掉共享的异步 HTTP 连接池，写队列里剩下的全部落盘
+    await aclose_async_client()
+    await run_in_threadpool(_writer.close)
+
+
+app = FastAPI(title="MM-TrustBench API", version="0.1.0", lifespan=lifespan)
+# 每个请求的耗时与在飞数，按路由模板记，见 /metrics
+app.add_middleware(MetricsMiddleware)
 
 
 #======全局异常处理======
@@ -53,82 +87,116 @@ def general_exception_handler(request: Request, exc: Exception):
         content={"code": 500, "message": "服务器内部错误", "data": None},
     )
 
-# 启动时建表（库不存在则自动创建）
-Base.metadata.create_all(bind=get_engine())
+# 启动时建表（库不存在则自动创建），老库原地补齐新增的列和索引
+_schema_changes = init_db()
+if _schema_changes:
+    logger.info("数据库已升级: %s", "; ".join(_schema_changes))
 
+# 模型回复缓存（MM_TRUSTBENCH_CACHE）、上传前预处理（MM_TRUSTBENCH_PREPROCESS）与多模型流水线，和独立 worker 共用一套装配
 # 多模型：model_id -> pipeline，至少有一组才能跑
-_pipelines: dict[str, TrustPipeline] = {}
-for mid, wr in get_available_wrappers():
-    _pipelines[mid] = TrustPipeline(wr)
-if not _pipelines:
-    # 测试环境可能只有 API_KEY=test_key，仍建 default
-    try:
-        _pipelines["default"] = TrustPipeline(ModelWrapper())
-    except ValueError:
-        pass
+_pipelines, _cache, _preprocessor = load_pipelines()
 
 
 def _get_pipeline(model_id: str) -> TrustPipeline | None:
     return _pipelines.get(model_id or "default")
 
 
-def _run_batch_evaluate(task_id_uuid: str, items: list[dict], model_id: str = "default", answer_type: str = "yes_no") -> None:
+# 批量执行器：每个 model_id 一个并发上限（BATCH_CONCURRENCY / BATCH_CONCURRENCY_i），并发提交的任务轮流分名额
+_batch_executor = BatchExecutor()
+
+
+def _image_stored(image_path: str | None, image_base64: str | None) -> str:
     """
-    后台执行批量评测：按 task_id 找到 Task，逐条跑 pipeline 写 Record，最后更新 Task 状态与耗时。
+    Record 里不存整段 base64，只存路径或简短标识。
     """
-    pipeline = _get_pipeline(model_id)
-    if not pipeline:
-        logger.warning("batch 未找到 model_id=%s", model_id)
-        return
+    if image_base64:
+        return f"[base64, len={len(image_base64)}]"
+    return image_path or ""
+
+
+#======落库（写后队列）======
+# 所有写操作都丢给单写线程攒批提交，请求路径不等 fsync；下面的 _op_* 在写线程里带 session 调用
+_writer = create_writer(SessionLocal)
+# 写线程提交某任务的变更后，唤醒订阅了该任务事件流的连接
+_task_events = TaskEventHub()
+
+
+def _op_insert_single_result(db, question: str, image_stored: str, model_name: str | None, result: dict, elapsed: float) -> None:
+    """
+    单条评测：一主一从，先写 Task，再写 Record。
+    """
+    task = EvaluationTask(
+        task_id=str(uuid.uuid4()),
+        status="completed",
+        model_name=model_name,
+        total_duration_sec=round(elapsed, 3),
+        total_items=1,
+        done_items=1,
+        failed_items=0,
+        eta_sec=0,
+    )
+    db.add(task)
+    db.flush()
+    db.add(EvaluationRecord(
+        task_id=task.id,
+        question=question,
+        image_base64=image_stored,
+        final_answer=result["answer"],
+        evidence=result.get("evidence", ""),
+        self_check=result.get("self_check", ""),
+        **round_stats(result.get("stats")),
+    ))
+
+
+def _op_insert_task(db, task_id_uuid: str, status: str, model_name: str | None, total_items: int | None = None) -> int:
+    task = EvaluationTask(
+        task_id=task_id_uuid, status=status, model_name=model_name,
+        total_items=total_items, done_items=0, failed_items=0,
+    )
+    db.add(task)
+    db.flush()
+    return task.id
+
+
+def _op_create_batch(db, task_id_uuid: str, model_name: str | None, model_id: str, answer_type: str, items: list[dict]) -> int:
+    """
+    批量任务：Task 和每条作业在同一个事务里落库，提交即持久，API 进程挂了作业也还在队列里。
+    """
+    task_pk = _op_insert_task(db, task_id_uuid, "processing", model_name, total_items=len(items))
+    op_enqueue(db, task_pk, items, model_id, answer_type)
+    return task_pk
+
+
+def _find_task_pk(task_id_uuid: str) -> int | None:
     db = SessionLocal()
     try:
         task = db.query(EvaluationTask).filter(EvaluationTask.task_id == task_id_uuid).first()
-        if not task:
-            logger.warning("batch task not found: %s", task_id_uuid)
-            return
-        t0 = time.perf_counter()
-        for i, it in enumerate(items):
-            try:
-                result = pipeline.process(
-                    image_path=it.get("image_path"),
-                    question=it.get("question", ""),
-                    image_base64=it.get("image_base64"),
-                    answer_type=answer_type,
-                )
-                if it.get("image_base64"):
-                    img_stored = f"[base64, len={len(it['image_base64'])}]"
-                else:
-                    img_stored = it.get("image_path") or ""
-                rec = EvaluationRecord(
-                    task_id=task.id,
-                    question=it.get("question", ""),
-                    image_base64=img_stored,
-                    final_answer=result["answer"],
-                    evidence=result.get("evidence", ""),
-                    self_check=result.get("self_check", ""),
-                )
-                db.add(rec)
-                db.commit()
-                logger.info("batch [%s] 第 %d/%d 条完成", task_id_uuid, i + 1, len(items))
-            except Exception as e:
-                logger.warning("batch 单条失败: %s", e)
-                db.rollback()
-        elapsed = time.perf_counter() - t0
-        task.status = "completed"
-        task.total_duration_sec = round(elapsed)
-        db.commit()
-        logger.info("batch 完成: task_id=%s, 共 %d 条, 耗时=%.2fs", task_id_uuid, len(items), elapsed)
-    except Exception as e:
-        logger.exception("batch 异常: %s", e)
-        if db:
-            task = db.query(EvaluationTask).filter(EvaluationTask.task_id == task_id_uuid).first()
-            if task:
-                task.status = "failed"
-                db.commit()
+        return task.id if task else None
     finally:
         db.close()
 
 
+#======批量作业执行======
+# MM_TRUSTBENCH_BATCH_WORKER=inline（默认）：本进程跑，提交后马上在后台把该任务的作业跑完，另常驻一个领取循环接手崩溃遗留的作业；
+# =external：本进程只入队，由 python -m src.worker 起的独立 worker（可多进程、多机共享同一个库）来跑
+_batch_worker_mode = (os.getenv("MM_TRUSTBENCH_BATCH_WORKER") or "inline").strip().lower()
+_job_runner = JobRunner(
+    _writer,
+    get_pipeline=lambda mid: _get_pipeline(mid),
+    executor=_batch_executor,
+    on_change=_task_events.notify,
+)
+
+
+async def _drain_batch(task_pk: int, task_id_uuid: str) -> None:
+    try:
+        await _job_runner.drain(task_pk)
+        logger.info("batch 完成: task_id=%s", task_id_uuid)
+    except Exception as e:
+        # 作业都还在库里，常驻领取循环或独立 worker 会接着跑
+        logger.exception("batch 异常: %s", e)
+
+
 #======探针======
 # 服务是否存活，运维/前端轮询用
 @app.get("/ping")
@@ -136,6 +204,63 @@ def ping():
     return {"status": "ok"}
 
 
+# 回复缓存、图片编码缓存命中统计，以及预处理省下的上传字节；没开的那项为 null
+@app.get("/api/v1/cache/stats")
+def cache_stats():
+    return {
+        "response_cache": _cache.stats if _cache is not None else None,
+        "image_cache": default_image_cache.stats,
+        "preprocess": _preprocessor.stats if _preprocessor is not None else None,
+    }
+
+
+# 各模型的限速与熔断状态：剩余令牌（负数即排队中）、连续失败次数、是否熔断中
+@app.get("/api/v1/ratelimit/stats")
+def ratelimit_stats():
+    out = {}
+    for mid, p in _pipelines.items():
+        lim = getattr(p.wrapper, "rate_limiter", None)
+        if lim is None:
+            continue
+        out[mid] = {"key": lim.key, "rpm": lim.rate * 60 if lim.rate else None, **lim.state()}
+    return out
+
+
+#======Prometheus 指标======
+# 队列长度这类现成的数在抓取时现算，不在热路径上维护
+BATCH_BACKLOG = Gauge("mm_trustbench_batch_backlog", "批量执行各模型在飞 / 排队的条数", ("model_id", "state"))
+BATCH_BACKLOG.set_function(lambda: {
+    (mid, state): n for mid, b in _batch_executor.backlog().items() for state, n in b.items()
+})
+JOBS = Gauge("mm_trustbench_jobs", "作业队列里排队中 / 执行中的作业数", ("status",))
+WRITER_PENDING = Gauge("mm_trustbench_db_writer_pending", "写后队列里还没提交的写操作数")
+WRITER_PENDING.set_function(lambda: {(): _writer.stats["pending"]})
+
+
+def _job_counts() -> dict:
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(EvaluationJob.status, func.count(EvaluationJob.id))
+            .filter(EvaluationJob.status.in_(("queued", "leased")))
+            .group_by(EvaluationJob.status)
+            .all()
+        )
+    finally:
+        db.close()
+    counts = {"queued": 0, "leased": 0, **dict(rows)}
+    return {(status,): n for status, n in counts.items()}
+
+
+JOBS.set_function(_job_counts)
+
+
+# Prometheus 文本格式：模型调用耗时 / 在飞数 / 请求与回复大小、解析耗时、答案分布、落库提交、HTTP 耗时、队列长度
+@app.get("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
 #======评测接口======
 @app.get("/api/v1/models", response_model=ModelsResponse)
 def list_models():
@@ -148,19 +273,12 @@ def list_models():
 
 
 @app.post("/api/v1/evaluate", response_model=EvaluateResponse)
-def evaluate(request: EvaluateRequest):
-    if not request.image_path and not request.image_base64:
-        raise HTTPException(status_code=400, detail="必须提供图片路径或Base64")
-    pipeline = _get_pipeline(request.model_id or "default")
-    if not pipeline:
-        raise HTTPException(status_code=400, detail=f"未知 model_id: {request.model_id}，请用 GET /api/v1/models 查看可用模型")
+async def evaluate(request: EvaluateRequest):
+    pipeline, answer_type = _resolve_evaluate(request)
     t0 = time.perf_counter()
     logger.info("evaluate 请求: question=%s, model_id=%s", request.question[:50] if request.question else "", request.model_id)
-    answer_type = (request.answer_type or "yes_no").strip().lower()
-    if answer_type not in ("yes_no", "open"):
-        answer_type = "yes_no"
     try:
-        result = pipeline.process(
+        result = await pipeline.aprocess(
             image_path=request.image_path,
             question=request.question,
             image_base64=request.image_base64,
@@ -173,41 +291,167 @@ def evaluate(request: EvaluateRequest):
             evidence=result.get("evidence", ""),
             self_check=result.get("self_check", ""),
         )
-        # 一主一从：先写 Task，再写 Record
-        if request.image_base64:
-            image_stored = f"[base64, len={len(request.image_base64)}]"
-        else:
-            image_stored = request.image_path or ""
-        db = SessionLocal()
-        try:
-            task = EvaluationTask(
-                task_id=str(uuid.uuid4()),
-                status="completed",
-                model_name=getattr(pipeline.wrapper, "model", None),
-                total_duration_sec=round(elapsed),
-            )
-            db.add(task)
-            db.flush()
-            record = EvaluationRecord(
-                task_id=task.id,
-                question=request.question,
-                image_base64=image_stored,
-                final_answer=result["answer"],
-                evidence=result.get("evidence", ""),
-                self_check=result.get("self_check", ""),
-            )
-            db.add(record)
-            db.commit()
-        finally:
-            db.close()
+        # 入队即返回，响应不等落盘
+        _submit_single_result(request, pipeline, result, elapsed)
         return resp
     except Exception as e:
         logger.warning("evaluate 失败: %s", e)
         raise HTTPException(status_code=500, detail="模型调用失败")
 
 
+def _resolve_evaluate(request: EvaluateRequest) -> tuple[TrustPipeline, str]:
+    """
+    单条评测的入参校验：图片必填、model_id 要存在，answer_type 不认识的按 yes_no。
+    """
+    if not request.image_path and not request.image_base64:
+        raise HTTPException(status_code=400, detail="必须提供图片路径或Base64")
+    pipeline = _get_pipeline(request.model_id or "default")
+    if not pipeline:
+        raise HTTPException(status_code=400, detail=f"未知 model_id: {request.model_id}，请用 GET /api/v1/models 查看可用模型")
+    answer_type = (request.answer_type or "yes_no").strip().lower()
+    if answer_type not in ("yes_no", "open"):
+        answer_type = "yes_no"
+    return pipeline, answer_type
+
+
+def _submit_single_result(request: EvaluateRequest, pipeline: TrustPipeline, result: dict, elapsed: float) -> None:
+    _writer.submit(partial(
+        _op_insert_single_result,
+        question=request.question,
+        image_stored=_image_stored(request.image_path, request.image_base64),
+        model_name=getattr(pipeline.wrapper, "model", None),
+        result=result,
+        elapsed=elapsed,
+    ))
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+#======流式评测（SSE）======
+# 边生成边推：delta 为模型新吐的文本，evidence / self_check / answer 为刚定稿的段，done 的 data 同 /api/v1/evaluate 响应体
+@app.post("/api/v1/evaluate/stream")
+async def evaluate_stream(
+    request: EvaluateRequest,
+    stop_at_answer: bool = Query(True, description="Answer 定稿后即断开上游，不等模型把后面生成完"),
+):
+    pipeline, answer_type = _resolve_evaluate(request)
+    logger.info("evaluate/stream 请求: question=%s, model_id=%s", request.question[:50] if request.question else "", request.model_id)
+
+    async def events():
+        t0 = time.perf_counter()
+        try:
+            async for event, data in pipeline.astream(
+                image_path=request.image_path,
+                question=request.question,
+                image_base64=request.image_base64,
+                answer_type=answer_type,
+                stop_at_answer=stop_at_answer,
+            ):
+                if event == "done":
+                    result = data
+                    body = EvaluateResponse(
+                        final_answer=result["answer"],
+                        evidence=result.get("evidence", ""),
+                        self_check=result.get("self_check", ""),
+                    ).model_dump()
+                elif event == "answer":
+                    body = {"final_answer": data}
+                else:
+                    body = {"text": data}
+                yield _sse(event, body)
+        except Exception as e:
+            logger.warning("evaluate/stream 失败: %s", e)
+            yield _sse("error", {"code": 500, "message": "模型调用失败", "data": None})
+            return
+        elapsed = time.perf_counter() - t0
+        logger.info("evaluate/stream 完成: answer=%s, 耗时=%.2fs", result.get("answer"), elapsed)
+        _submit_single_result(request, pipeline, result, elapsed)
+
+    # 关掉反向代理缓冲，否则事件会被攒着一起到
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+#======多模型对比======
+# 同一张图 + 问题并发发给多个模型，总耗时约等于最慢的那个；/compare/stream 谁先答完先推谁
+def _resolve_compare(request: CompareRequest) -> tuple[list[tuple[str, TrustPipeline]], str]:
+    if not request.image_path and not request.image_base64:
+        raise HTTPException(status_code=400, detail="必须提供图片路径或Base64")
+    model_ids = list(dict.fromkeys(request.model_ids)) if request.model_ids else list(_pipelines)
+    unknown = [mid for mid in model_ids if _get_pipeline(mid) is None]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"未知 model_id: {', '.join(unknown)}，请用 GET /api/v1/models 查看可用模型")
+    if not model_ids:
+        raise HTTPException(status_code=400, detail="没有可用模型")
+    answer_type = (request.answer_type or "yes_no").strip().lower()
+    if answer_type not in ("yes_no", "open"):
+        answer_type = "yes_no"
+    return [(mid, _get_pipeline(mid)) for mid in model_ids], answer_type
+
+
+def _compare_item(out: dict) -> CompareItem:
+    return CompareItem(
+        model_id=out["model_id"],
+        model_name=out.get("model_name"),
+        final_answer=None if out["error"] else out["answer"],
+        evidence=out.get("evidence") or "",
+        self_check=out.get("self_check") or "",
+        latency_sec=out["latency_sec"],
+        error=out["error"],
+    )
+
+
+def _fan_out(request: CompareRequest, pipelines: list[tuple[str, TrustPipeline]], answer_type: str):
+    """
+    逐个产出各模型的 CompareItem；成功的每个模型各落一条单条评测记录，和分别调 /evaluate 时一样进历史。
+    """
+    by_id = dict(pipelines)
+
+    async def gen():
+        async for out in afan_out(
+            pipelines, request.question, image_path=request.image_path, image_base64=request.image_base64, answer_type=answer_type,
+        ):
+            if not out["error"]:
+                _submit_single_result(request, by_id[out["model_id"]], out, out["latency_sec"])
+            yield _compare_item(out)
+
+    return gen()
+
+
+@app.post("/api/v1/evaluate/compare", response_model=CompareResponse)
+async def evaluate_compare(request: CompareRequest):
+    pipelines, answer_type = _resolve_compare(request)
+    t0 = time.perf_counter()
+    items = {item.model_id: item async for item in _fan_out(request, pipelines, answer_type)}
+    elapsed = time.perf_counter() - t0
+    logger.info("compare 完成: %d 个模型, 耗时=%.2fs", len(items), elapsed)
+    return CompareResponse(results=[items[mid] for mid, _ in pipelines], elapsed_sec=round(elapsed, 3))
+
+
+@app.post("/api/v1/evaluate/compare/stream")
+async def evaluate_compare_stream(request: CompareRequest):
+    pipelines, answer_type = _resolve_compare(request)
+
+    async def events():
+        t0 = time.perf_counter()
+        async for item in _fan_out(request, pipelines, answer_type):
+            yield _sse("result", item.model_dump())
+        yield _sse("done", {"elapsed_sec": round(time.perf_counter() - t0, 3)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 #======批量评测（异步）======
-# 立即返回 task_id，后台执行；前端轮询 GET /api/v1/task/{task_id}
+# 立即返回 task_id，条目落进作业队列后由后台 / 独立 worker 执行；前端轮询 GET /api/v1/task/{task_id}
 @app.post("/api/v1/evaluate/batch", response_model=BatchEvaluateResponse)
 def evaluate_batch(request: BatchEvaluateRequest, background_tasks: BackgroundTasks):
     if not request.items:
@@ -216,97 +460,312 @@ def evaluate_batch(request: BatchEvaluateRequest, background_tasks: BackgroundTa
     pipeline = _get_pipeline(model_id)
     if not pipeline:
         raise HTTPException(status_code=400, detail=f"未知 model_id: {model_id}，请用 GET /api/v1/models 查看可用模型")
-    db = SessionLocal()
-    try:
-        task = EvaluationTask(
-            task_id=str(uuid.uuid4()),
-            status="processing",
-            model_name=getattr(pipeline.wrapper, "model", None),
-        )
-        db.add(task)
-        db.commit()
-        task_id_uuid = task.task_id
-    finally:
-        db.close()
-    # 序列化为可传参的 dict 列表
-    items_payload = []
-    for it in request.items:
-        items_payload.append({
-            "question": it.question,
-            "image_path": it.image_path,
-            "image_base64": it.image_base64,
-        })
     answer_type = (request.answer_type or "yes_no").strip().lower()
     if answer_type not in ("yes_no", "open"):
         answer_type = "yes_no"
-    background_tasks.add_task(_run_batch_evaluate, task_id_uuid, items_payload, model_id, answer_type)
+    items_payload = [
+        {
+            "question": it.question,
+            "image_path": it.image_path,
+            "image_base64": it.image_base64,
+            "image_stored": _image_stored(it.image_path, it.image_base64),
+        }
+        for it in request.items
+    ]
+    # 建 Task 并入队也走写队列，但要等它提交：返回 task_id 后前端马上会来轮询，worker 也要能领到
+    task_id_uuid = str(uuid.uuid4())
+    task_pk = _writer.submit(partial(
+        _op_create_batch,
+        task_id_uuid=task_id_uuid,
+        model_name=getattr(pipeline.wrapper, "model", None),
+        model_id=model_id,
+        answer_type=answer_type,
+        items=items_payload,
+    )).result()
+    if _batch_worker_mode == "inline":
+        background_tasks.add_task(_drain_batch, task_pk, task_id_uuid)
     logger.info("batch 已提交: task_id=%s, model_id=%s, 共 %d 条", task_id_uuid, model_id, len(items_payload))
     return BatchEvaluateResponse(task_id=task_id_uuid, status="processing")
 
 
 #======任务状态（轮询）======
+# 增量轮询：带 since（上次拿到的最大记录 id）只返回新记录；带 If-None-Match 且任务和分页参数都没变时直接 304。
+# 记录由单写线程按提交顺序分配自增 id，所以 id > since 不会漏掉晚提交的旧记录。
 @app.get("/api/v1/task/{task_id}", response_model=TaskStatusResponse)
-def get_task_status(task_id: str):
+def get_task_status(
+    task_id: str,
+    request: Request,
+    response: Response,
+    since: int = Query(0, ge=0, description="只返回 id 大于它的记录；首次传 0 取全部"),
+    limit: int | None = Query(None, ge=1, le=5000, description="本次最多返回多少条记录，不传不限"),
+):
     db = SessionLocal()
     try:
-        task = db.query(EvaluationTask).options(joinedload(EvaluationTask.records)).filter(EvaluationTask.task_id == task_id).first()
-        if not task:
+        # 只查一行汇总（状态 + 进度计数器 + 最大记录 id），不碰 ORM、不扫记录，够算 ETag
+        summary = _task_summary(db, task_id)
+        if summary is None:
             raise HTTPException(status_code=404, detail="任务不存在")
-        return TaskStatusResponse(
-            task_id=task.task_id,
-            status=task.status,
-            started_at=task.started_at,
-            model_name=task.model_name,
-            total_duration_sec=task.total_duration_sec,
-            records=[
-                TaskRecordItem(
-                    question=r.question,
-                    final_answer=r.final_answer,
-                    evidence=r.evidence,
-                    self_check=r.self_check,
-                    created_at=r.created_at,
-                )
-                for r in task.records
-            ],
+        etag = _task_etag(summary, since, limit)
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        records = _task_records(db, summary.pk, since, limit)
+        response.headers["ETag"] = etag
+        return _task_status_response(task_id, summary, records, since)
+    finally:
+        db.close()
+
+
+# 进度与记录数直接用任务行上的计数器（每写一条记录 done_items 就在同一事务里 +1），不再对记录表 COUNT；
+# 最大记录 id 走 task_id 索引的 MAX 子查询，只定位索引末尾一项，轮询和每次提交后的 SSE 重查都与任务大小无关。
+# done_items 为空的是有计数器之前的老任务，只有它们才回退到 COUNT。
+_TASK_SUMMARY_SQL = text(
+    "SELECT t.id AS pk, t.status, t.started_at, t.model_name, t.total_duration_sec, "
+    "t.total_items, t.done_items, t.failed_items, t.eta_sec, "
+    "CASE WHEN t.done_items IS NULL "
+    "THEN (SELECT COUNT(*) FROM evaluation_records r WHERE r.task_id = t.id) "
+    "ELSE t.done_items END AS record_count, "
+    "COALESCE((SELECT MAX(r.id) FROM evaluation_records r WHERE r.task_id = t.id), 0) AS max_record_id "
+    "FROM evaluation_tasks t WHERE t.task_id = :task_id"
+).columns(started_at=DateTime)
+
+
+def _task_summary(db, task_id: str):
+    return db.execute(_TASK_SUMMARY_SQL, {"task_id": task_id}).first()
+
+
+def _task_records(db, task_pk: int, since: int, limit: int | None = None) -> list[TaskRecordItem]:
+    query = (
+        db.query(EvaluationRecord)
+        .filter(EvaluationRecord.task_id == task_pk, EvaluationRecord.id > since)
+        .order_by(EvaluationRecord.id)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return [
+        TaskRecordItem(
+            id=r.id,
+            question=r.question,
+            final_answer=r.final_answer,
+            evidence=r.evidence,
+            self_check=r.self_check,
+            created_at=r.created_at,
+            **{k: getattr(r, k) for k in STAT_FIELDS},
         )
+        for r in query
+    ]
+
+
+def _task_status_response(task_id: str, summary, records: list[TaskRecordItem], since: int) -> TaskStatusResponse:
+    return TaskStatusResponse(
+        task_id=task_id,
+        status=summary.status,
+        started_at=summary.started_at,
+        model_name=summary.model_name,
+        total_duration_sec=summary.total_duration_sec,
+        records=records,
+        record_count=summary.record_count,
+        next_since=records[-1].id if records else since,
+        total_items=summary.total_items,
+        done_items=summary.done_items,
+        failed_items=summary.failed_items,
+        eta_sec=summary.eta_sec,
+    )
+
+
+def _task_progress(summary) -> dict:
+    return {
+        "status": summary.status,
+        "total_items": summary.total_items,
+        "done_items": summary.done_items,
+        "failed_items": summary.failed_items,
+        "eta_sec": summary.eta_sec,
+        "record_count": summary.record_count,
+        "total_duration_sec": summary.total_duration_sec,
+    }
+
+
+def _task_etag(summary, since: int = 0, limit: int | None = None) -> str:
+    # 状态、耗时、进度计数器、最大记录 id 任一变化都换 ETag（记录数就是 done_items，不用单独算）；
+    # since / limit 也算进去：同一任务的不同分页是不同的表示，拿上一页的 ETag 翻下一页不能回 304
+    return (
+        f'"{summary.pk}-{summary.status}-{summary.total_duration_sec}-{summary.done_items}-{summary.failed_items}'
+        f'-{summary.max_record_id}-{since}-{limit or ""}"'
+    )
+
+
+def _etag_matches(header: str | None, etag: str) -> bool:
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _load_task_delta(task_id: str, since: int):
+    db = SessionLocal()
+    try:
+        summary = _task_summary(db, task_id)
+        if summary is None:
+            return None, []
+        return summary, _task_records(db, summary.pk, since)
     finally:
         db.close()
 
 
+#======任务事件推送（SSE）======
+# 连上先补发 since（或 Last-Event-ID）之后的已有记录和当前进度，之后每有提交就推新记录（event: record，id 为记录 id）
+# 和最新进度（event: progress），任务结束推 done 并断开。写线程提交后才唤醒，推的都是已落盘的数据。
+@app.get("/api/v1/task/{task_id}/events")
+async def task_events(
+    task_id: str,
+    request: Request,
+    since: int = Query(0, ge=0, description="只推 id 大于它的记录；断线重连时也可由 Last-Event-ID 头带上"),
+):
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since = max(since, int(last_event_id))
+    if await run_in_threadpool(_find_task_pk, task_id) is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    async def events():
+        cursor = since
+        # 先订阅再查库：查库和订阅之间提交的变化也不会漏
+        with _task_events.subscribe(task_id) as wake:
+            while True:
+                wake.clear()
+                summary, records = await run_in_threadpool(_load_task_delta, task_id, cursor)
+                if summary is None:
+                    return
+                for r in records:
+                    yield f"id: {r.id}\n" + _sse("record", r.model_dump(mode="json"))
+                    cursor = r.id
+                yield _sse("progress", _task_progress(summary))
+                if summary.status != "processing":
+                    yield _sse("done", _task_progress(summary))
+                    return
+                try:
+                    await asyncio.wait_for(wake.wait(), TASK_EVENTS_HEARTBEAT_SEC)
+                except asyncio.TimeoutError:
+                    # 注释行当心跳，防代理掐空闲连接；醒来照样回库里查一次
+                    yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 #======历史查询======
-# 最近 N 条任务，按 task 聚合，每条任务带其 records
+# 最近的任务按 (started_at, id) 倒序 keyset 分页：next_cursor 原样传回 cursor 取下一页，翻多深都只走一次索引定位。
+# mode=full 每条任务带全部 records（兼容旧前端）；mode=summary 不带记录，只带 SQL GROUP BY 出来的按答案计数，
+# 记录另走 /api/v1/task/{task_id}/records 分页，页面大小与任务多大无关。
 @app.get("/api/v1/history", response_model=HistoryResponse)
-def get_history(limit: int = Query(10, ge=1, le=100)):
+def get_history(
+    limit: int = Query(10, ge=1, le=100),
+    cursor: str | None = Query(None, description="上一页响应里的 next_cursor"),
+    mode: str = Query("full", pattern="^(full|summary)$"),
+):
+    after = _decode_history_cursor(cursor) if cursor else None
     db = SessionLocal()
     try:
-        tasks = (
-            db.query(EvaluationTask)
-            .options(joinedload(EvaluationTask.records))
-            .order_by(EvaluationTask.started_at.desc())
-            .limit(limit)
-            .all()
-        )
+        query = db.query(EvaluationTask)
+        if after is not None:
+            query = query.filter(tuple_(EvaluationTask.started_at, EvaluationTask.id) < after)
+        # 多取一条判断还有没有下一页
+        tasks = query.order_by(EvaluationTask.started_at.desc(), EvaluationTask.id.desc()).limit(limit + 1).all()
+        has_more = len(tasks) > limit
+        tasks = tasks[:limit]
+        pks = [t.id for t in tasks]
+        counts: dict[int, dict[str, int]] = {}
+        records_by_task: dict[int, list[HistoryRecordItem]] = {pk: [] for pk in pks}
+        if mode == "summary":
+            counts = _answer_counts(db, pks)
+        elif pks:
+            # 一次 IN 查询取这一页的全部记录，不用 joinedload 的笛卡尔积
+            for r in db.query(EvaluationRecord).filter(EvaluationRecord.task_id.in_(pks)).order_by(EvaluationRecord.id):
+                records_by_task[r.task_id].append(
+                    HistoryRecordItem(
+                        question=r.question,
+                        final_answer=r.final_answer,
+                        evidence=r.evidence,
+                        self_check=r.self_check,
+                        created_at=r.created_at,
+                    )
+                )
         out = []
         for t in tasks:
-            out.append(
-                HistoryTaskItem(
-                    task_id=t.task_id,
-                    started_at=t.started_at,
-                    status=t.status,
-                    model_name=t.model_name,
-                    total_duration_sec=t.total_duration_sec,
-                    records=[
-                        HistoryRecordItem(
-                            question=r.question,
-                            final_answer=r.final_answer,
-                            evidence=r.evidence,
-                            self_check=r.self_check,
-                            created_at=r.created_at,
-                        )
-                        for r in t.records
-                    ],
-                )
+            item = HistoryTaskItem(
+                task_id=t.task_id,
+                started_at=t.started_at,
+                status=t.status,
+                model_name=t.model_name,
+                total_duration_sec=t.total_duration_sec,
+                records=records_by_task[t.id],
             )
-        return HistoryResponse(tasks=out)
+            if mode == "summary":
+                item.answer_counts = counts.get(t.id) or dict.fromkeys(ANSWER_BUCKETS, 0)
+                item.record_count = sum(item.answer_counts.values())
+            out.append(item)
+        next_cursor = _encode_history_cursor(tasks[-1]) if has_more else None
+        return HistoryResponse(tasks=out, next_cursor=next_cursor)
+    finally:
+        db.close()
+
+
+# 摘要里的答案分桶；yes/no/refused 之外的都算开放回答
+ANSWER_BUCKETS = ("yes", "no", "refused", "open")
+
+
+def _answer_counts(db, task_pks: list[int]) -> dict[int, dict[str, int]]:
+    if not task_pks:
+        return {}
+    bucket = case(
+        (EvaluationRecord.final_answer.in_(ANSWER_BUCKETS[:3]), EvaluationRecord.final_answer),
+        else_=literal("open"),
+    )
+    rows = (
+        db.query(EvaluationRecord.task_id, bucket, func.count())
+        .filter(EvaluationRecord.task_id.in_(task_pks))
+        .group_by(EvaluationRecord.task_id, bucket)
+    )
+    out: dict[int, dict[str, int]] = {}
+    for pk, b, n in rows:
+        out.setdefault(pk, dict.fromkeys(ANSWER_BUCKETS, 0))[b] = n
+    return out
+
+
+def _encode_history_cursor(task: EvaluationTask) -> str:
+    raw = json.dumps([task.started_at.isoformat() if task.started_at else None, task.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_history_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        started, pk = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(started), int(pk)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="cursor 无效")
+
+
+# 单个任务的记录按 id 正序 keyset 分页，next_after 原样传回 after 取下一页
+@app.get("/api/v1/task/{task_id}/records", response_model=TaskRecordsResponse)
+def get_task_records(
+    task_id: str,
+    after: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+):
+    db = SessionLocal()
+    try:
+        task = db.query(EvaluationTask.id).filter(EvaluationTask.task_id == task_id).first()
+        if task is None:
+            raise HTTPException(status_code=404, detail="任务不存在")
+        records = _task_records(db, task.id, after, limit + 1)
+        has_more = len(records) > limit
+        records = records[:limit]
+        return TaskRecordsResponse(
+            task_id=task_id,
+            records=records,
+            next_after=records[-1].id if has_more else None,
+        )
     finally:
         db.close()
@@ -0,0 +1,118 @@
+import os
+import asyncio
+from collections import deque
+from typing import Callable
+
+#======配置区======
+# 每个 model_id 同时在飞的模型请求上限（跨所有批量任务共享）。
+# 默认组读 BATCH_CONCURRENCY，第 i 组读 BATCH_CONCURRENCY_i，与 API_KEY_i 的编号对应
+DEFAULT_BATCH_CONCURRENCY = 8
+
+
+def get_batch_limit(model_id: str) -> int:
+    """
+    按 model_id 取并发上限：default 读 BATCH_CONCURRENCY，"2" 读 BATCH_CONCURRENCY_2，以此类推；没配用默认值。
+    """
+    name = "BATCH_CONCURRENCY" if model_id in ("", "default") else f"BATCH_CONCURRENCY_{model_id}"
+    raw = os.getenv(name) or os.getenv("BATCH_CONCURRENCY")
+    try:
+        return max(1, int(raw)) if raw else DEFAULT_BATCH_CONCURRENCY
+    except ValueError:
+        return DEFAULT_BATCH_CONCURRENCY
+
+
+#======公平限流======
+class FairLimiter:
+    """
+    一个 model_id 一把：同时最多 limit 个持有者；名额不够时按任务（owner）轮流放行，
+    先提交的大批量不会饿死后提交的小批量。只在单个事件循环里用，不需要锁。
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(1, int(limit))
+        self.active = 0
+        self._waiters: dict[str, deque] = {}
+        # 有人在排队的 owner，轮转顺序
+        self._order: deque[str] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._waiters.values())
+
+    async def acquire(self, owner: str) -> None:
+        if self.active < self.limit and not self._order:
+            self.active += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        q = self._waiters.get(owner)
+        if q is None:
+            q = self._waiters[owner] = deque()
+            self._order.append(owner)
+        q.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 名额已经给了但自己被取消，还回去
+                self.release()
+            else:
+                self._discard(owner, fut)
+            raise
+
+    def release(self) -> None:
+        self.active -= 1
+        self._wake()
+
+    def _discard(self, owner: str, fut) -> None:
+        q = self._waiters.get(owner)
+        if q is None:
+            return
+        try:
+            q.remove(fut)
+        except ValueError:
+            pass
+        if not q:
+            del self._waiters[owner]
+            try:
+                self._order.remove(owner)
+            except ValueError:
+                pass
+
+    def _wake(self) -> None:
+        while self.active < self.limit and self._order:
+            owner = self._order.popleft()
+            q = self._waiters[owner]
+            fut = q.popleft()
+            if q:
+                # 放行一个后排到队尾，轮到下一个任务
+                self._order.append(owner)
+            else:
+                del self._waiters[owner]
+            if fut.cancelled():
+                continue
+            self.active += 1
+            fut.set_result(None)
+
+
+#======批量执行器======
+class BatchExecutor:
+    """
+    批量评测的按模型限流：每个 model_id 一把 FairLimiter，同一模型下所有并发执行的任务共享名额、轮流执行。
+    条目怎么跑、怎么落库在 worker.JobRunner 里，这里只管名额和积压统计。
+    """
+
+    def __init__(self, limit_for: Callable[[str], int] = get_batch_limit) -> None:
+        self._limit_for = limit_for
+        self._limiters: dict[str, FairLimiter] = {}
+
+    def limiter(self, model_id: str) -> FairLimiter:
+        lim = self._limiters.get(model_id)
+        if lim is None:
+            lim = self._limiters[model_id] = FairLimiter(self._limit_for(model_id))
+        return lim
+
+    def backlog(self) -> dict[str, dict[str, int]]:
+        """
+        各模型当前在飞 / 排队的条数。
+        """
+        return {mid: {"active": lim.active, "waiting": lim.waiting} for mid, lim in self._limiters.items()}
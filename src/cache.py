@@ -0,0 +1,418 @@
+import os
+import json
+import time
+import base64
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+#======配置区======
+# 内存层字节上限（按缓存值的 utf-8 字节数算）
+MEMORY_MAX_BYTES = 64 * 1024 * 1024
+# 磁盘层字节上限，超了按最久未访问淘汰
+DISK_MAX_BYTES = 1024 * 1024 * 1024
+# 磁盘层条目存活秒数，过期视为未命中并删除；None 表示不过期
+DISK_TTL_SEC = 30 * 24 * 3600
+# 淘汰时一次多删一点，别每次写入都触发淘汰
+EVICT_SLACK = 0.9
+# 图片编码缓存（data URL）的字节上限；POPE 一张图会被问好几遍，缓存住省掉重复读盘和 base64
+IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# 图片指纹缓存的条目上限（每条就一个 64 字符的 sha256，十万张图也就十来 MB）
+IMAGE_DIGEST_MAX_ITEMS = 100_000
+# 算文件指纹时每次读多少字节，大图也不整张读进内存
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+
+#======工具函数======
+def image_digest(image_path: str | None = None, image_base64: str | None = None, image_cache: "ImageCache | None" = None) -> str:
+    """
+    图片内容的 sha256。路径走 image_cache（默认进程内共享的那份）的指纹缓存：只流式读盘算哈希，不做 base64、不建 data URL；
+    base64 先去掉 data: 前缀再解码，这样同一张图不管怎么传进来，指纹都一样。都没有返回空串。
+    """
+    if image_base64:
+        raw = image_base64.strip()
+        if raw.startswith("data:"):
+            raw = raw.split(",", 1)[-1]
+        try:
+            data = base64.b64decode(raw)
+        except ValueError:
+            data = raw.encode("utf-8")
+        return hashlib.sha256(data).hexdigest()
+    if image_path:
+        return (image_cache or default_image_cache).digest(image_path)
+    return ""
+
+
+def file_sha256(image_path: str) -> str:
+    h = hashlib.sha256()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(DIGEST_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_key(model: str, image_sha: str, prompt: str, answer_type: str, variant: str = "") -> str:
+    """
+    内容寻址的缓存 key：模型名 + 图片指纹 + 完整 prompt + answer_type，任一变了就是另一条。
+    variant 标记发给模型的图被怎么处理过（如预处理参数），为空时 key 与不带它时一致。
+    """
+    parts = [model or "", image_sha, prompt, answer_type]
+    if variant:
+        parts.append(variant)
+    blob = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+#======内存层======
+class LRUBytesCache:
+    """
+    按字节数封顶的 LRU，线程安全。值默认是 str，大小按 utf-8 字节算；别的类型 set 时传 size。
+    """
+
+    def __init__(self, max_bytes: int = MEMORY_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._data: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                return None
+            self._data.move_to_end(key)
+            return hit[0]
+
+    def set(self, key, value, size: int | None = None) -> None:
+        if size is None:
+            size = len(value.encode("utf-8"))
+        # 单条就超上限的不进内存层，免得把别的全挤掉
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, sz) = self._data.popitem(last=False)
+                self._bytes -= sz
+                self.evictions += 1
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+#======图片编码缓存======
+class EncodedImage:
+    """
+    一张图编码后的结果：data URL（直接塞进请求）、原图内容 sha256、原图字节数、实际发送的图片字节数。
+    """
+
+    __slots__ = ("data_url", "sha256", "file_bytes", "payload_bytes")
+
+    def __init__(self, data_url: str, sha256: str, file_bytes: int, payload_bytes: int | None = None) -> None:
+        self.data_url = data_url
+        self.sha256 = sha256
+        self.file_bytes = file_bytes
+        self.payload_bytes = file_bytes if payload_bytes is None else payload_bytes
+
+
+def encode_image_bytes(data: bytes, mime: str, preprocessor=None) -> EncodedImage:
+    """
+    原始图片字节转 data URL；给了 preprocessor（见 preprocess.ImagePreprocessor）就先缩放重编码。
+    sha256 始终是原图的，和 image_digest 对得上。
+    """
+    sha = hashlib.sha256(data).hexdigest()
+    payload = data
+    if preprocessor is not None:
+        payload, mime = preprocessor.process(data, mime)
+    img_b64 = base64.b64encode(payload).decode("utf-8")
+    return EncodedImage(f"data:{mime};base64,{img_b64}", sha, len(data), len(payload))
+
+
+def encode_image_file(image_path: str, preprocessor=None) -> EncodedImage:
+    """
+    读本地图片转 base64 data URL，按扩展名定 mime（png 以外一律 jpeg）。
+    """
+    with open(image_path, "rb") as f:
+        data = f.read()
+    ext = os.path.splitext(image_path)[1].lower()
+    mime = "image/png" if ext == ".png" else "image/jpeg"
+    return encode_image_bytes(data, mime, preprocessor)
+
+
+def _preprocess_sig(preprocessor) -> str:
+    return getattr(preprocessor, "signature", "") if preprocessor is not None else ""
+
+
+class ImageCache:
+    """
+    图片 → EncodedImage 的 LRU，按 data URL 总字节数封顶，超了淘汰最久没用的。
+    本地文件的 key 是 (绝对路径, mtime, 文件大小)，文件被改过就自动失效，不会拿到旧图；
+    带预处理时 key 里再加预处理参数指纹，缓存的是处理后的结果。
+    同一个 key 多个线程同时未命中时只有一个去编码，其余等它编完直接取（多模型同时评同一张图只编码一次）。
+    另带一份只存原图 sha256 的指纹缓存（同样按路径 + mtime + 大小），查回复缓存 / 磁带只要指纹时不用编码整张图。
+    """
+
+    def __init__(self, max_bytes: int = IMAGE_CACHE_MAX_BYTES, max_digests: int = IMAGE_DIGEST_MAX_ITEMS) -> None:
+        self._lru = LRUBytesCache(max_bytes)
+        self._digests: OrderedDict = OrderedDict()
+        self._max_digests = max_digests
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0}
+        # 正在编码的 key -> 编完置位的 Event
+        self._building: dict = {}
+
+    def _lookup(self, key, build) -> EncodedImage:
+        while True:
+            hit = self._lru.get(key)
+            if hit is not None:
+                with self._lock:
+                    self._counts["hits"] += 1
+                return hit
+            with self._lock:
+                waiter = self._building.get(key)
+                if waiter is None:
+                    self._building[key] = threading.Event()
+                    self._counts["misses"] += 1
+                    break
+            # 别人在编，等它编完回头再查；它失败了或结果太大没进缓存，下一轮自己编
+            waiter.wait()
+        try:
+            enc = build()
+            self._lru.set(key, enc, size=len(enc.data_url))
+            return enc
+        finally:
+            with self._lock:
+                self._building.pop(key).set()
+
+    def get(self, image_path: str, preprocessor=None) -> EncodedImage:
+        st = os.stat(image_path)
+        file_key = (os.path.abspath(image_path), st.st_mtime_ns, st.st_size)
+        enc = self._lookup(file_key + (_preprocess_sig(preprocessor),), lambda: encode_image_file(image_path, preprocessor))
+        # 编码时顺带算好了原图指纹，记下来，之后查指纹不用再读盘
+        self._remember_digest(file_key, enc.sha256)
+        return enc
+
+    def digest(self, image_path: str) -> str:
+        """
+        本地图片原图的 sha256，与 get(...).sha256 一致；未命中时流式读盘算，不编码。
+        """
+        st = os.stat(image_path)
+        file_key = (os.path.abspath(image_path), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            sha = self._digests.get(file_key)
+            if sha is not None:
+                self._digests.move_to_end(file_key)
+                return sha
+        sha = file_sha256(image_path)
+        self._remember_digest(file_key, sha)
+        return sha
+
+    def _remember_digest(self, file_key: tuple, sha: str) -> None:
+        with self._lock:
+            self._digests[file_key] = sha
+            self._digests.move_to_end(file_key)
+            while len(self._digests) > self._max_digests:
+                self._digests.popitem(last=False)
+
+    def get_base64(self, raw_b64: str, preprocessor=None, mime: str = "image/jpeg") -> EncodedImage:
+        """
+        网络传来的裸 base64（不带 data: 前缀）经预处理后的结果，按 base64 串的指纹缓存，重复上传同一张图只处理一次。
+        """
+        key = ("b64", hashlib.sha256(raw_b64.encode("ascii", "ignore")).hexdigest(), _preprocess_sig(preprocessor))
+        return self._lookup(key, lambda: encode_image_bytes(base64.b64decode(raw_b64), mime, preprocessor))
+
+    def clear(self) -> None:
+        self._lru = LRUBytesCache(self._lru.max_bytes)
+        with self._lock:
+            self._digests.clear()
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._counts)
+        out["items"] = len(self._lru)
+        out["bytes"] = self._lru.size_bytes
+        out["evictions"] = self._lru.evictions
+        return out
+
+
+# 进程内共享一份：main.py 和 api.py 里所有 wrapper 默认都用它
+default_image_cache = ImageCache()
+
+
+#======磁盘层======
+class SQLiteCache:
+    """
+    SQLite 单表持久缓存：TTL 过期 + 总字节数超限时按最久未访问淘汰。
+    一个连接 + 锁，多线程安全；WAL 模式下多进程也能共用一个文件。
+    """
+
+    def __init__(self, path: str, max_bytes: int = DISK_MAX_BYTES, ttl_sec: float | None = DISK_TTL_SEC) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self.evictions = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_responses_accessed_at ON responses (accessed_at)")
+        self._conn.commit()
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at, size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at, size = row
+            if self.ttl_sec is not None and created_at < now - self.ttl_sec:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self._bytes -= size
+                self.evictions += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        size = len(value.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._bytes += size - (old[0] if old else 0)
+            if self._bytes > self.max_bytes:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        """
+        先清过期的，还超就按 accessed_at 从旧往新删，删到上限的 EVICT_SLACK 以下。调用方持锁。
+        """
+        if self.ttl_sec is not None:
+            cur = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_sec,))
+            self.evictions += max(cur.rowcount, 0)
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        target = self.max_bytes * EVICT_SLACK
+        if self._bytes <= target:
+            return
+        freed = 0
+        doomed = []
+        for k, sz in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            doomed.append((k,))
+            freed += sz
+            if self._bytes - freed <= target:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self._bytes -= freed
+        self.evictions += len(doomed)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+#======两级缓存======
+class ResponseCache:
+    """
+    模型原始回复的两级缓存：先查内存 LRU，再查 SQLite；磁盘命中会回填内存。
+    path 为 None 时只有内存层。只存原始回复，解析交给调用方，这样改解析器不用重新调接口。
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        memory_max_bytes: int = MEMORY_MAX_BYTES,
+        disk_max_bytes: int = DISK_MAX_BYTES,
+        ttl_sec: float | None = DISK_TTL_SEC,
+    ) -> None:
+        self.memory = LRUBytesCache(memory_max_bytes)
+        self.disk = SQLiteCache(path, disk_max_bytes, ttl_sec) if path else None
+        self._lock = threading.Lock()
+        self._counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+    def _bump(self, field: str) -> None:
+        with self._lock:
+            self._counts[field] += 1
+
+    def key_for(
+        self,
+        model: str,
+        prompt: str,
+        answer_type: str,
+        image_path: str | None = None,
+        image_base64: str | None = None,
+        variant: str = "",
+        image_cache: ImageCache | None = None,
+    ) -> str:
+        """
+        一次请求的缓存 key，图片会读出来算指纹（走 image_cache 的指纹缓存），读盘是阻塞的。
+        """
+        return make_key(model, image_digest(image_path, image_base64, image_cache), prompt, answer_type, variant)
+
+    def get(self, key: str) -> str | None:
+        value = self.memory.get(key)
+        if value is not None:
+            self._bump("memory_hits")
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self._bump("disk_hits")
+                self.memory.set(key, value)
+                return value
+        self._bump("misses")
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+        self._bump("stores")
+
+    @property
+    def stats(self) -> dict:
+        """
+        命中统计快照：memory_hits / disk_hits / misses / stores、hit_rate，以及两层的占用与淘汰数。
+        """
+        with self._lock:
+            out = dict(self._counts)
+        lookups = out["memory_hits"] + out["disk_hits"] + out["misses"]
+        out["hit_rate"] = (out["memory_hits"] + out["disk_hits"]) / lookups if lookups else 0.0
+        out["memory_items"] = len(self.memory)
+        out["memory_bytes"] = self.memory.size_bytes
+        out["memory_evictions"] = self.memory.evictions
+        if self.disk is not None:
+            out["disk_bytes"] = self.disk.size_bytes
+            out["disk_evictions"] = self.disk.evictions
+        return out
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
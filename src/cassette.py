@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Callable, Iterable
+
+# 既会被 src.wrapper 当包内模块导入，也会被 main.py 按顶层模块导入，两种都兼容
+try:
+    from .cache import image_digest
+except ImportError:
+    from cache import image_digest
+
+#======配置区======
+# 没录到的请求怎么办：fail 直接抛 CassetteMiss；live 照常调接口；record 调接口并把回复追加进磁带
+MISS_MODES = ("fail", "live", "record")
+
+
+class CassetteMiss(LookupError):
+    """
+    回放模式下磁带里没有这条请求。
+    """
+
+
+def cassette_key(model: str, image_sha: str, prompt: str) -> str:
+    """
+    磁带的 key：模型名 + 图片内容指纹 + 发给模型的完整 prompt。prompt 模板一改 key 就变，
+    所以回放只适合验证 prompt 之外的逻辑（解析、归一化、拒答规则）。
+    """
+    blob = json.dumps([model or "", image_sha, prompt], ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+#======磁带======
+class Cassette:
+    """
+    录好的模型原始回复，一行一条 jsonl（key、model、图片指纹、prompt 指纹、response），启动时整体读进内存。
+    ModelWrapper 挂上它后先按 key 查，命中直接返回录好的回复，不走网络、不占限速配额。
+    on_miss 见 MISS_MODES；record 时新回复立即追加写盘，进程中途退出也不丢。
+    """
+
+    def __init__(self, path: str, on_miss: str = "fail") -> None:
+        if on_miss not in MISS_MODES:
+            raise ValueError(f"on_miss 只能是 {', '.join(MISS_MODES)}")
+        self.path = path
+        self.on_miss = on_miss
+        self._entries: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "recorded": 0}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        row = json.loads(line)
+                        self._entries[row["key"]] = row["response"]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, model: str, image_sha: str, prompt: str) -> tuple[str, str | None]:
+        """
+        返回 (key, 录好的回复)；没录到时按 on_miss：fail 抛 CassetteMiss，否则回复为 None，由调用方去调接口。
+        """
+        key = cassette_key(model, image_sha, prompt)
+        with self._lock:
+            raw = self._entries.get(key)
+            self._counts["hits" if raw is not None else "misses"] += 1
+        if raw is None and self.on_miss == "fail":
+            raise CassetteMiss(f"磁带 {self.path} 里没有这条请求（model={model}, image={image_sha[:12]}）")
+        return key, raw
+
+    def record(self, key: str, model: str, image_sha: str, prompt: str, raw: str) -> None:
+        """
+        record 模式下把调接口拿到的回复追加进磁带；调用失败的 "Error" 不录。
+        """
+        if self.on_miss != "record" or not raw or raw.strip() == "Error":
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = raw
+            _append(self.path, [_entry(key, model, image_sha, prompt, raw)])
+            self._counts["recorded"] += 1
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._counts)
+        out["entries"] = len(self._entries)
+        return out
+
+
+def _entry(key: str, model: str, image_sha: str, prompt: str, raw: str) -> dict:
+    return {
+        "key": key,
+        "model": model,
+        "image_sha256": image_sha,
+        "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        "response": raw,
+    }
+
+
+def _append(path: str, entries: list[dict]) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for e in entries:
+            f.write(json.dumps(e, ensure_ascii=False) + "\n")
+
+
+#======从结果文件建磁带======
+def build_cassette(
+    rows: Iterable[dict],
+    path: str,
+    default_model: str,
+    build_prompt: Callable[[dict], str],
+    image_path_for: Callable[[dict], str | None],
+) -> dict:
+    """
+    用已有结果文件里的 model_answer 建磁带（追加到 path，已有的 key 跳过）。
+    模型名取行里的 model（多模型对比的结果有），没有则用 default_model；prompt 由 build_prompt 按题目重新拼，
+    所以要和当初跑的时候是同一版 prompt 模板。图片找不到、回复为 "Error" 的行跳过。返回各类计数。
+    """
+    existing = Cassette(path, on_miss="live")
+    counts = {"rows": 0, "added": 0, "duplicate": 0, "no_image": 0, "error": 0}
+    seen = set()
+    batch = []
+    for row in rows:
+        counts["rows"] += 1
+        raw = row.get("model_answer")
+        if not raw or raw.strip() == "Error":
+            counts["error"] += 1
+            continue
+        image_path = image_path_for(row)
+        if not image_path or not os.path.exists(image_path):
+            counts["no_image"] += 1
+            continue
+        model = row.get("model") or default_model
+        image_sha = image_digest(image_path)
+        prompt = build_prompt(row)
+        key = cassette_key(model, image_sha, prompt)
+        if key in seen or key in existing._entries:
+            counts["duplicate"] += 1
+            continue
+        seen.add(key)
+        batch.append(_entry(key, model, image_sha, prompt, raw))
+        counts["added"] += 1
+    if batch:
+        _append(path, batch)
+    return counts
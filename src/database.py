@@ -1,20 +1,103 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import StaticPool
+
+#======SQLite 性能参数======
+# 每个新连接都会执行一遍。WAL 让读不阻塞写；synchronous=NORMAL 在 WAL 下只在 checkpoint 时 fsync，掉电最多丢最近的事务、不会损坏库
+# cache_size 负数单位 KiB；mmap_size 单位字节；busy_timeout 毫秒，写锁被占时等一会儿而不是立刻报 database is locked
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+}
+
+
+def _apply_pragmas(dbapi_conn, pragmas: dict) -> None:
+    cur = dbapi_conn.cursor()
+    try:
+        for k, v in pragmas.items():
+            cur.execute(f"PRAGMA {k}={v}")
+    finally:
+        cur.close()
+
+
+def create_sqlite_engine(path: str | None = None, pragmas: dict | None = SQLITE_PRAGMAS):
+    """
+    建 SQLite 引擎并挂上性能参数。path 为 None 时是内存库（StaticPool，各线程共用同一个连接，否则每个连接都是一个空库）。
+    pragmas 传 None 则保持 SQLite 默认配置（压测对比用）。
+    """
+    if path is None:
+        engine = create_engine(
+            "sqlite:///:memory:",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    if pragmas:
+        @event.listens_for(engine, "connect")
+        def _on_connect(dbapi_conn, _record):
+            _apply_pragmas(dbapi_conn, pragmas)
+    return engine
+
 
 #======配置区======
-# 测试时用内存库，不落盘
+# 测试时用内存库，不落盘；MM_TRUSTBENCH_DB 可换库路径（压测时用临时库，不碰 data/trustbench.db）
 if os.getenv("MM_TRUSTBENCH_TEST"):
-    _engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+    _engine = create_sqlite_engine(None)
 else:
     _here = os.path.dirname(os.path.abspath(__file__))
     _project_root = os.path.dirname(_here)
-    _db_path = os.path.join(_project_root, "data", "trustbench.db")
-    os.makedirs(os.path.dirname(_db_path), exist_ok=True)
-    _engine = create_engine(f"sqlite:///{_db_path}", connect_args={"check_same_thread": False})
+    _db_path = os.getenv("MM_TRUSTBENCH_DB") or os.path.join(_project_root, "data", "trustbench.db")
+    _engine = create_sqlite_engine(_db_path)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=_engine)
 Base = declarative_base()
 
 
 def get_engine():
     return _engine
+
+
+#======建表与原地升级======
+def upgrade_schema(engine=None) -> list[str]:
+    """
+    给已有的库补齐 ORM 里新增的列和索引（只加不删不改），返回执行过的变更说明。
+    新列按可空加，旧行为 NULL；索引用 IF NOT EXISTS，重复跑无副作用。
+    """
+    engine = engine or _engine
+    changes = []
+    insp = inspect(engine)
+    existing_tables = set(insp.get_table_names())
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            have_cols = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in have_cols:
+                    continue
+                col_type = col.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {col_type}'))
+                changes.append(f"add column {table.name}.{col.name}")
+            have_idx = {i["name"] for i in insp.get_indexes(table.name)}
+            for idx in table.indexes:
+                if idx.name in have_idx:
+                    continue
+                idx.create(conn, checkfirst=True)
+                changes.append(f"create index {idx.name}")
+    return changes
+
+
+def init_db(engine=None) -> list[str]:
+    """
+    启动时调：不存在的表直接建（连同索引），已存在的表原地补列补索引。
+    调用前需已 import models，让表注册到 Base.metadata。
+    """
+    engine = engine or _engine
+    Base.metadata.create_all(bind=engine)
+    return upgrade_schema(engine)
@@ -0,0 +1,279 @@
+import json
+import time
+import uuid
+import logging
+from datetime import datetime
+
+from sqlalchemy import text, func
+
+from .models import EvaluationTask, EvaluationRecord, EvaluationJob
+from .telemetry import round_stats
+
+logger = logging.getLogger("mm_trustbench")
+
+#======配置区======
+# 租约时长（秒）：worker 每 LEASE_SEC/3 续一次，超过这么久没续就当它死了，作业可被别人重领
+LEASE_SEC = 60.0
+# 一条作业最多被领几次（含崩溃重领）；用完仍失败就记为 failed
+MAX_ATTEMPTS = 3
+# 条目抛异常后推迟重试：第 n 次失败后等 min(RETRY_MAX_SEC, RETRY_BASE_SEC * 2**(n-1)) 秒
+RETRY_BASE_SEC = 2.0
+RETRY_MAX_SEC = 60.0
+
+
+#======作业队列（写操作都是 op(session)，交给写后队列在一个事务里跑）======
+# 多进程并发靠 SQLite 的写锁串行：每个 op 的第一条语句都是带条件的 UPDATE（领取 / 凭 token 认领结果），
+# 拿到写锁后再读，读到的都是最新数据；同一条作业不会被两个 worker 同时领走，过期租约的迟到结果也写不进去。
+
+def op_enqueue(db, task_pk: int, items: list[dict], model_id: str, answer_type: str) -> int:
+    """
+    批量任务的每一条入队一行作业，和建 Task 放在同一个事务里，提交后任务即可被任意 worker 领取。
+    """
+    db.bulk_insert_mappings(EvaluationJob, [
+        {
+            "task_id": task_pk,
+            "item_index": i,
+            "model_id": model_id,
+            "answer_type": answer_type,
+            "payload": json.dumps(it, ensure_ascii=False),
+            "status": "queued",
+            "attempts": 0,
+            "available_at": 0.0,
+        }
+        for i, it in enumerate(items)
+    ])
+    return len(items)
+
+
+_CLAIM_SQL = """
+UPDATE evaluation_jobs
+SET status = 'leased', lease_owner = :owner, lease_token = :token, lease_expires_at = :expires, attempts = attempts + 1
+WHERE id IN (
+    SELECT id FROM evaluation_jobs
+    WHERE ((status = 'queued' AND available_at <= :now) OR (status = 'leased' AND lease_expires_at < :now))
+      AND attempts < :max_attempts {task_filter}
+    ORDER BY id LIMIT :limit
+)
+"""
+
+
+def op_claim(
+    db,
+    owner: str,
+    limit: int,
+    lease_sec: float = LEASE_SEC,
+    task_pk: int | None = None,
+    max_attempts: int = MAX_ATTEMPTS,
+) -> list[dict]:
+    """
+    领取至多 limit 条可跑的作业：排队中且到了可跑时间的，或租约已过期（原 worker 多半崩了）的。
+    task_pk 给了就只领这个任务的。返回 [{id, token, task_pk, task_uuid, model_id, answer_type, attempts, item}, ...]。
+    顺带把租约过期且次数用完的作业标成 failed。
+    """
+    now = time.time()
+    token = str(uuid.uuid4())
+    changed = _reap_exhausted(db, now, max_attempts)
+    if limit <= 0:
+        return []
+    sql = _CLAIM_SQL.format(task_filter="AND task_id = :task_pk" if task_pk is not None else "")
+    db.execute(text(sql), {
+        "owner": owner, "token": token, "expires": now + lease_sec, "now": now,
+        "max_attempts": max_attempts, "limit": int(limit), "task_pk": task_pk,
+    })
+    rows = (
+        db.query(EvaluationJob, EvaluationTask.task_id)
+        .join(EvaluationTask, EvaluationTask.id == EvaluationJob.task_id)
+        .filter(EvaluationJob.lease_token == token)
+        .order_by(EvaluationJob.id)
+        .all()
+    )
+    jobs = [
+        {
+            "id": job.id,
+            "token": token,
+            "task_pk": job.task_id,
+            "task_uuid": task_uuid,
+            "model_id": job.model_id,
+            "answer_type": job.answer_type,
+            "attempts": job.attempts,
+            "item": json.loads(job.payload or "{}"),
+        }
+        for job, task_uuid in rows
+    ]
+    if changed:
+        logger.warning("作业租约过期且领取次数用完，记为失败: %d 条", changed)
+    return jobs
+
+
+def _reap_exhausted(db, now: float, max_attempts: int) -> int:
+    # 先用 UPDATE 把要判死的作业打上一次性 token：既拿到写锁，又和迟到的结果提交互斥
+    reap_token = str(uuid.uuid4())
+    n = (
+        db.query(EvaluationJob)
+        .filter(
+            EvaluationJob.status == "leased",
+            EvaluationJob.lease_expires_at < now,
+            EvaluationJob.attempts >= max_attempts,
+        )
+        .update({EvaluationJob.lease_token: reap_token}, synchronize_session=False)
+    )
+    if not n:
+        return 0
+    dead = db.query(EvaluationJob).populate_existing().filter(EvaluationJob.lease_token == reap_token).all()
+    for job in dead:
+        _mark_failed(db, job, "lease expired")
+    for task_pk in {job.task_id for job in dead}:
+        _refresh_task(db, task_pk, now)
+    return len(dead)
+
+
+def op_heartbeat(db, owner: str, tokens: list[str], lease_sec: float = LEASE_SEC) -> int:
+    """
+    给自己手上还在跑的作业续租，返回续上的条数。
+    """
+    if not tokens:
+        return 0
+    return (
+        db.query(EvaluationJob)
+        .filter(
+            EvaluationJob.lease_token.in_(tokens),
+            EvaluationJob.lease_owner == owner,
+            EvaluationJob.status == "leased",
+        )
+        .update({EvaluationJob.lease_expires_at: time.time() + lease_sec}, synchronize_session=False)
+    )
+
+
+def op_settle(db, outcomes: list[dict], max_attempts: int = MAX_ATTEMPTS) -> list[str]:
+    """
+    提交一批作业结果。outcome 为领取时的作业 dict 加 result（成功）或 error（异常说明）。
+    先凭 (id, token) 确认租约还在：已被别人重领的结果直接丢掉，不会重复写 Record。
+    成功：写 Record、done_items+1；失败：次数没用完就推迟后重新排队，用完记 failed、failed_items+1。
+    返回进度有变化的任务 task_id（UUID），供调用方唤醒事件流订阅方。
+    """
+    now = time.time()
+    changed: dict[int, str] = {}
+    for out in outcomes:
+        attempts = out.get("attempts", max_attempts)
+        values = {
+            EvaluationJob.lease_owner: None,
+            EvaluationJob.lease_token: None,
+            EvaluationJob.lease_expires_at: None,
+        }
+        if "result" in out:
+            values.update({EvaluationJob.status: "done", EvaluationJob.payload: None})
+        elif attempts < max_attempts:
+            values.update({
+                EvaluationJob.status: "queued",
+                EvaluationJob.available_at: now + min(RETRY_MAX_SEC, RETRY_BASE_SEC * 2 ** max(0, attempts - 1)),
+                EvaluationJob.last_error: out.get("error"),
+            })
+        else:
+            values.update({EvaluationJob.status: "failed", EvaluationJob.last_error: out.get("error")})
+        # 凭 (id, token) 改状态，改到了才说明租约还在自己手里
+        hit = (
+            db.query(EvaluationJob)
+            .filter(
+                EvaluationJob.id == out["id"],
+                EvaluationJob.lease_token == out["token"],
+                EvaluationJob.status == "leased",
+            )
+            .update(values, synchronize_session=False)
+        )
+        if not hit:
+            logger.warning("作业 %s 的租约已失效，丢弃本次结果", out["id"])
+            continue
+        task_pk = out["task_pk"]
+        if "result" in out:
+            result = out["result"]
+            item = out.get("item") or {}
+            db.add(EvaluationRecord(
+                task_id=task_pk,
+                question=item.get("question", ""),
+                image_base64=item.get("image_stored", ""),
+                final_answer=result["answer"],
+                evidence=result.get("evidence", ""),
+                self_check=result.get("self_check", ""),
+                **round_stats(result.get("stats")),
+            ))
+            _bump(db, task_pk, "done_items")
+        elif attempts >= max_attempts:
+            _bump(db, task_pk, "failed_items")
+        changed[task_pk] = out.get("task_uuid", "")
+    db.flush()
+    for task_pk in changed:
+        _refresh_task(db, task_pk, now)
+    return [tid for tid in changed.values() if tid]
+
+
+def op_release(db, tokens: list[str]) -> int:
+    """
+    worker 正常退出时把还没跑完的作业放回队列（不算一次尝试），不用等租约过期。
+    """
+    if not tokens:
+        return 0
+    return (
+        db.query(EvaluationJob)
+        .filter(EvaluationJob.lease_token.in_(tokens), EvaluationJob.status == "leased")
+        .update(
+            {
+                EvaluationJob.status: "queued",
+                EvaluationJob.attempts: EvaluationJob.attempts - 1,
+                EvaluationJob.lease_owner: None,
+                EvaluationJob.lease_token: None,
+                EvaluationJob.lease_expires_at: None,
+            },
+            synchronize_session=False,
+        )
+    )
+
+
+def op_pending(db, task_pk: int | None = None) -> int:
+    """
+    还在排队（含推迟重试）的作业数，不含别人正租着的。
+    """
+    query = db.query(EvaluationJob).filter(EvaluationJob.status == "queued")
+    if task_pk is not None:
+        query = query.filter(EvaluationJob.task_id == task_pk)
+    return query.count()
+
+
+def _mark_failed(db, job: EvaluationJob, error: str | None) -> None:
+    job.status = "failed"
+    job.last_error = error
+    job.lease_owner = None
+    job.lease_token = None
+    job.lease_expires_at = None
+    _bump(db, job.task_id, "failed_items")
+
+
+def _bump(db, task_pk: int, field: str) -> None:
+    # 直接 UPDATE 自增，不把 Task 读出来；旧库补出来的列是 NULL，按 0 起算
+    col = getattr(EvaluationTask, field)
+    db.query(EvaluationTask).filter(EvaluationTask.id == task_pk).update(
+        {col: func.coalesce(col, 0) + 1}, synchronize_session=False,
+    )
+
+
+def _refresh_task(db, task_pk: int, now: float) -> None:
+    """
+    按已处理条数外推 ETA；该任务没有排队/在跑的作业了就收尾为 completed。
+    """
+    # 计数是上面 UPDATE 改的，会话里可能还缓存着旧值，强制重读
+    task = db.get(EvaluationTask, task_pk, populate_existing=True)
+    if task is None or task.status != "processing":
+        return
+    processed = (task.done_items or 0) + (task.failed_items or 0)
+    # started_at 是 utcnow 写的无时区时间
+    elapsed = max(0.0, (datetime.utcnow() - task.started_at).total_seconds()) if task.started_at else 0.0
+    open_jobs = (
+        db.query(EvaluationJob)
+        .filter(EvaluationJob.task_id == task_pk, EvaluationJob.status.in_(("queued", "leased")))
+        .count()
+    )
+    if open_jobs == 0:
+        task.status = "completed"
+        task.total_duration_sec = round(elapsed, 3)
+        task.eta_sec = 0
+    elif processed and task.total_items:
+        task.eta_sec = round(elapsed / processed * max(0, task.total_items - processed))
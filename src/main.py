@@ -1,13 +1,21 @@
 import os
+import re
 import sys
 import json
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # 保证从项目根 python src/main.py 或 src 下 python main.py 都能找到 wrapper
 _src_dir = os.path.dirname(os.path.abspath(__file__))
 if _src_dir not in sys.path:
     sys.path.insert(0, _src_dir)
-from wrapper import ModelWrapper
+from wrapper import ModelWrapper, POOL_SIZE, IMAGE_DETAIL, DEFAULT_MODEL, get_available_wrappers
 from trust_pipeline import TrustPipeline
+from cache import ResponseCache, default_image_cache
+from preprocess import ImagePreprocessor, OUTPUT_FORMAT, OUTPUT_QUALITY
+from telemetry import round_stats
+from cassette import Cassette, MISS_MODES, build_cassette
 
 #======配置区======
 # 本脚本在 src/ 下，用 __file__ 推到项目根，这样无论从哪执行路径都对
@@ -17,6 +25,16 @@ INPUT_JSONL = os.path.join(_PROJECT_ROOT, "data", "annotations", "mini_pope.json
 OUTPUT_JSONL = os.path.join(_PROJECT_ROOT, "data", "prediction_results.jsonl")
 # jsonl 里只有 "image" 文件名、没有完整路径时，用这个目录拼
 IMG_DIR = os.path.join(_PROJECT_ROOT, "data", "images")
+# 默认同时在飞的模型请求数；1 即原来的逐条串行
+DEFAULT_CONCURRENCY = 1
+# --ordered 时乱序缓冲（已完成、等前面的题落盘）最多攒几个提交窗口的量，满了先停止提交，等卡住的题做完
+REORDER_BUFFER_WINDOWS = 8
+# --cache 不带路径时用的持久缓存文件
+CACHE_DB = os.path.join(_PROJECT_ROOT, "data", "response_cache.db")
+# --models 多模型对比时默认写这里（每行带 model_id），和单模型结果分开，断点续传互不干扰
+COMPARE_JSONL = os.path.join(_PROJECT_ROOT, "data", "compare_results.jsonl")
+# --cassette / --build-cassette 不带路径时用的磁带文件
+CASSETTE_JSONL = os.path.join(_PROJECT_ROOT, "data", "cassette.jsonl")
 
 
 #======主逻辑======
@@ -32,10 +50,20 @@ def load_items(path: str) -> list:
     return items
 
 
+def item_key(item: dict) -> str:
+    """
+    题目唯一 key：用 question_id，没有就用 (image, question) 的元组转 str。
+    load_done_keys 与跑题时共用，保证断点续传两边算出来一致。
+    """
+    k = item.get("question_id")
+    if k is None:
+        k = (item.get("image"), item.get("question") or item.get("text"))
+    return json.dumps(k, sort_keys=True, ensure_ascii=False)
+
+
 def load_done_keys(path: str) -> set:
     """
     读已有结果文件，把已做过的题目的 key 放进 set，用于断点续传。
-    key 用 question_id，没有就用 (image, question) 的元组转 str。
     """
     if not os.path.exists(path):
         return set()
@@ -44,68 +72,408 @@ def load_done_keys(path: str) -> set:
         for line in f:
             if not line.strip():
                 continue
-            row = json.loads(line)
-            k = row.get("question_id")
-            if k is None:
-                k = (row.get("image"), row.get("question") or row.get("text"))
-            done.add(json.dumps(k, sort_keys=True, ensure_ascii=False))
+            done.add(item_key(json.loads(line)))
     return done
 
 
-def main() -> None:
-    # 1. 加载 50 道题
-    if not os.path.exists(INPUT_JSONL):
-        print(f"Error: 找不到 {INPUT_JSONL}，请先运行 setup_data.py")
-        return
-    items = load_items(INPUT_JSONL)
+def resolve_image_path(item: dict) -> str | None:
+    """
+    优先用 local_path（完整路径），没有则用 image 文件名 + IMG_DIR 拼。
+    """
+    image_path = item.get("local_path")
+    if not image_path and item.get("image"):
+        image_path = os.path.join(IMG_DIR, item["image"])
+    return image_path
+
+
+def build_row(item: dict, result: dict) -> dict:
+    """
+    原题 + 原始回复 + 最终答案 + 证据/自检 + 分阶段统计（耗时、请求字节数、token 数），拼成结果文件的一行。
+    """
+    return {
+        **item,
+        "model_answer": result["raw"],
+        "final_answer": result["answer"],
+        "evidence": result.get("evidence", ""),
+        "self_check": result.get("self_check", ""),
+        **round_stats(result.get("stats")),
+    }
+
+
+def run_benchmark(
+    pipeline,
+    items: list,
+    output_path: str,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    ordered: bool = False,
+) -> int:
+    """
+    跑一遍题库，返回本次新写入的条数。
+    同时最多 concurrency 个模型请求在飞；每完成一题就追加写一行并 flush，断点续传语义不变。
+    ordered=True 时按输入顺序落盘（先完成的后面题会在内存里等前面的题），否则按完成顺序落盘；
+    排队等落盘的题不占提交窗口，一道慢题只拖住落盘，不拖住其他工作线程；缓冲另有上限，慢题卡太久时才停止提交。
+    写文件只在主线程做，工作线程只跑 pipeline.process，不需要锁。
+    """
     total = len(items)
-    print(f"Loaded {total} items from {INPUT_JSONL}")
-
-    # 2. 断点续传：已写进结果文件的题不再跑
-    done_keys = load_done_keys(OUTPUT_JSONL)
-    wrapper = ModelWrapper()
-    pipeline = TrustPipeline(wrapper)
-
-    # 3. 输出目录不存在时先建
-    os.makedirs(os.path.dirname(OUTPUT_JSONL), exist_ok=True)
-    # 4. 追加写入用 "a"；首次写时文件不存在也会自动创建
-    with open(OUTPUT_JSONL, "a", encoding="utf-8") as out_f:
-        for i, item in enumerate(items):
-            # 本题唯一 key，和 load_done_keys 里一致
-            k = item.get("question_id")
-            if k is None:
-                k = (item.get("image"), item.get("question") or item.get("text"))
-            key_str = json.dumps(k, sort_keys=True, ensure_ascii=False)
-            if key_str in done_keys:
-                print(f"[{i+1}/{total}] skip (already done)")
-                continue
+    done_keys = load_done_keys(output_path)
 
-            # 优先用 local_path（完整路径），没有则用 image 文件名 + IMG_DIR 拼
-            image_path = item.get("local_path")
-            if not image_path and item.get("image"):
-                image_path = os.path.join(IMG_DIR, item["image"])
-            question = item.get("question") or item.get("text", "")
-            if not image_path or not os.path.exists(image_path):
-                print(f"[{i+1}/{total}] skip: no image {image_path}")
-                continue
+    # 1. 先过滤掉已做过的、没图的，剩下的按输入顺序编号；同一个 key 在题库里出现多次只跑第一次
+    jobs = []
+    queued = set()
+    for i, item in enumerate(items):
+        key_str = item_key(item)
+        if key_str in done_keys:
+            print(f"[{i+1}/{total}] skip (already done)")
+            continue
+        if key_str in queued:
+            print(f"[{i+1}/{total}] skip (duplicate)")
+            continue
+        image_path = resolve_image_path(item)
+        if not image_path or not os.path.exists(image_path):
+            print(f"[{i+1}/{total}] skip: no image {image_path}")
+            continue
+        question = item.get("question") or item.get("text", "")
+        queued.add(key_str)
+        jobs.append((len(jobs), i, key_str, item, image_path, question))
+
+    # 2. 输出目录不存在时先建；追加写入用 "a"，首次写时文件不存在也会自动创建
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    concurrency = max(1, int(concurrency))
+    # 提交窗口：只限在飞的题数，避免大题库一次性全塞进线程池。
+    # 乱序缓冲单独限：比窗口宽得多，一道慢题不会马上把所有线程饿着；但卡住太久也不会把后面整个题库都攒进内存
+    window = concurrency * 2
+    buffer_cap = window * REORDER_BUFFER_WINDOWS
+    written = 0
+    with open(output_path, "a", encoding="utf-8") as out_f, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = {}  # future -> job
+        buffered = {}  # seq -> row，仅 ordered 用；None 表示该题失败跳过
+        next_seq = 0
+        job_iter = iter(jobs)
 
-            # 走证据+自检流水线
-            print(f"[{i+1}/{total}] {image_path} | {question[:40]}...")
-            result = pipeline.process(image_path, question)
-
-            # 原题 + 原始回复 + 最终答案 + 证据/自检，写一行
-            row = {
-                **item,
-                "model_answer": result["raw"],
-                "final_answer": result["answer"],
-                "evidence": result.get("evidence", ""),
-                "self_check": result.get("self_check", ""),
-            }
+        def _write(key_str: str, row: dict) -> None:
             out_f.write(json.dumps(row, ensure_ascii=False) + "\n")
             out_f.flush()
             done_keys.add(key_str)
 
-    print(f"\nDone. Results: {OUTPUT_JSONL}")
+        def _fill() -> None:
+            while len(pending) < window and len(buffered) < buffer_cap:
+                job = next(job_iter, None)
+                if job is None:
+                    return
+                _, i, _, _, image_path, question = job
+                # 走证据+自检流水线
+                print(f"[{i+1}/{total}] {image_path} | {question[:40]}...")
+                pending[pool.submit(pipeline.process, image_path, question)] = job
+
+        _fill()
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                seq, i, key_str, item, _, _ = pending.pop(fut)
+                try:
+                    row = (key_str, build_row(item, fut.result()))
+                except Exception as e:
+                    # 单题异常不拖垮整轮，不写结果，下次续跑会重做
+                    print(f"[{i+1}/{total}] failed: {e}")
+                    row = None
+                if ordered:
+                    buffered[seq] = row
+                elif row is not None:
+                    _write(*row)
+                    written += 1
+            if ordered:
+                while next_seq in buffered:
+                    row = buffered.pop(next_seq)
+                    next_seq += 1
+                    if row is not None:
+                        _write(*row)
+                        written += 1
+            _fill()
+    return written
+
+
+def compare_key(key_str: str, model_id: str) -> str:
+    """
+    多模型对比时断点续传的 key：题目 key + model_id，某个模型没跑完的题只补它自己。
+    """
+    return f"{model_id}\t{key_str}"
+
+
+def run_compare(pipelines: dict, items: list, output_path: str, concurrency: int = DEFAULT_CONCURRENCY) -> int:
+    """
+    多模型对比：每道题同时发给 pipelines（model_id -> pipeline）里的所有模型，返回本次新写入的行数。
+    同时最多 concurrency 道题在飞（即至多 concurrency × 模型数 个请求）；每个模型一答完就写一行（带 model_id、model），
+    慢模型不挡快模型落盘。同一道题的几个请求同时发出，共享图片缓存只编码一次。
+    """
+    total = len(items)
+    done = set()
+    if os.path.exists(output_path):
+        with open(output_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    done.add(compare_key(item_key(row), row.get("model_id", "")))
+
+    jobs = []
+    for i, item in enumerate(items):
+        key_str = item_key(item)
+        todo = [mid for mid in pipelines if compare_key(key_str, mid) not in done]
+        if not todo:
+            continue
+        image_path = resolve_image_path(item)
+        if not image_path or not os.path.exists(image_path):
+            print(f"[{i+1}/{total}] skip: no image {image_path}")
+            continue
+        question = item.get("question") or item.get("text", "")
+        jobs.append((i, item, image_path, question, todo))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    concurrency = max(1, int(concurrency))
+    written = 0
+    workers = concurrency * max(1, len(pipelines))
+    with open(output_path, "a", encoding="utf-8") as out_f, ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}  # future -> (i, item, model_id)
+        open_items = {}  # 题目序号 -> 还没答完的模型数
+        job_iter = iter(jobs)
+
+        def _fill() -> None:
+            while len(open_items) < concurrency:
+                job = next(job_iter, None)
+                if job is None:
+                    return
+                i, item, image_path, question, todo = job
+                print(f"[{i+1}/{total}] {image_path} | {question[:40]}... -> {', '.join(todo)}")
+                open_items[i] = len(todo)
+                for mid in todo:
+                    pending[pool.submit(pipelines[mid].process, image_path, question)] = (i, item, mid)
+
+        _fill()
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                i, item, mid = pending.pop(fut)
+                try:
+                    row = build_row(item, fut.result())
+                except Exception as e:
+                    # 单个模型异常不影响同题的其他模型，不写结果，下次续跑会重做
+                    print(f"[{i+1}/{total}] {mid} failed: {e}")
+                else:
+                    row["model_id"] = mid
+                    row["model"] = getattr(getattr(pipelines[mid], "wrapper", None), "model", None) or mid
+                    out_f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    out_f.flush()
+                    written += 1
+                open_items[i] -= 1
+                if not open_items[i]:
+                    del open_items[i]
+            _fill()
+    return written
+
+
+#======分片======
+# 一次大扫描拆给多个进程 / 多台机器：按题目 key 的稳定哈希分片，每片写自己的结果文件、各自断点续传，最后 --merge 合并
+def parse_shard(spec: str) -> tuple[int, int]:
+    """
+    解析 --shard 的 "i/N"（i 从 0 起），返回 (i, N)。
+    """
+    m = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", spec or "")
+    if not m or not 0 <= int(m.group(1)) < int(m.group(2)):
+        raise argparse.ArgumentTypeError(f"--shard 要写成 i/N 且 0 <= i < N，收到 {spec!r}")
+    return int(m.group(1)), int(m.group(2))
+
+
+def shard_of(key_str: str, num_shards: int) -> int:
+    """
+    题目归哪一片：item_key 的 sha1 取模。不用内置 hash（每个进程加盐不同），换机器、换 Python 版本结果都一样。
+    """
+    digest = hashlib.sha1(key_str.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def shard_path(output_path: str, index: int, num_shards: int) -> str:
+    """
+    分片结果文件：prediction_results.jsonl -> prediction_results.shard-0-of-4.jsonl，和合并后的文件放一起。
+    """
+    stem, ext = os.path.splitext(output_path)
+    return f"{stem}.shard-{index}-of-{num_shards}{ext or '.jsonl'}"
+
+
+def find_shards(output_path: str) -> list[str]:
+    """
+    找 output_path 旁边的所有分片文件，按 (N, i) 排序，合并结果不依赖目录列举顺序。
+    """
+    stem, ext = os.path.splitext(os.path.abspath(output_path))
+    folder, base = os.path.split(stem)
+    pattern = re.compile(re.escape(base) + r"\.shard-(\d+)-of-(\d+)" + re.escape(ext or ".jsonl") + "$")
+    found = []
+    for name in os.listdir(folder) if os.path.isdir(folder) else []:
+        m = pattern.match(name)
+        if m:
+            found.append((int(m.group(2)), int(m.group(1)), os.path.join(folder, name)))
+    return [path for _, _, path in sorted(found)]
+
+
+def merge_shards(items: list, output_path: str, shard_paths: list | None = None) -> dict:
+    """
+    把分片结果合并进 output_path：按题库顺序排（多模型对比的行同题再按 model_id），同一 key 只留一行。
+    已有的 output_path 也算一份来源且优先，之前合并过或不分片跑过的结果不会丢；题库里没有的行按 key 排在最后。
+    先写临时文件再替换，中途失败不会留下半个结果文件。返回各来源行数与去重、写出计数。
+    """
+    shard_paths = find_shards(output_path) if shard_paths is None else shard_paths
+    order = {}
+    for i, item in enumerate(items):
+        order.setdefault(item_key(item), i)
+    sources = ([output_path] if os.path.exists(output_path) else []) + list(shard_paths)
+    merged = {}  # 去重 key -> row
+    counts = {"sources": len(sources), "rows": 0, "duplicate": 0}
+    for path in sources:
+        for row in load_items(path):
+            counts["rows"] += 1
+            dedup = compare_key(item_key(row), row["model_id"]) if "model_id" in row else item_key(row)
+            if dedup in merged:
+                counts["duplicate"] += 1
+                continue
+            merged[dedup] = row
+
+    def sort_key(entry):
+        dedup, row = entry
+        key_str = item_key(row)
+        return (key_str not in order, order.get(key_str, 0), key_str, str(row.get("model_id", "")))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tmp_path = output_path + ".merging"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for _, row in sorted(merged.items(), key=sort_key):
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, output_path)
+    counts["written"] = len(merged)
+    return counts
+
+
+def parse_args(argv: list | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="MM-TrustBench 离线批量评测（支持断点续传）")
+    parser.add_argument("--input", default=INPUT_JSONL, help="题库 jsonl 路径")
+    parser.add_argument("--output", default=None, help=f"结果 jsonl 路径（追加写），默认 {OUTPUT_JSONL}")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同时在飞的模型请求数")
+    parser.add_argument("--ordered", action="store_true", help="结果按输入顺序落盘（默认按完成顺序）")
+    parser.add_argument(
+        "--models", default=None,
+        help=f"多模型对比：逗号分隔的 model_id（default,2,...），all 为 .env 里配置的全部；结果默认写 {COMPARE_JSONL}",
+    )
+    parser.add_argument(
+        "--cache", nargs="?", const=CACHE_DB, default=None,
+        help=f"开启模型回复缓存，可给 SQLite 路径（默认 {CACHE_DB}），传 memory 只用内存层",
+    )
+    parser.add_argument(
+        "--shard", type=parse_shard, default=None, metavar="i/N",
+        help="只跑按题目 key 哈希分到第 i 片（0 起）的题，结果写 <output>.shard-i-of-N.jsonl，各片可在不同进程 / 机器上跑",
+    )
+    parser.add_argument(
+        "--merge", action="store_true",
+        help="把 <output> 旁边的各分片按题库顺序、去重后合并进 <output>，然后退出",
+    )
+    parser.add_argument(
+        "--cassette", nargs="?", const=CASSETTE_JSONL, default=None,
+        help=f"回放录好的模型回复（默认 {CASSETTE_JSONL}），命中的题不调接口",
+    )
+    parser.add_argument(
+        "--cassette-miss", default="fail", choices=MISS_MODES,
+        help="磁带里没有的请求：fail 该题失败不写结果；live 照常调接口；record 调接口并录进磁带",
+    )
+    parser.add_argument(
+        "--build-cassette", default=None, metavar="RESULTS_JSONL",
+        help="从已有结果文件的 model_answer 建磁带（写到 --cassette 的路径）后退出，不跑评测",
+    )
+    parser.add_argument("--preprocess", action="store_true", help="上传前按 detail 档位缩图、去元数据、重新编码")
+    parser.add_argument("--preprocess-format", default=OUTPUT_FORMAT, choices=["JPEG", "WEBP"], help="预处理输出格式")
+    parser.add_argument("--preprocess-quality", type=int, default=OUTPUT_QUALITY, help="预处理编码质量")
+    return parser.parse_args(argv)
+
+
+def build_cassette_from_results(results_path: str, cassette_path: str) -> dict:
+    """
+    用结果文件建磁带：prompt 按当前模板由题目重新拼，图片按 resolve_image_path 找，
+    模型名取行里的 model（多模型对比结果），没有就用 .env 的 MODEL_NAME（与 ModelWrapper 的默认一致）。
+    """
+    prompt_builder = TrustPipeline(None)
+    default_model = os.getenv("MODEL_NAME", DEFAULT_MODEL)
+    return build_cassette(
+        load_items(results_path),
+        cassette_path,
+        default_model,
+        lambda row: prompt_builder._build_prompt(row.get("question") or row.get("text", "")),
+        resolve_image_path,
+    )
+
+
+def main(argv: list | None = None) -> None:
+    args = parse_args(argv)
+    if args.build_cassette:
+        cassette_path = args.cassette or CASSETTE_JSONL
+        counts = build_cassette_from_results(args.build_cassette, cassette_path)
+        print(f"Cassette: {cassette_path} {counts}")
+        return
+    # 1. 加载题库
+    if not os.path.exists(args.input):
+        print(f"Error: 找不到 {args.input}，请先运行 setup_data.py")
+        return
+    items = load_items(args.input)
+    print(f"Loaded {len(items)} items from {args.input}")
+    output = args.output or (COMPARE_JSONL if args.models else OUTPUT_JSONL)
+    if args.merge:
+        counts = merge_shards(items, output)
+        print(f"Merged {counts['sources']} files ({counts['rows']} rows, {counts['duplicate']} duplicates) -> {output}: {counts['written']} rows")
+        return
+    if args.shard:
+        # 只留本片的题，结果与断点续传都走本片自己的文件，几片同时跑互不相干
+        index, num_shards = args.shard
+        items = [it for it in items if shard_of(item_key(it), num_shards) == index]
+        output = shard_path(output, index, num_shards)
+        print(f"Shard {index}/{num_shards}: {len(items)} items -> {output}")
+
+    # 2. 断点续传在 run_benchmark 里做：已写进结果文件的题不再跑
+    # keep-alive 连接池至少要容得下并发数，否则多出来的请求每次都重新握手
+    preprocessor = None
+    if args.preprocess:
+        preprocessor = ImagePreprocessor(detail=IMAGE_DETAIL, fmt=args.preprocess_format, quality=args.preprocess_quality)
+        if not preprocessor.available:
+            print("Warning: 未安装 Pillow，--preprocess 不生效，原图直传")
+    cache = None
+    if args.cache:
+        cache = ResponseCache(None if args.cache == "memory" else args.cache)
+    cassette = None
+    if args.cassette:
+        cassette = Cassette(args.cassette, on_miss=args.cassette_miss)
+        print(f"Cassette: {len(cassette)} recorded responses from {args.cassette} (miss: {args.cassette_miss})")
+    if args.models:
+        available = dict(get_available_wrappers(
+            pool_size=max(POOL_SIZE, args.concurrency), preprocessor=preprocessor, cassette=cassette,
+        ))
+        wanted = list(available) if args.models.strip() == "all" else [m.strip() for m in args.models.split(",") if m.strip()]
+        unknown = [m for m in wanted if m not in available]
+        if unknown or not wanted:
+            print(f"Error: 未配置的 model_id: {', '.join(unknown) or '(空)'}，可用: {', '.join(available) or '(无)'}")
+            return
+        pipelines = {mid: TrustPipeline(available[mid], cache=cache) for mid in wanted}
+        written = run_compare(pipelines, items, output, concurrency=args.concurrency)
+    else:
+        # 纯回放不会发请求，没配 API_KEY 也能跑
+        api_key = "replay" if cassette is not None and args.cassette_miss == "fail" and not os.getenv("API_KEY") else None
+        wrapper = ModelWrapper(
+            api_key=api_key, pool_size=max(POOL_SIZE, args.concurrency), preprocessor=preprocessor, cassette=cassette,
+        )
+        pipeline = TrustPipeline(wrapper, cache=cache)
+        written = run_benchmark(pipeline, items, output, concurrency=args.concurrency, ordered=args.ordered)
+
+    print(f"\nDone. {written} new rows. Results: {output}")
+    print(f"Image cache: {default_image_cache.stats}")
+    if preprocessor is not None:
+        print(preprocessor.report())
+    if cache is not None:
+        print(f"Cache: {cache.stats}")
+        cache.close()
+    if cassette is not None:
+        print(f"Cassette: {cassette.stats}")
 
 
 if __name__ == "__main__":
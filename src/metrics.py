@@ -0,0 +1,221 @@
+import os
+import re
+import warnings
+from array import array
+
+import numpy as np
+
+# 既会被 src.analysis 当包内模块导入，也会被直接跑的 analysis.py 按顶层模块导入
+try:
+    from .analysis import normalize_label, extract_yes_no
+except ImportError:
+    from analysis import normalize_label, extract_yes_no
+
+#======配置区======
+# 编码：gt 与 pred 各占 2 bit，一行压成 gt * 4 + pred，分组混淆矩阵一次 bincount 出来
+NO, YES, REFUSED, UNKNOWN = 0, 1, 2, 3
+_LABEL_CODE = {"no": NO, "yes": YES, "refused": REFUSED, "unknown": UNKNOWN}
+# 支持的分组维度
+GROUP_DIMS = ("split", "object", "model", "prompt_variant")
+# POPE 的 split 名，行里没写 split 时从文件名里认
+POPE_SPLITS = ("random", "popular", "adversarial")
+# POPE 问法 "Is there a/an X in the image?"，抠出物体名
+_OBJECT_RE = re.compile(r"is there (?:a |an )?(.+?) in the (?:image|picture)", re.IGNORECASE)
+# 一组 bootstrap 指标
+METRIC_NAMES = ("accuracy", "precision", "recall", "f1", "yes_ratio", "refusal_rate", "hallucination_rate")
+
+
+#======编码======
+def encode_gt(row: dict) -> int:
+    label_key = "answer" if "answer" in row else "label"
+    return _LABEL_CODE[normalize_label(row.get(label_key, ""))]
+
+
+def encode_pred(row: dict) -> int:
+    """
+    和 analysis.score_row 的口径一致，只是把 refused 单独拎出来，方便算拒答率。
+    """
+    if "final_answer" in row:
+        fa = (row["final_answer"] or "").strip().lower()
+        return _LABEL_CODE.get(fa, UNKNOWN)
+    return _LABEL_CODE[extract_yes_no(row.get("model_answer", ""))]
+
+
+def group_value(row: dict, dim: str, source: str | None = None) -> str:
+    """
+    取一行在某个分组维度上的取值，取不到记 "-"。
+    """
+    if dim == "split":
+        v = row.get("split")
+        if not v and source:
+            name = os.path.basename(source).lower()
+            v = next((s for s in POPE_SPLITS if s in name), None)
+        return v or "-"
+    if dim == "object":
+        v = row.get("object")
+        if not v:
+            m = _OBJECT_RE.search(row.get("question") or row.get("text") or "")
+            v = m.group(1).strip().lower() if m else None
+        return v or "-"
+    if dim == "model":
+        return row.get("model") or row.get("model_name") or row.get("model_id") or "-"
+    if dim == "prompt_variant":
+        return row.get("prompt_variant") or "-"
+    raise ValueError(f"未知分组维度: {dim}")
+
+
+class MetricsCollector:
+    """
+    流式收集：每行只存 1 字节编码 + 每个分组维度一个整数编号，几十万行也就几 MB。
+    分组取值按出现顺序编号（factorize），算指标时直接当数组下标用。
+    """
+
+    def __init__(self, group_by: tuple | list = ()) -> None:
+        for d in group_by:
+            if d not in GROUP_DIMS:
+                raise ValueError(f"未知分组维度: {d}，可选 {GROUP_DIMS}")
+        self.group_by = tuple(group_by)
+        self._codes = array("b")
+        self._groups = {d: array("i") for d in self.group_by}
+        self._labels: dict[str, dict[str, int]] = {d: {} for d in self.group_by}
+
+    def add(self, row: dict, source: str | None = None) -> None:
+        self._codes.append(encode_gt(row) * 4 + encode_pred(row))
+        for d in self.group_by:
+            v = group_value(row, d, source)
+            labels = self._labels[d]
+            idx = labels.get(v)
+            if idx is None:
+                idx = labels[v] = len(labels)
+            self._groups[d].append(idx)
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def codes(self) -> np.ndarray:
+        return np.frombuffer(self._codes, dtype=np.int8).astype(np.int64)
+
+    def groups(self, dim: str) -> tuple[np.ndarray, list[str]]:
+        labels = [None] * len(self._labels[dim])
+        for v, i in self._labels[dim].items():
+            labels[i] = v
+        return np.frombuffer(self._groups[dim], dtype=np.int32).astype(np.int64), labels
+
+
+#======向量化指标======
+def confusion(codes: np.ndarray, group_idx: np.ndarray | None = None, n_groups: int = 1) -> np.ndarray:
+    """
+    分组混淆矩阵，形状 (n_groups, 4, 4)，[g, gt, pred]。不分组时 n_groups=1。
+    """
+    if group_idx is None:
+        group_idx = np.zeros(len(codes), dtype=np.int64)
+    flat = np.bincount(group_idx * 16 + codes, minlength=n_groups * 16)
+    return flat.reshape(n_groups, 4, 4)
+
+
+def _safe_div(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(b > 0, a / np.where(b > 0, b, 1), np.nan)
+
+
+def metrics_from_confusion(cm: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    从 (..., 4, 4) 混淆矩阵算指标，前面的维度原样保留（分组、bootstrap 轮次都行）。
+    拒答与洗不出 yes/no 都算错；recall 分母是全部标准 yes（拒答算漏），幻觉率分母是全部标准 no。
+    """
+    cm = cm.astype(np.float64)
+    n = cm.sum(axis=(-1, -2))
+    tp = cm[..., YES, YES]
+    tn = cm[..., NO, NO]
+    fp = cm[..., NO, YES]
+    gt_yes = cm[..., YES, :].sum(axis=-1)
+    gt_no = cm[..., NO, :].sum(axis=-1)
+    pred_yes = cm[..., :, YES].sum(axis=-1)
+    precision = _safe_div(tp, pred_yes)
+    recall = _safe_div(tp, gt_yes)
+    return {
+        "n": n,
+        "accuracy": _safe_div(tp + tn, n),
+        "precision": precision,
+        "recall": recall,
+        "f1": _safe_div(2 * precision * recall, precision + recall),
+        "yes_ratio": _safe_div(pred_yes, n),
+        "refusal_rate": _safe_div(cm[..., :, REFUSED].sum(axis=-1), n),
+        "hallucination_rate": _safe_div(fp, gt_no),
+    }
+
+
+def bootstrap_ci(cm: np.ndarray, n_boot: int = 1000, ci: float = 0.95, seed: int = 0) -> dict[str, np.ndarray]:
+    """
+    分组 bootstrap 置信区间，返回 {指标: (n_groups, 2) 的 [下界, 上界]}。
+    指标只依赖混淆矩阵，所以对每组按其 16 格频率做多项分布重抽样，等价于逐行有放回重抽，
+    代价是 O(n_boot × 组数 × 16)，与行数无关。
+    """
+    rng = np.random.default_rng(seed)
+    flat = cm.reshape(cm.shape[0], 16).astype(np.float64)
+    n = flat.sum(axis=1)
+    pvals = flat / np.where(n > 0, n, 1)[:, None]
+    # 空组给个合法的概率向量，抽 0 次
+    pvals[n == 0, 0] = 1.0
+    samples = rng.multinomial(n.astype(np.int64), pvals, size=(n_boot, cm.shape[0]))
+    boot = metrics_from_confusion(samples.reshape(n_boot, cm.shape[0], 4, 4))
+    alpha = (1 - ci) / 2
+    out = {}
+    for name in METRIC_NAMES:
+        with warnings.catch_warnings():
+            # 某组某指标所有轮次都无定义（如没有标准 no 的组算幻觉率）时区间就是 nan，不用报警
+            warnings.simplefilter("ignore", RuntimeWarning)
+            lo, hi = np.nanquantile(boot[name], [alpha, 1 - alpha], axis=0)
+        out[name] = np.stack([lo, hi], axis=-1)
+    return out
+
+
+def _clean(v: float) -> float | None:
+    return None if np.isnan(v) else round(float(v), 6)
+
+
+def compute_metrics(collector: MetricsCollector, n_boot: int = 0, ci: float = 0.95, seed: int = 0) -> dict:
+    """
+    汇总 + 各分组维度的指标表：{"overall": {...}, "by": {维度: {取值: {...}}}}。
+    n_boot > 0 时每个指标再带一个 "<指标>_ci": [下界, 上界]。
+    """
+    codes = collector.codes()
+
+    def table(cm: np.ndarray, labels: list[str]) -> dict:
+        m = metrics_from_confusion(cm)
+        cis = bootstrap_ci(cm, n_boot, ci, seed) if n_boot > 0 else None
+        rows = {}
+        for g, label in enumerate(labels):
+            row = {"n": int(m["n"][g])}
+            for name in METRIC_NAMES:
+                row[name] = _clean(m[name][g])
+                if cis is not None:
+                    row[f"{name}_ci"] = [_clean(cis[name][g, 0]), _clean(cis[name][g, 1])]
+            rows[label] = row
+        return rows
+
+    out = {"overall": table(confusion(codes), ["all"])["all"], "by": {}}
+    for d in collector.group_by:
+        idx, labels = collector.groups(d)
+        out["by"][d] = table(confusion(codes, idx, len(labels)), labels)
+    return out
+
+
+def format_table(dim: str, rows: dict, limit: int = 30) -> str:
+    """
+    某个分组维度的指标表，按样本数从多到少，最多 limit 行。
+    """
+    head = f"{dim:<20} {'n':>7} {'acc':>7} {'prec':>7} {'rec':>7} {'f1':>7} {'yes%':>7} {'ref%':>7} {'hall%':>7}  hall 95% CI"
+    lines = [head, "-" * len(head)]
+
+    def pct(v):
+        return f"{v:>7.2%}" if v is not None else f"{'-':>7}"
+
+    for label, r in sorted(rows.items(), key=lambda kv: -kv[1]["n"])[:limit]:
+        ci = r.get("hallucination_rate_ci")
+        ci_s = f"[{ci[0]:.2%}, {ci[1]:.2%}]" if ci and None not in ci else ""
+        lines.append(
+            f"{str(label)[:20]:<20} {r['n']:>7} {pct(r['accuracy'])} {pct(r['precision'])} {pct(r['recall'])} "
+            f"{pct(r['f1'])} {pct(r['yes_ratio'])} {pct(r['refusal_rate'])} {pct(r['hallucination_rate'])}  {ci_s}"
+        )
+    return "\n".join(lines)
@@ -1,6 +1,6 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, Float, String, Text, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 
 from .database import Base
@@ -13,25 +13,68 @@ class EvaluationTask(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     task_id = Column(String(36), unique=True, nullable=False)  # UUID，供前端轮询
-    started_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, default=datetime.utcnow, index=True)  # history 按它倒序
     status = Column(String(32), nullable=False)  # processing | completed | failed
     model_name = Column(String(128), nullable=True)
-    total_duration_sec = Column(Integer, nullable=True)  # 秒，可选
+    total_duration_sec = Column(Float, nullable=True)  # 秒，保留 3 位小数；老库这列是 INTEGER 亲和，存小数照样原样存
+    # 批量进度：由批量执行随每条结果更新，查进度不用数 Record；旧任务这几列为 NULL
+    total_items = Column(Integer, nullable=True)
+    done_items = Column(Integer, nullable=True, default=0)
+    failed_items = Column(Integer, nullable=True, default=0)
+    eta_sec = Column(Integer, nullable=True)  # 按已完成条目的平均耗时估算的剩余秒数
 
     records = relationship("EvaluationRecord", back_populates="task")
 
+    # history 按 (started_at, id) 倒序做 keyset 分页，翻到多深都是一次索引定位
+    __table_args__ = (Index("ix_evaluation_tasks_started_at_id", "started_at", "id"),)
+
 
 #======评测记录从表======
 class EvaluationRecord(Base):
     __tablename__ = "evaluation_records"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    task_id = Column(Integer, ForeignKey("evaluation_tasks.id"), nullable=True)  # 兼容旧数据
+    task_id = Column(Integer, ForeignKey("evaluation_tasks.id"), nullable=True, index=True)  # 兼容旧数据；查任务结果按它过滤
     question = Column(String(512), nullable=False)
     image_base64 = Column(Text, nullable=True)  # 存路径或 base64 简短标识
     final_answer = Column(String(32), nullable=False)
     evidence = Column(Text, nullable=True)
     self_check = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # 分阶段统计（见 telemetry.STAT_FIELDS）：缓存命中时没有上游那几项，服务端不回 usage 时 token 为 NULL；旧记录全为 NULL
+    encode_sec = Column(Float, nullable=True)  # 图片读盘 + 预处理 + base64
+    request_bytes = Column(Integer, nullable=True)  # prompt + 图片 data URL
+    upstream_sec = Column(Float, nullable=True)  # 模型 HTTP 请求耗时，各次重试相加，不含退避与限速排队
+    parse_sec = Column(Float, nullable=True)
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
 
     task = relationship("EvaluationTask", back_populates="records")
+
+    # history 摘要按 (task_id, final_answer) GROUP BY 计数，只扫索引不回表
+    __table_args__ = (Index("ix_evaluation_records_task_answer", "task_id", "final_answer"),)
+
+
+#======批量评测作业队列======
+# 批量任务的每一条是一行作业，worker 进程按租约领取：领走时写 lease_owner/lease_token/lease_expires_at，
+# 跑的过程中定期续租；进程崩了租约过期，别的 worker 重新领。时间列存 epoch 秒，跨进程比较不受时区影响
+class EvaluationJob(Base):
+    __tablename__ = "evaluation_jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(Integer, ForeignKey("evaluation_tasks.id"), nullable=False, index=True)
+    item_index = Column(Integer, nullable=False)  # 在批量请求 items 里的下标
+    model_id = Column(String(32), nullable=False, default="default")
+    answer_type = Column(String(16), nullable=False, default="yes_no")
+    payload = Column(Text, nullable=True)  # 条目 JSON（问题、图片）；跑完清空省空间
+    status = Column(String(16), nullable=False, default="queued")  # queued | leased | done | failed
+    attempts = Column(Integer, nullable=False, default=0)  # 已领取次数，含崩溃后被重领
+    available_at = Column(Float, nullable=False, default=0.0)  # 失败重试时推迟到这个时刻后才可领
+    lease_owner = Column(String(128), nullable=True)  # 主机名:pid
+    lease_token = Column(String(36), nullable=True)  # 每次领取一个新 token，提交结果时凭它确认租约还在自己手里
+    lease_expires_at = Column(Float, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # 领取时按 (status, available_at) 找可跑的作业
+    __table_args__ = (Index("ix_evaluation_jobs_claim", "status", "available_at"),)
@@ -0,0 +1,185 @@
+import time
+import queue
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable
+
+from .telemetry import DB_COMMIT_SECONDS, DB_COMMIT_OPS, DB_WRITE_FAILURES
+
+logger = logging.getLogger("mm_trustbench")
+
+#======配置区======
+# 攒够这么多条写操作就提交一次
+FLUSH_MAX_OPS = 256
+# 或者第一条进队后等这么久就提交，限制写入延迟
+FLUSH_INTERVAL_SEC = 0.05
+
+
+#======写后队列======
+class WriteBehindQueue:
+    """
+    单写线程的落库队列：各接口把写操作（op(session) 的可调用对象）丢进来就返回，
+    写线程按条数或时间攒成一组，一个事务一次 commit（group commit），SQLite 锁竞争和 fsync 都摊薄。
+    submit 返回 Future，需要确认落盘的调用方（如批量任务收尾）可以等它；不关心的直接丢。
+    组内某条 op 抛异常只让这一条失败，其余重放后照常提交。
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Any],
+        max_ops: int = FLUSH_MAX_OPS,
+        interval_sec: float = FLUSH_INTERVAL_SEC,
+    ) -> None:
+        self.session_factory = session_factory
+        self.max_ops = max_ops
+        self.interval_sec = interval_sec
+        self._q: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self._stats = {"ops": 0, "commits": 0, "failed_ops": 0}
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="mm-trustbench-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, op: Callable[[Any], Any]) -> Future:
+        """
+        入队一条写操作，立即返回 Future；op 在写线程里带着 session 调用，返回值作为 Future 结果（提交成功后才 set）。
+        """
+        if self._closed:
+            raise RuntimeError("写队列已关闭")
+        fut: Future = Future()
+        self._ensure_started()
+        self._q.put((op, fut))
+        return fut
+
+    def flush(self, timeout: float | None = None) -> None:
+        """
+        阻塞到此前提交的写操作全部 commit。
+        """
+        if self._thread is None:
+            return
+        self.submit(lambda db: None).result(timeout=timeout)
+
+    def close(self, timeout: float | None = 30) -> None:
+        """
+        停止接收新写入，把队列里剩下的全部落盘后退出写线程。进程退出前调。
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            self._q.put(None)
+            self._thread.join(timeout=timeout)
+
+    @property
+    def stats(self) -> dict:
+        out = dict(self._stats)
+        out["pending"] = self._q.qsize()
+        return out
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._q.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.interval_sec
+            while len(batch) < self.max_ops:
+                remaining = deadline - time.monotonic()
+                try:
+                    nxt = self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stopping = True
+                    break
+                batch.append(nxt)
+            self._commit_group(batch)
+        # 关闭时把剩余的也写掉
+        rest = []
+        while True:
+            try:
+                item = self._q.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                rest.append(item)
+        for i in range(0, len(rest), self.max_ops):
+            self._commit_group(rest[i:i + self.max_ops])
+
+    def _commit_group(self, batch: list) -> None:
+        """
+        一组 op 一个事务。某条 op 抛异常：回滚，把它标失败，其余的重新来一遍。
+        """
+        pending = list(batch)
+        while pending:
+            t0 = time.perf_counter()
+            db = None
+            results = []
+            bad = None
+            try:
+                # 建会话也放在 try 里：库打不开 / 被锁时整组失败返回，写线程不能死，否则之后所有 Future 永远等不到结果
+                db = self.session_factory()
+                for idx, (op, _) in enumerate(pending):
+                    try:
+                        results.append(op(db))
+                    except Exception as e:
+                        bad = (idx, e)
+                        break
+                if bad is None:
+                    db.commit()
+            except Exception as e:
+                # 建会话或 commit 本身失败（如库被锁超时），整组失败
+                if db is not None:
+                    _quiet_rollback(db)
+                logger.exception("写队列提交失败: %s", e)
+                for _, fut in pending:
+                    fut.set_exception(e)
+                self._stats["failed_ops"] += len(pending)
+                DB_WRITE_FAILURES.inc(len(pending))
+                return
+            finally:
+                if db is not None:
+                    if bad is not None:
+                        _quiet_rollback(db)
+                    db.close()
+            if bad is None:
+                self._stats["ops"] += len(pending)
+                self._stats["commits"] += 1
+                DB_COMMIT_SECONDS.observe(time.perf_counter() - t0)
+                DB_COMMIT_OPS.observe(len(pending))
+                for (_, fut), res in zip(pending, results):
+                    fut.set_result(res)
+                return
+            idx, err = bad
+            logger.warning("写队列单条失败: %s", err)
+            pending[idx][1].set_exception(err)
+            self._stats["failed_ops"] += 1
+            DB_WRITE_FAILURES.inc()
+            pending = pending[:idx] + pending[idx + 1:]
+
+
+def _quiet_rollback(db) -> None:
+    # 连接已坏时 rollback 也会抛，这里吞掉，别盖过原来的异常
+    try:
+        db.rollback()
+    except Exception as e:
+        logger.warning("写队列回滚失败: %s", e)
+
+
+def create_writer(session_factory: Callable[[], Any], **kwargs) -> WriteBehindQueue:
+    """
+    建一个写队列并注册进程退出时的落盘。
+    """
+    writer = WriteBehindQueue(session_factory, **kwargs)
+    atexit.register(writer.close)
+    return writer
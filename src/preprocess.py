@@ -0,0 +1,106 @@
+import io
+import threading
+
+# Pillow 可选：没装就原图直传，不影响评测
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+#======配置区======
+# 各 detail 档位的最长边像素。服务商拿到图也会按 detail 降采样，多传的像素纯属浪费上行带宽
+MAX_SIDE = {"low": 512, "high": 2048, "auto": 2048}
+# 重新编码的格式与质量：JPEG 兼容性最好，WEBP 更小
+OUTPUT_FORMAT = "JPEG"
+OUTPUT_QUALITY = 85
+_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+#======预处理======
+class ImagePreprocessor:
+    """
+    上传前的图片预处理：按 detail 档位把最长边缩到 max_side，去掉 EXIF 等元数据，按 fmt/quality 重新编码。
+    处理后反而更大（小图、已高度压缩的图）就保留原图。
+    stats 记每次上传的原始字节与实际发送字节，report() 给出本轮省了多少。
+    """
+
+    def __init__(
+        self,
+        detail: str = "low",
+        max_side: int | None = None,
+        fmt: str = OUTPUT_FORMAT,
+        quality: int = OUTPUT_QUALITY,
+    ) -> None:
+        self.max_side = max_side or MAX_SIDE.get(detail, MAX_SIDE["high"])
+        self.fmt = fmt.upper()
+        if self.fmt not in _MIME:
+            raise ValueError(f"不支持的输出格式: {fmt}")
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._stats = {"processed": 0, "uploads": 0, "bytes_in": 0, "bytes_out": 0}
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    @property
+    def signature(self) -> str:
+        """
+        预处理参数指纹，进缓存 key：参数变了，缓存的处理结果和模型回复都不能再用。
+        """
+        if not self.available:
+            return ""
+        return f"{self.fmt.lower()}-q{self.quality}-{self.max_side}"
+
+    def process(self, data: bytes, mime: str) -> tuple[bytes, str]:
+        """
+        处理一张图的原始字节，返回 (新字节, 新 mime)。Pillow 没装或解码失败时原样返回。
+        """
+        if not self.available:
+            return data, mime
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                # 按 EXIF 方向摆正，之后元数据整体丢弃
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+                if self.fmt != "PNG" and img.mode not in ("RGB", "L"):
+                    # 带透明通道的铺白底再转 RGB，JPEG 存不了 alpha
+                    rgba = img.convert("RGBA")
+                    bg = Image.new("RGB", rgba.size, (255, 255, 255))
+                    bg.paste(rgba, mask=rgba.split()[-1])
+                    img = bg
+                out = io.BytesIO()
+                img.save(out, format=self.fmt, quality=self.quality, optimize=True)
+        except Exception:
+            return data, mime
+        with self._lock:
+            self._stats["processed"] += 1
+        new = out.getvalue()
+        if len(new) >= len(data):
+            return data, mime
+        return new, _MIME[self.fmt]
+
+    def record_upload(self, original_bytes: int, sent_bytes: int) -> None:
+        """
+        每次真正发请求时记一笔（缓存命中也算，省下的是上行带宽）。
+        """
+        with self._lock:
+            self._stats["uploads"] += 1
+            self._stats["bytes_in"] += original_bytes
+            self._stats["bytes_out"] += sent_bytes
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+        out["bytes_saved"] = out["bytes_in"] - out["bytes_out"]
+        out["saved_ratio"] = out["bytes_saved"] / out["bytes_in"] if out["bytes_in"] else 0.0
+        return out
+
+    def report(self) -> str:
+        s = self.stats
+        return (
+            f"Preprocess: {s['uploads']} uploads, {s['bytes_in'] / 1e6:.2f} MB -> {s['bytes_out'] / 1e6:.2f} MB, "
+            f"saved {s['bytes_saved'] / 1e6:.2f} MB ({s['saved_ratio']:.1%})"
+        )
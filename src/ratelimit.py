@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from typing import Any, Callable
+
+#======配置区======
+# 每组模型的限速：默认组读 RATE_LIMIT_RPM，第 i 组读 RATE_LIMIT_RPM_i（与 API_KEY_i 编号对应），不配则不限速。
+# 突发容量 RATE_LIMIT_BURST(_i)，默认一秒的量（至少 1）
+# 熔断：同一 (api_url, model) 连续失败 BREAKER_FAILURES 次就熔断 BREAKER_COOLDOWN_SEC 秒，期间请求直接失败不发出去；
+# 冷却到点后放一个探测请求过去，成功则恢复。BREAKER_FAILURES=0 关闭熔断
+BREAKER_FAILURES = 5
+BREAKER_COOLDOWN_SEC = 30.0
+# 状态存哪：默认只在本进程内存里（一把锁，不碰盘）；MM_TRUSTBENCH_RATELIMIT_DB 给路径则存 SQLite，
+# 多个 uvicorn worker、离线脚本共用一份配额（如 data/ratelimit.db），=memory 等同不配
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    熔断期间请求直接失败，不打到服务端。
+    """
+
+
+#======状态存储======
+# 限速和熔断的状态都是一个小 dict，按 key 存；update(key, fn) 原子地读出、改、写回，fn 返回 (新状态, 结果)
+class MemoryStateStore:
+    """
+    进程内存储，一把锁保证原子。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._data: dict[str, dict] = {}
+
+    def update(self, key: str, fn: Callable[[dict], tuple[dict, Any]]) -> Any:
+        with self._lock:
+            state, out = fn(dict(self._data.get(key) or {}))
+            self._data[key] = state
+            return out
+
+
+class SQLiteStateStore:
+    """
+    SQLite 单表存储，多进程之间靠库的写锁串行，WAL 下读不阻塞。
+    update 先不加锁读一遍算新状态，没变就直接返回（成功请求清零熔断计数、不限速时大多如此），
+    要写才开 BEGIN IMMEDIATE 拿写锁、重读重算后写回，避免热路径上每次请求都抢一把跨进程写锁。
+    """
+
+    def __init__(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        # 自己管事务，关掉 sqlite3 模块的隐式 BEGIN
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS limiter_state (key TEXT PRIMARY KEY, state TEXT NOT NULL)")
+
+    def _read(self, key: str) -> dict:
+        row = self._conn.execute("SELECT state FROM limiter_state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def update(self, key: str, fn: Callable[[dict], tuple[dict, Any]]) -> Any:
+        with self._lock:
+            conn = self._conn
+            # 自动提交模式下的单条 SELECT 是个只读的 deferred 事务，不占写锁
+            old = self._read(key)
+            state, out = fn(dict(old))
+            if state == old:
+                return out
+            # 要改：拿写锁后重读，读和写之间别的进程可能已经改过，按最新状态重算
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                old = self._read(key)
+                state, out = fn(dict(old))
+                if state != old:
+                    conn.execute(
+                        "INSERT INTO limiter_state (key, state) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+                        (key, json.dumps(state)),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return out
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_state_store():
+    """
+    进程内共享的默认存储，第一次用时建：配了 MM_TRUSTBENCH_RATELIMIT_DB（且不是 memory）才用 SQLite，否则进程内存。
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            conf = os.getenv("MM_TRUSTBENCH_RATELIMIT_DB")
+            if conf and conf != "memory":
+                _default_store = SQLiteStateStore(conf)
+            else:
+                _default_store = MemoryStateStore()
+        return _default_store
+
+
+#======限速 + 熔断======
+class RateLimiter:
+    """
+    一个 (api_url, model) 一个：令牌桶限速 + 熔断器，状态放在共享存储里，多个进程看到的是同一个桶。
+    取令牌是「预约」式的：桶里不够就记负数，返回要等的秒数，调用方睡够再发，不用轮询；
+    所有进程按预约顺序排队，正好贴着配额发，不会一起撞 429。
+    服务端回 429 时按 Retry-After 把桶压成负数，所有进程一起让开。
+    """
+
+    def __init__(
+        self,
+        key: str,
+        rpm: float | None = None,
+        burst: float | None = None,
+        store=None,
+        breaker_failures: int = BREAKER_FAILURES,
+        breaker_cooldown: float = BREAKER_COOLDOWN_SEC,
+    ) -> None:
+        self.key = key
+        self.rate = rpm / 60.0 if rpm else None
+        self.capacity = max(1.0, float(burst)) if burst else max(1.0, self.rate or 0.0)
+        self.store = store
+        self.breaker_failures = max(0, int(breaker_failures))
+        self.breaker_cooldown = breaker_cooldown
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate is not None or self.breaker_failures > 0
+
+    def _store(self):
+        if self.store is None:
+            self.store = get_state_store()
+        return self.store
+
+    def _refill(self, st: dict, now: float) -> float:
+        tokens = st.get("tokens", self.capacity)
+        updated = st.get("updated", now)
+        return min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+
+    def reserve(self) -> float:
+        """
+        发请求前调：熔断中抛 CircuitOpenError；否则占一个令牌，返回还要等的秒数（0 即可直接发）。
+        """
+        if not self.enabled:
+            return 0.0
+        now = time.time()
+        kind, value = self._store().update(self.key, lambda st: self._reserve(st, now))
+        if kind == "open":
+            raise CircuitOpenError(f"{self.key} 熔断中，{value:.1f}s 后重试")
+        return value
+
+    def _reserve(self, st: dict, now: float) -> tuple[dict, tuple[str, float]]:
+        open_until = st.get("open_until", 0.0)
+        if open_until > now:
+            return st, ("open", open_until - now)
+        if open_until:
+            # 冷却到点：放这一个探测请求过去，其他的在它出结果前继续快速失败
+            st["open_until"] = now + self.breaker_cooldown
+        wait = 0.0
+        if self.rate is not None:
+            tokens = self._refill(st, now) - 1.0
+            st["tokens"], st["updated"] = tokens, now
+            wait = max(0.0, -tokens / self.rate)
+        return st, ("ok", wait)
+
+    def acquire(self) -> None:
+        """
+        同步版：占令牌并睡到可以发。
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self) -> None:
+        """
+        协程版：SQLite 存储的读写放线程里，等待用 asyncio.sleep。
+        """
+        if not self.enabled:
+            return
+        if isinstance(self._store(), MemoryStateStore):
+            wait = self.reserve()
+        else:
+            wait = await asyncio.to_thread(self.reserve)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record(self, outcome: str, retry_after: float | None = None) -> None:
+        """
+        一次请求的结果：ok 成功（熔断清零）、fail 服务端故障/超时/连不上（连续失败计数）、
+        throttled 被 429（不算故障，按 retry_after 把桶压住，让所有进程一起让开）、
+        cancel 调用方中途放弃（不算成败；若这是熔断后的探测请求，把探测名额放回去，下一个请求接着探）。
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+
+        def fn(st: dict):
+            if outcome == "ok":
+                st.pop("failures", None)
+                st.pop("open_until", None)
+            elif outcome == "fail":
+                st["failures"] = st.get("failures", 0) + 1
+                if self.breaker_failures and st["failures"] >= self.breaker_failures:
+                    st["open_until"] = now + self.breaker_cooldown
+            elif outcome == "throttled" and self.rate is not None:
+                delay = retry_after if retry_after is not None else 1.0 / self.rate
+                st["tokens"] = min(self._refill(st, now), -delay * self.rate)
+                st["updated"] = now
+            elif outcome == "cancel" and st.get("open_until", 0.0) > now:
+                st["open_until"] = now
+            return st, None
+
+        self._store().update(self.key, fn)
+
+    async def arecord(self, outcome: str, retry_after: float | None = None) -> None:
+        if not self.enabled:
+            return
+        if isinstance(self._store(), MemoryStateStore):
+            self.record(outcome, retry_after)
+        else:
+            await asyncio.to_thread(self.record, outcome, retry_after)
+
+    def state(self) -> dict:
+        """
+        当前状态快照（tokens 已按时间补过），看板 / 排查用。
+        """
+        now = time.time()
+
+        def fn(st: dict):
+            snap = dict(st)
+            if self.rate is not None:
+                snap["tokens"] = self._refill(st, now)
+            snap["open"] = st.get("open_until", 0.0) > now
+            return st, snap
+
+        return self._store().update(self.key, fn)
+
+
+#======按模型组取限速器======
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _env_float(name: str, group: str) -> float | None:
+    raw = os.getenv(f"{name}_{group}" if group not in ("", "default") else name)
+    try:
+        return float(raw) if raw else None
+    except ValueError:
+        return None
+
+
+def get_rate_limiter(api_url: str | None, model: str | None, group: str = "default") -> RateLimiter:
+    """
+    按 (api_url, model) 取限速器，同一进程里同一个模型的所有 wrapper 共用一个（配额是按服务端 + 模型算的）；
+    限速参数读 group 对应的 RATE_LIMIT_RPM / RATE_LIMIT_RPM_i、RATE_LIMIT_BURST / RATE_LIMIT_BURST_i。
+    几组指向同一 (api_url, model) 时共用一个桶，参数以最先建它的那组为准（get_available_wrappers 按 default、2、3… 的顺序建）。
+    """
+    key = f"{api_url or ''}|{model or ''}"
+    with _limiters_lock:
+        lim = _limiters.get(key)
+        if lim is None:
+            failures = os.getenv("BREAKER_FAILURES")
+            cooldown = os.getenv("BREAKER_COOLDOWN_SEC")
+            lim = _limiters[key] = RateLimiter(
+                key,
+                rpm=_env_float("RATE_LIMIT_RPM", group),
+                burst=_env_float("RATE_LIMIT_BURST", group),
+                breaker_failures=int(failures) if failures else BREAKER_FAILURES,
+                breaker_cooldown=float(cooldown) if cooldown else BREAKER_COOLDOWN_SEC,
+            )
+        return lim
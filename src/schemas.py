@@ -43,12 +43,41 @@ class HistoryTaskItem(BaseModel):
     started_at: datetime | None
     status: str
     model_name: str | None
-    total_duration_sec: int | None
-    records: list[HistoryRecordItem]
+    total_duration_sec: float | None
+    records: list[HistoryRecordItem] = []  # summary 模式下为空，记录走 /api/v1/task/{task_id}/records 分页取
+    # summary 模式：按答案分桶计数 {yes, no, refused, open}，以及记录总数
+    answer_counts: dict[str, int] | None = None
+    record_count: int | None = None
 
 
 class HistoryResponse(BaseModel):
     tasks: list[HistoryTaskItem]
+    next_cursor: str | None = None  # 下一页游标，原样传回 cursor 参数；没有更多时为 null
+
+
+#======多模型对比======
+# 同一张图 + 问题并发发给多个模型；model_ids 不传则发给全部可用模型
+class CompareRequest(BaseModel):
+    question: str
+    image_path: str | None = None
+    image_base64: str | None = None
+    model_ids: list[str] | None = None
+    answer_type: str | None = "yes_no"
+
+
+class CompareItem(BaseModel):
+    model_id: str
+    model_name: str | None
+    final_answer: str | None  # 调用失败时为 null，看 error
+    evidence: str
+    self_check: str
+    latency_sec: float
+    error: str | None = None
+
+
+class CompareResponse(BaseModel):
+    results: list[CompareItem]  # 顺序同请求里的 model_ids
+    elapsed_sec: float  # 整体耗时，约等于最慢模型的 latency_sec
 
 
 #======批量评测======
@@ -73,11 +102,19 @@ class BatchEvaluateResponse(BaseModel):
 
 #======任务状态（轮询用）======
 class TaskRecordItem(BaseModel):
+    id: int | None = None  # 记录主键，轮询时作 since 游标
     question: str
     final_answer: str
     evidence: str | None
     self_check: str | None
     created_at: datetime | None
+    # 分阶段统计：图片编码、请求字节数、上游耗时、解析耗时、token 数；取不到为 null
+    encode_sec: float | None = None
+    request_bytes: int | None = None
+    upstream_sec: float | None = None
+    parse_sec: float | None = None
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
 
 
 class TaskStatusResponse(BaseModel):
@@ -85,5 +122,18 @@ class TaskStatusResponse(BaseModel):
     status: str  # processing | completed | failed
     started_at: datetime | None
     model_name: str | None
-    total_duration_sec: int | None
+    total_duration_sec: float | None
+    records: list[TaskRecordItem]  # 带 since 时只含 id > since 的新记录
+    record_count: int = 0  # 该任务已落库的记录总数（不受 since/limit 影响）
+    next_since: int = 0  # 下次轮询带上的游标：已返回记录里最大的 id
+    # 批量进度，随每条结果更新；单条评测为 1/1，旧任务为 null
+    total_items: int | None = None
+    done_items: int | None = None
+    failed_items: int | None = None
+    eta_sec: int | None = None  # 预计剩余秒数，完成后为 0
+
+
+class TaskRecordsResponse(BaseModel):
+    task_id: str
     records: list[TaskRecordItem]
+    next_after: int | None = None  # 下一页传给 after；没有更多时为 null
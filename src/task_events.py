@@ -0,0 +1,54 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+#======配置区======
+# 订阅方最长等这么久没被唤醒就自己回库里查一次，顺带发心跳；
+# 兜住别的进程（多 worker 部署）写的任务，本进程收不到通知的情况
+TASK_EVENTS_HEARTBEAT_SEC = 15.0
+
+
+#======任务事件通知======
+class TaskEventHub:
+    """
+    按 task_id 的进程内唤醒：写线程把某任务的 Record/进度提交落盘后调 notify，
+    订阅这个任务的 SSE 连接醒来，再去库里按游标取增量。只传「有变化」这个信号，数据始终以库为准。
+    notify 可在任意线程调，通过订阅方所在事件循环的 call_soon_threadsafe 置位。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._subs: dict[str, set[tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+
+    @contextmanager
+    def subscribe(self, task_id: str) -> Iterator[asyncio.Event]:
+        """
+        订阅一个任务，返回一个 Event，有新提交时被置位；用完（with 退出）自动退订。只能在协程里用。
+        """
+        entry = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._subs.setdefault(task_id, set()).add(entry)
+        try:
+            yield entry[1]
+        finally:
+            with self._lock:
+                subs = self._subs.get(task_id)
+                if subs is not None:
+                    subs.discard(entry)
+                    if not subs:
+                        del self._subs[task_id]
+
+    def notify(self, task_id: str) -> None:
+        with self._lock:
+            subs = list(self._subs.get(task_id, ()))
+        for loop, event in subs:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # 订阅方的循环已关，等它自己退订
+                pass
+
+    def subscribers(self, task_id: str) -> int:
+        with self._lock:
+            return len(self._subs.get(task_id, ()))
@@ -0,0 +1,336 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterable, Iterator
+
+#======配置区======
+# 耗时直方图的桶（秒）：从几毫秒的解析 / 落库到几十秒的模型调用
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 大小直方图的桶（字节 / 字符）：短问题到整张 base64 大图
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# 一组提交的写操作条数
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 256)
+
+
+#======指标类型（Prometheus 文本格式，不依赖 prometheus_client）======
+# 每个 label 组合一个子对象，自带一把锁；热路径上只有一次 dict 查找 + 加锁加数，开销可以忽略
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), registry: "Registry | None" = None) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += self._samples()
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1.0) -> None:
+        with self._lock:
+            self.value += n
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, n: float = 1.0) -> None:
+        self.labels().inc(n)
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_label_str(self.labelnames, k)} {_fmt(c.value)}" for k, c in list(self._children.items())]
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, n: float = 1.0) -> None:
+        self.inc(-n)
+
+    def set(self, v: float) -> None:
+        with self._lock:
+            self.value = v
+
+
+class Gauge(_Metric):
+    """
+    可增可减的量。也可以 set_function：抓取时调一次函数现算，返回 {label 值元组: 数值}，适合队列长度这类现成的数。
+    """
+
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._fn: Callable[[], dict] | None = None
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set_function(self, fn: Callable[[], dict]) -> None:
+        self._fn = fn
+
+    def _samples(self) -> list[str]:
+        if self._fn is not None:
+            try:
+                values = self._fn()
+            except Exception:
+                # 现算失败（如库暂时不可用）就不出这一项，别让整个 /metrics 挂掉
+                return []
+            return [f"{self.name}{_label_str(self.labelnames, tuple(str(x) for x in k))} {_fmt(v)}" for k, v in values.items()]
+        return [f"{self.name}{_label_str(self.labelnames, k)} {_fmt(c.value)}" for k, c in list(self._children.items())]
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, v: float) -> None:
+        i = bisect_left(self.buckets, v)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += v
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "t0")
+
+    def __init__(self, child: _HistogramChild) -> None:
+        self.child = child
+
+    def __enter__(self) -> "_Timer":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.child.observe(time.perf_counter() - self.t0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS, registry=None) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, v: float) -> None:
+        self.labels().observe(v)
+
+    def _samples(self) -> list[str]:
+        out = []
+        for key, c in list(self._children.items()):
+            with c._lock:
+                counts, total = list(c.counts), c.sum
+            acc = 0
+            for le, n in zip(self.buckets + (float("inf"),), counts):
+                acc += n
+                le_label = 'le="' + _fmt(le) + '"'
+                out.append(f"{self.name}_bucket{_label_str(self.labelnames, key, le_label)} {acc}")
+            out.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {_fmt(total)}")
+            out.append(f"{self.name}_count{_label_str(self.labelnames, key)} {acc}")
+        return out
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: list[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        """
+        全部指标的 Prometheus 文本格式（exposition format 0.0.4）。
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+#======热路径指标======
+# 模型调用：按模型 + 结果（HTTP 状态码 / timeout / connect）分的每次尝试耗时，在飞请求数，请求与回复大小
+MODEL_REQUEST_SECONDS = Histogram(
+    "mm_trustbench_model_request_duration_seconds", "模型 HTTP 请求耗时（每次尝试）", ("model", "status"),
+)
+MODEL_IN_FLIGHT = Gauge("mm_trustbench_model_requests_in_flight", "正在等模型回复的请求数", ("model",))
+MODEL_REQUEST_BYTES = Histogram(
+    "mm_trustbench_model_request_bytes", "发给模型的 prompt + 图片 data URL 字节数", ("model",), buckets=SIZE_BUCKETS,
+)
+MODEL_RESPONSE_CHARS = Histogram(
+    "mm_trustbench_model_response_chars", "模型回复字符数", ("model",), buckets=SIZE_BUCKETS,
+)
+# 流水线：解析耗时、按答案归类的计数（error 即模型调用失败）
+PARSE_SECONDS = Histogram("mm_trustbench_parse_duration_seconds", "回复解析耗时", ("answer_type",))
+ANSWERS = Counter("mm_trustbench_answers_total", "按答案归类的评测条数", ("model", "answer"))
+# 落库：写后队列每次 group commit 的耗时与条数
+DB_COMMIT_SECONDS = Histogram("mm_trustbench_db_commit_duration_seconds", "写后队列一组写操作从开始执行到 commit 完的耗时")
+DB_COMMIT_OPS = Histogram("mm_trustbench_db_commit_ops", "每次 commit 的写操作条数", buckets=COUNT_BUCKETS)
+DB_WRITE_FAILURES = Counter("mm_trustbench_db_write_failures_total", "写失败的写操作条数")
+# API：在飞请求数与按路由的耗时
+HTTP_IN_FLIGHT = Gauge("mm_trustbench_http_requests_in_flight", "正在处理的 HTTP 请求数")
+HTTP_REQUEST_SECONDS = Histogram(
+    "mm_trustbench_http_request_duration_seconds", "HTTP 请求耗时（流式响应算到最后一个字节）", ("method", "route", "status"),
+)
+
+
+def answer_bucket(raw: str, answer: str) -> str:
+    """
+    答案归类：调用失败 error，yes / no / refused 原样，其余（开放题）为 open。
+    """
+    if (raw or "").strip() == "Error":
+        return "error"
+    return answer if answer in ("yes", "no", "refused") else "open"
+
+
+#======单条评测的分阶段统计======
+# 每条评测各阶段的耗时 / 大小 / token 数，随结果落库、写进结果 jsonl，analysis.py 据此出分位数。
+# 流水线开一个 capture_stats，调用链下游（wrapper）往里记；按 contextvar 传，协程、to_thread 都能跟着走，
+# 不用改 predict / apredict 的签名。不在 capture_stats 里调用时记了也是丢掉
+STAT_FIELDS = ("encode_sec", "request_bytes", "upstream_sec", "parse_sec", "prompt_tokens", "completion_tokens")
+_call_stats: ContextVar[dict | None] = ContextVar("mm_trustbench_call_stats", default=None)
+
+
+@contextmanager
+def capture_stats() -> Iterator[dict]:
+    stats: dict = {}
+    token = _call_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        try:
+            _call_stats.reset(token)
+        except ValueError:
+            # 流式生成器被别的上下文关掉（如 GC 时 aclose）时 token 对不上，值留在那份上下文里也无妨
+            pass
+
+
+def add_stats(**values) -> None:
+    """
+    往当前的分阶段统计里累加（重试多次的上游耗时加在一起）；值为 None 的跳过。
+    """
+    stats = _call_stats.get()
+    if stats is None:
+        return
+    for k, v in values.items():
+        if v is not None:
+            stats[k] = stats.get(k, 0) + v
+
+
+def set_stats(**values) -> None:
+    """
+    覆盖写（token 数以最后一次成功的回复为准）。
+    """
+    stats = _call_stats.get()
+    if stats is None:
+        return
+    stats.update({k: v for k, v in values.items() if v is not None})
+
+
+def round_stats(stats: dict | None) -> dict:
+    """
+    只留 STAT_FIELDS 里的项，秒数保留 4 位小数，缺的记 None。落库、写 jsonl 前用。
+    """
+    stats = stats or {}
+    out = {}
+    for k in STAT_FIELDS:
+        v = stats.get(k)
+        out[k] = round(v, 4) if isinstance(v, float) else v
+    return out
+
+
+#======ASGI 中间件======
+class MetricsMiddleware:
+    """
+    统计在飞请求数与每个请求的耗时。路由按模板记（/api/v1/task/{task_id}），不按实际路径，避免标签无限增长。
+    纯 ASGI 实现，不经 BaseHTTPMiddleware，流式响应不受影响。
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def send_wrapper(message) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        gauge = HTTP_IN_FLIGHT.labels()
+        gauge.inc()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            gauge.dec()
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope.get("method", ""), getattr(route, "path", "unmatched"), status["code"],
+            ).observe(time.perf_counter() - t0)
@@ -1,5 +1,14 @@
 import re
-from typing import Dict, Any
+import time
+import asyncio
+from bisect import bisect_left
+from typing import Dict, Any, AsyncIterator, Iterable
+
+# 既会被 src.api 当包内模块导入，也会被 main.py 按顶层模块导入，两种都兼容
+try:
+    from .telemetry import PARSE_SECONDS, ANSWERS, answer_bucket, capture_stats, add_stats, round_stats
+except ImportError:
+    from telemetry import PARSE_SECONDS, ANSWERS, answer_bucket, capture_stats, add_stats, round_stats
 
 #======配置区======
 # 让模型按这三段输出，正则按这个抠
@@ -7,6 +16,203 @@ EVIDENCE_HEAD = "Evidence:"
 SELF_CHECK_HEAD = "Self-check:"
 ANSWER_HEAD = "Answer:"
 
+# 解析用的正则全部预编译。三个段标题合成一个（不区分大小写），一遍扫出所有标题位置，各段按位置切片
+_HEAD_RE = re.compile(
+    "(?P<ev>" + re.escape(EVIDENCE_HEAD) + ")|(?P<sc>" + re.escape(SELF_CHECK_HEAD) + ")|(?P<ans>" + re.escape(ANSWER_HEAD) + ")",
+    re.IGNORECASE,
+)
+_HEADS_LOWER = (EVIDENCE_HEAD.lower(), SELF_CHECK_HEAD.lower(), ANSWER_HEAD.lower())
+_HEAD_MAX_LEN = max(len(h) for h in _HEADS_LOWER)
+_WS_RE = re.compile(r"\s*")
+_WORD_RE = re.compile(r"\w+")
+# 段尾残留的下一段编号，如 "...\n2)"
+_TRAILING_ITEM_RE = re.compile(r"\n+\s*\d+\)\s*$")
+_UNSUPPORTED_RE = re.compile(r"\bunsupported\b", re.IGNORECASE)
+
+
+class ModelCallError(RuntimeError):
+    """
+    模型调用失败（重试耗尽、熔断中、鉴权失败等，wrapper 约定返回 "Error"）。
+    和拒答区分开：调用方不该把它当 refused 记进结果，离线评测不落盘、作业队列按失败重试。
+    """
+
+
+#======解析======
+def _find_heads(text: str, pos: int = 0) -> tuple[list, list, list]:
+    """
+    找出三种段标题在 text[pos:] 里的全部 (start, end)，坐标相对整个 text。纯 ASCII 文本转小写后用 str.find，比正则快几倍；
+    含非 ASCII 字符时走 _HEAD_RE，保证和 IGNORECASE 的 Unicode 大小写规则一致。
+    """
+    tail = text[pos:] if pos else text
+    if tail.isascii():
+        low = tail.lower()
+        found = []
+        for head in _HEADS_LOWER:
+            spans = []
+            i = low.find(head)
+            while i >= 0:
+                spans.append((pos + i, pos + i + len(head)))
+                i = low.find(head, i + len(head))
+            found.append(spans)
+        return found[0], found[1], found[2]
+    ev_heads, sc_heads, ans_heads = [], [], []
+    for m in _HEAD_RE.finditer(text, pos):
+        kind = m.lastgroup
+        if kind == "ev":
+            ev_heads.append(m.span())
+        elif kind == "sc":
+            sc_heads.append(m.span())
+        else:
+            ans_heads.append(m.span())
+    return ev_heads, sc_heads, ans_heads
+
+
+def _section(text: str, heads: list, stop_starts: list) -> str:
+    """
+    从第一个 heads 标题之后切到它后面第一个 stop 标题（没有就到结尾），去首尾空白和段尾残留编号。
+    """
+    if not heads:
+        return ""
+    start = heads[0][1]
+    i = bisect_left(stop_starts, start)
+    end = stop_starts[i] if i < len(stop_starts) else len(text)
+    sec = text[start:end].strip()
+    # 残留编号必以 ")" 结尾，先用 endswith 挡掉绝大多数不用跑正则的情况
+    if sec.endswith(")"):
+        sec = _TRAILING_ITEM_RE.sub("", sec)
+    return sec
+
+
+def parse_response(raw: str, answer_type: str = "yes_no") -> Dict[str, Any]:
+    """
+    单遍解析：一次扫描拿到所有段标题位置，再按位置切出三段，不再对全文反复跑懒惰 DOTALL 正则。
+    取段规则：每段取第一次出现的标题，到其后第一次出现的下一段标题为止；
+    Answer 取第一个后面（跳过空白）真有内容的标题，yes_no 取一个词，open 取到空行或结尾。
+    """
+    evidence = ""
+    self_check = ""
+    answer = "refused"
+
+    if not raw or raw.strip() == "Error":
+        return {"answer": "refused", "evidence": evidence, "self_check": self_check, "raw": raw or ""}
+
+    text = raw.strip()
+    ev_heads, sc_heads, ans_heads = _find_heads(text)
+    sc_starts = [h[0] for h in sc_heads]
+    ans_starts = [h[0] for h in ans_heads]
+    evidence = _section(text, ev_heads, sc_starts)
+    self_check = _section(text, sc_heads, ans_starts)
+
+    n = len(text)
+    if answer_type == "open":
+        # Answer 段取到结尾或下一个空行，整段作为答案；若为 Unsupported 则 refused
+        for _, head_end in ans_heads:
+            start = _WS_RE.match(text, head_end).end()
+            if start >= n:
+                # 标题后面啥也没有，看下一个 Answer 标题（text 已 strip，不会以空白结尾）
+                continue
+            end = text.find("\n\n", start + 1)
+            a = text[start:end if end >= 0 else n].strip()
+            if _UNSUPPORTED_RE.search(a):
+                answer = "refused"
+            else:
+                answer = a.split("\n")[0].strip() or "refused"
+            break
+        return {"answer": answer, "evidence": evidence, "self_check": self_check, "raw": raw}
+
+    # yes_no：只认一个词，取第一个后面紧跟单词的 Answer 标题
+    for _, head_end in ans_heads:
+        m = _WORD_RE.match(text, _WS_RE.match(text, head_end).end())
+        if m:
+            a = m.group().lower()
+            if a == "yes":
+                answer = "yes"
+            elif a == "no":
+                answer = "no"
+            break
+    if answer in ("yes", "no") and "unsupported" in self_check.lower():
+        answer = "refused"
+    return {"answer": answer, "evidence": evidence, "self_check": self_check, "raw": raw}
+
+
+class StreamParser:
+    """
+    流式回复的增量解析：每喂一段文本，返回这次刚刚定稿的段 [(section, text), ...]。
+    段的定稿规则与 parse_response 一致：Evidence 在其后出现 Self-check 标题时定稿，Self-check 在其后出现 Answer 标题时定稿，
+    Answer 在 yes_no 下读到完整一个词、open 下读到空行时定稿（answer_done 置真）；流结束时调 finish 收尾。
+    定稿的段和最终 parse_response(全文) 结果相同，前提是模型按 Evidence → Self-check → Answer 的顺序输出。
+    """
+
+    def __init__(self, answer_type: str = "yes_no") -> None:
+        self.answer_type = answer_type
+        self.text = ""
+        self.answer_done = False
+        self._emitted: set[str] = set()
+        # 已扫过的标题和下次扫描起点；每段只扫新到的尾巴，回退一个标题长度接住跨段切开的标题
+        self._heads: tuple[list, list, list] = ([], [], [])
+        self._scan_from = 0
+        # open 题找空行的起点，同样只看新到的部分
+        self._blank_from = 0
+
+    def feed(self, chunk: str) -> list[tuple[str, str]]:
+        if not chunk:
+            return []
+        self.text += chunk
+        self._scan()
+        ev_heads, sc_heads, ans_heads = self._heads
+        out = []
+        if "evidence" not in self._emitted and ev_heads and bisect_left([h[0] for h in sc_heads], ev_heads[0][1]) < len(sc_heads):
+            out.append(("evidence", None))
+        if "self_check" not in self._emitted and sc_heads and bisect_left([h[0] for h in ans_heads], sc_heads[0][1]) < len(ans_heads):
+            out.append(("self_check", None))
+        if not self.answer_done and self._answer_complete(ans_heads):
+            self.answer_done = True
+            out.append(("answer", None))
+        if not out:
+            return []
+        # 有段定稿才整体解析一次（每段至多一次），取值和最终结果同源
+        parsed = parse_response(self.text, self.answer_type)
+        self._emitted.update(name for name, _ in out)
+        return [(name, parsed[name]) for name, _ in out]
+
+    def _scan(self) -> None:
+        """
+        在上次扫描之后新到的文本里找标题，追加到已知列表；回退区里重复找到的标题按起点去重。
+        """
+        for known, found in zip(self._heads, _find_heads(self.text, self._scan_from)):
+            last = known[-1][0] if known else -1
+            known.extend(span for span in found if span[0] > last)
+        self._scan_from = max(0, len(self.text) - _HEAD_MAX_LEN + 1)
+
+    def _answer_complete(self, ans_heads: list) -> bool:
+        text = self.text
+        n = len(text)
+        for _, head_end in ans_heads:
+            start = _WS_RE.match(text, head_end).end()
+            if start >= n:
+                # 标题后面还没来内容，等下一段
+                return False
+            if self.answer_type == "open":
+                done = text.find("\n\n", max(start + 1, self._blank_from)) >= 0
+                # 下次从结尾前一个字符找起，接住跨段的 "\n" + "\n"
+                self._blank_from = n - 1
+                return done
+            m = _WORD_RE.match(text, start)
+            if m:
+                # 词正好在结尾可能还没收全（"ye" → "yes"）
+                return m.end() < n
+        return False
+
+    def finish(self) -> tuple[list[tuple[str, str]], Dict[str, Any]]:
+        """
+        流结束：返回还没发过的段和最终解析结果。
+        """
+        parsed = parse_response(self.text, self.answer_type)
+        rest = [(name, parsed[name]) for name in ("evidence", "self_check", "answer") if name not in self._emitted]
+        self._emitted.update(name for name, _ in rest)
+        self.answer_done = True
+        return rest, parsed
+
 
 #======证据+自检流水线======
 class TrustPipeline:
@@ -15,11 +221,38 @@ class TrustPipeline:
     若自检说不支持或答 Unsupported，则拒答，不强行给 yes/no。
     """
 
-    def __init__(self, wrapper) -> None:
+    def __init__(self, wrapper, cache=None) -> None:
         """
-        wrapper 需有 predict(image_path: str, question: str) -> str。
+        wrapper 需有 predict(image_path: str, question: str) -> str；有 apredict 协程时 aprocess 优先用它。
+        cache 可选（见 cache.ResponseCache），按 模型+图片指纹+prompt+answer_type 缓存原始回复；
+        命中后仍走 _parse_response，改解析逻辑不用重新调接口。
         """
         self.wrapper = wrapper
+        self.cache = cache
+
+    def _cache_lookup(self, prompt: str, answer_type: str, image_path: str | None, image_base64: str | None) -> tuple[str | None, str | None]:
+        """
+        查缓存，返回 (key, raw)；没开缓存时 key 为 None，未命中时 raw 为 None。
+        """
+        if self.cache is None:
+            return None, None
+        # wrapper 上传前若对图做了预处理，模型看到的图就不同，要区分开
+        preprocessor = getattr(self.wrapper, "preprocessor", None)
+        key = self.cache.key_for(
+            getattr(self.wrapper, "model", "") or "",
+            prompt,
+            answer_type,
+            image_path=image_path,
+            image_base64=image_base64,
+            variant=getattr(preprocessor, "signature", "") if preprocessor is not None else "",
+            image_cache=getattr(self.wrapper, "image_cache", None),
+        )
+        return key, self.cache.get(key)
+
+    def _cache_store(self, key: str | None, raw: str) -> None:
+        # 调用失败的 "Error" 不缓存，下次还要真调
+        if key is not None and raw and raw.strip() != "Error":
+            self.cache.set(key, raw)
 
     def _build_prompt(self, question: str, answer_type: str = "yes_no") -> str:
         """
@@ -53,51 +286,26 @@ class TrustPipeline:
         从模型回复里抠 Evidence、Self-check、Answer。
         yes_no 时 answer 仅为 yes/no/refused；open 时为 Answer 段整段文本，Unsupported 则 refused。
         """
-        evidence = ""
-        self_check = ""
-        answer = "refused"
+        t0 = time.perf_counter()
+        parsed = parse_response(raw, answer_type=answer_type)
+        elapsed = time.perf_counter() - t0
+        PARSE_SECONDS.labels(answer_type).observe(elapsed)
+        add_stats(parse_sec=elapsed)
+        self._count_answer(parsed)
+        return parsed
 
-        if not raw or raw.strip() == "Error":
-            return {"answer": "refused", "evidence": evidence, "self_check": self_check, "raw": raw or ""}
-
-        text = raw.strip()
-        ev_pat = re.escape(EVIDENCE_HEAD) + r"\s*(.*?)(?=" + re.escape(SELF_CHECK_HEAD) + r"|$)"
-        ev_match = re.search(ev_pat, text, re.DOTALL | re.IGNORECASE)
-        if ev_match:
-            evidence = ev_match.group(1).strip()
-            evidence = re.sub(r"\n+\s*\d+\)\s*$", "", evidence)
-        sc_pat = re.escape(SELF_CHECK_HEAD) + r"\s*(.*?)(?=" + re.escape(ANSWER_HEAD) + r"\s*|$)"
-        sc_match = re.search(sc_pat, text, re.DOTALL | re.IGNORECASE)
-        if sc_match:
-            self_check = sc_match.group(1).strip()
-            self_check = re.sub(r"\n+\s*\d+\)\s*$", "", self_check)
+    def _count_answer(self, parsed: Dict[str, Any]) -> None:
+        model = getattr(self.wrapper, "model", None) or "unknown"
+        ANSWERS.labels(model, answer_bucket(parsed.get("raw", ""), parsed.get("answer"))).inc()
 
-        if answer_type == "open":
-            # Answer 段取到结尾或下一段，整段作为答案；若为 Unsupported 则 refused
-            ans_pat = re.escape(ANSWER_HEAD) + r"\s*(.+?)(?=\n\n|$)"
-            ans_match = re.search(ans_pat, text, re.DOTALL | re.IGNORECASE)
-            if ans_match:
-                a = ans_match.group(1).strip()
-                if re.search(r"\bunsupported\b", a, re.IGNORECASE):
-                    answer = "refused"
-                else:
-                    answer = a.split("\n")[0].strip() or "refused"
-            return {"answer": answer, "evidence": evidence, "self_check": self_check, "raw": raw}
-
-        # yes_no：只认一个词
-        ans_pat = re.escape(ANSWER_HEAD) + r"\s*(\w+)"
-        ans_match = re.search(ans_pat, text, re.IGNORECASE)
-        if ans_match:
-            a = ans_match.group(1).strip().lower()
-            if a == "yes":
-                answer = "yes"
-            elif a == "no":
-                answer = "no"
-        if answer not in ("yes", "no"):
-            answer = "refused"
-        elif "unsupported" in self_check.lower():
-            answer = "refused"
-        return {"answer": answer, "evidence": evidence, "self_check": self_check, "raw": raw}
+    def _check_raw(self, raw: str) -> None:
+        """
+        wrapper 返回 "Error" 说明这次没调通：记一笔 error 桶后抛 ModelCallError，不解析成拒答。
+        """
+        if (raw or "").strip() == "Error":
+            model = getattr(self.wrapper, "model", None) or "unknown"
+            ANSWERS.labels(model, "error").inc()
+            raise ModelCallError("模型调用失败")
 
     def process(
         self,
@@ -109,10 +317,156 @@ class TrustPipeline:
         """
         入口：拼 prompt → 调 wrapper → 解析三段。answer_type 为 yes_no 时 answer 仅 yes/no/refused，为 open 时可数字或短句。
         图片二选一：image_path 或 image_base64，透传给 wrapper。
+        返回值另带 stats：图片编码、请求字节数、上游耗时、解析耗时、prompt / completion token 数（缓存命中时只有解析耗时）。
+        模型调用失败（wrapper 返回 "Error"）时抛 ModelCallError，不当拒答返回。
+        """
+        with capture_stats() as stats:
+            prompt = self._build_prompt(question, answer_type=answer_type)
+            key, raw = self._cache_lookup(prompt, answer_type, image_path, image_base64)
+            if raw is None:
+                raw = self.wrapper.predict(image_path=image_path, question=prompt, image_base64=image_base64)
+                self._cache_store(key, raw)
+            self._check_raw(raw)
+            parsed = self._parse_response(raw, answer_type=answer_type)
+        return dict(parsed, stats=round_stats(stats))
+
+    async def aprocess(
+        self,
+        image_path: str | None = None,
+        question: str = "",
+        image_base64: str | None = None,
+        answer_type: str = "yes_no",
+    ) -> Dict[str, Any]:
         """
-        prompt = self._build_prompt(question, answer_type=answer_type)
-        raw = self.wrapper.predict(image_path=image_path, question=prompt, image_base64=image_base64)
-        return self._parse_response(raw, answer_type=answer_type)
+        process 的协程版。wrapper 有 apredict 就直接 await；只有同步 predict 的放线程里跑，不卡事件循环。
+        调用失败同样抛 ModelCallError。
+        """
+        with capture_stats() as stats:
+            prompt = self._build_prompt(question, answer_type=answer_type)
+            key, raw = None, None
+            if self.cache is not None:
+                # 算图片指纹、查 SQLite 都是阻塞的，放线程里
+                key, raw = await asyncio.to_thread(self._cache_lookup, prompt, answer_type, image_path, image_base64)
+            if raw is None:
+                raw = await self._afetch(prompt, image_path, image_base64, key)
+            self._check_raw(raw)
+            parsed = self._parse_response(raw, answer_type=answer_type)
+        return dict(parsed, stats=round_stats(stats))
+
+    async def _afetch(self, prompt: str, image_path: str | None, image_base64: str | None, key: str | None) -> str:
+        """
+        缓存未命中时真调模型拿全文并回写缓存。wrapper 有 apredict 就直接 await，只有同步 predict 的放线程里跑。
+        """
+        apredict = getattr(self.wrapper, "apredict", None)
+        if apredict is not None:
+            raw = await apredict(image_path=image_path, question=prompt, image_base64=image_base64)
+        else:
+            raw = await asyncio.to_thread(
+                self.wrapper.predict, image_path=image_path, question=prompt, image_base64=image_base64
+            )
+        if key is not None:
+            await asyncio.to_thread(self._cache_store, key, raw)
+        return raw
+
+    async def astream(
+        self,
+        image_path: str | None = None,
+        question: str = "",
+        image_base64: str | None = None,
+        answer_type: str = "yes_no",
+        stop_at_answer: bool = True,
+    ) -> AsyncIterator[tuple[str, Any]]:
+        """
+        流式版 aprocess，逐个产出 (event, data)：
+        delta 为模型新吐出的文本；evidence / self_check / answer 为刚定稿的段；最后一个 done 为完整解析结果（同 aprocess 返回值）。
+        stop_at_answer 为真时 Answer 定稿后不再读流，提前断开省掉后面的生成。
+        缓存命中、或 wrapper 没有 astream 时退化为一次性拿全文，照样按段产出。
+        模型调用失败（一个字没拿到就失败，wrapper 产出 "Error"）时抛 ModelCallError，不产出 delta 和 done。
+        """
+        with capture_stats() as stats:
+            prompt = self._build_prompt(question, answer_type=answer_type)
+            key, raw = None, None
+            if self.cache is not None:
+                key, raw = await asyncio.to_thread(self._cache_lookup, prompt, answer_type, image_path, image_base64)
+            parser = StreamParser(answer_type)
+            astream = getattr(self.wrapper, "astream", None)
+            if raw is None and astream is not None:
+                complete = True
+                stream = astream(image_path=image_path, question=prompt, image_base64=image_base64)
+                try:
+                    async for chunk in stream:
+                        if not parser.text:
+                            self._check_raw(chunk)
+                        yield "delta", chunk
+                        for name, value in _timed_feed(parser, chunk):
+                            yield name, value
+                        if stop_at_answer and parser.answer_done:
+                            complete = False
+                            break
+                finally:
+                    await stream.aclose()
+                # 提前断开的是残缺回复，不进缓存，免得非流式请求拿到截断的 raw
+                if key is not None and complete:
+                    await asyncio.to_thread(self._cache_store, key, parser.text)
+            else:
+                if raw is None:
+                    raw = await self._afetch(prompt, image_path, image_base64, key)
+                self._check_raw(raw)
+                yield "delta", raw
+                for name, value in _timed_feed(parser, raw):
+                    yield name, value
+            t0 = time.perf_counter()
+            rest, parsed = parser.finish()
+            add_stats(parse_sec=time.perf_counter() - t0)
+            self._count_answer(parsed)
+            parsed = dict(parsed, stats=round_stats(stats))
+        for name, value in rest:
+            yield name, value
+        yield "done", parsed
+
+
+def _timed_feed(parser: StreamParser, chunk: str) -> list[tuple[str, str]]:
+    # 流式解析是边收边做的，解析耗时按每段 feed 累加
+    t0 = time.perf_counter()
+    events = parser.feed(chunk)
+    add_stats(parse_sec=time.perf_counter() - t0)
+    return events
+
+
+#======多模型并发对比======
+async def afan_out(
+    pipelines: Iterable[tuple[str, TrustPipeline]],
+    question: str,
+    image_path: str | None = None,
+    image_base64: str | None = None,
+    answer_type: str = "yes_no",
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    同一张图 + 问题同时发给多个模型，谁先答完先产出谁，慢模型不挡快模型；总耗时约等于最慢的那个，而不是逐个相加。
+    每条：model_id、model_name、answer、evidence、self_check、raw、latency_sec、error（成功为 None）。
+    单个模型失败只在它那条里带 error。图片编码走共享的图片缓存，并发请求同一张图只编码一次。
+    调用方提前 aclose 时还没答完的请求一并取消。
+    """
+    async def one(model_id: str, pipeline: TrustPipeline) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        out: Dict[str, Any] = {"model_id": model_id, "model_name": getattr(pipeline.wrapper, "model", None)}
+        try:
+            result = await pipeline.aprocess(
+                image_path=image_path, question=question, image_base64=image_base64, answer_type=answer_type,
+            )
+            out.update(result, error=None)
+        except Exception as e:
+            out.update(answer=None, evidence="", self_check="", raw="", error=str(e) or type(e).__name__)
+        out["latency_sec"] = round(time.perf_counter() - t0, 3)
+        return out
+
+    tasks = [asyncio.ensure_future(one(mid, p)) for mid, p in pipelines]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        for t in tasks:
+            t.cancel()
 
 
 #======自测======
@@ -0,0 +1,263 @@
+import os
+import socket
+import signal
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from functools import partial
+from typing import Any, Callable
+
+from .wrapper import ModelWrapper, get_available_wrappers, aclose_async_client, IMAGE_DETAIL
+from .trust_pipeline import TrustPipeline
+from .cache import ResponseCache
+from .batch_executor import BatchExecutor
+from .preprocess import ImagePreprocessor
+from .job_queue import LEASE_SEC, MAX_ATTEMPTS, op_claim, op_heartbeat, op_settle, op_release, op_pending
+
+logger = logging.getLogger("mm_trustbench")
+
+#======配置区======
+# 单个 worker 进程同时持有的作业数上限；实际打到模型的并发仍受 BATCH_CONCURRENCY 限流
+DEFAULT_MAX_IN_FLIGHT = 32
+# 队列空时隔多久再来领一次
+DEFAULT_POLL_SEC = 1.0
+
+
+#======流水线装配（API 与 worker 共用）======
+def load_pipelines() -> tuple[dict[str, TrustPipeline], ResponseCache | None, ImagePreprocessor | None]:
+    """
+    按环境变量建好各 model_id 的流水线，返回 (pipelines, 回复缓存, 预处理器)。
+    MM_TRUSTBENCH_CACHE=memory 只开内存层，=某路径 再加 SQLite 持久层；MM_TRUSTBENCH_PREPROCESS=jpeg/webp 开上传前压缩。
+    """
+    cache_conf = os.getenv("MM_TRUSTBENCH_CACHE")
+    cache = ResponseCache(None if cache_conf == "memory" else cache_conf) if cache_conf else None
+    preprocess_conf = (os.getenv("MM_TRUSTBENCH_PREPROCESS") or "").strip().upper()
+    preprocessor = None
+    if preprocess_conf:
+        preprocessor = ImagePreprocessor(detail=IMAGE_DETAIL, fmt="WEBP" if preprocess_conf == "WEBP" else "JPEG")
+    pipelines: dict[str, TrustPipeline] = {}
+    for mid, wr in get_available_wrappers(preprocessor=preprocessor):
+        pipelines[mid] = TrustPipeline(wr, cache=cache)
+    if not pipelines:
+        # 测试环境可能只有 API_KEY=test_key，仍建 default
+        try:
+            pipelines["default"] = TrustPipeline(ModelWrapper(preprocessor=preprocessor), cache=cache)
+        except ValueError:
+            pass
+    return pipelines, cache, preprocessor
+
+
+#======作业执行======
+class JobRunner:
+    """
+    从 SQLite 作业队列领作业、跑模型、回写结果。领取 / 续租 / 结算都是写后队列里的 op，
+    和其他落库操作一起 group commit；模型调用按 model_id 走 BatchExecutor 的公平限流，owner 是任务 UUID。
+    手上有作业时每 lease_sec/3 续一次租；进程崩了租约自然过期，作业被别的 worker 重领。
+    """
+
+    def __init__(
+        self,
+        writer,
+        get_pipeline: Callable[[str], Any],
+        executor: BatchExecutor | None = None,
+        owner: str | None = None,
+        lease_sec: float = LEASE_SEC,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        max_attempts: int = MAX_ATTEMPTS,
+        on_change: Callable[[str], Any] | None = None,
+    ) -> None:
+        self.writer = writer
+        self.get_pipeline = get_pipeline
+        self.executor = executor or BatchExecutor()
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_sec = lease_sec
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_attempts = max_attempts
+        self.on_change = on_change
+        self.stats = {"claimed": 0, "done": 0, "errors": 0}
+
+    async def _call(self, op):
+        return await asyncio.wrap_future(self.writer.submit(op))
+
+    async def drain(self, task_pk: int | None = None, poll_sec: float = DEFAULT_POLL_SEC) -> None:
+        """
+        把队列（给了 task_pk 就只看这个任务）跑到没有排队中的作业为止；推迟重试的会等到点再领。
+        """
+        await self._pump(task_pk=task_pk, stop=None, poll_sec=poll_sec)
+
+    async def serve(self, stop: asyncio.Event, poll_sec: float = DEFAULT_POLL_SEC) -> None:
+        """
+        常驻领作业，直到 stop 被置位；退出时手上没跑完的作业放回队列。
+        """
+        await self._pump(task_pk=None, stop=stop, poll_sec=poll_sec)
+
+    async def _pump(self, task_pk: int | None, stop: asyncio.Event | None, poll_sec: float) -> None:
+        running: set[asyncio.Task] = set()
+        # 本轮手上还没结算的领取 token -> 作业数，续租和退出释放都按它来；drain 可能几个同时跑，各管各的
+        held: dict[str, int] = {}
+        heartbeat = asyncio.create_task(self._heartbeat(held))
+        try:
+            while stop is None or not stop.is_set():
+                free = self.max_in_flight - len(running)
+                jobs = await self._claim(free, task_pk, held) if free > 0 else []
+                for job in jobs:
+                    running.add(asyncio.create_task(self._run_job(job, held)))
+                if jobs and len(running) < self.max_in_flight:
+                    # 还有空位，接着领，直到领空
+                    continue
+                if running:
+                    _, running = await asyncio.wait(running, timeout=poll_sec, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                if stop is None and not await self._call(partial(op_pending, task_pk=task_pk)):
+                    return
+                await self._sleep(stop, poll_sec)
+        finally:
+            for t in running:
+                t.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+            heartbeat.cancel()
+            await self._release(held)
+
+    async def _sleep(self, stop: asyncio.Event | None, sec: float) -> None:
+        if stop is None:
+            await asyncio.sleep(sec)
+            return
+        try:
+            await asyncio.wait_for(stop.wait(), sec)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _claim(self, limit: int, task_pk: int | None, held: dict[str, int]) -> list[dict]:
+        jobs = await self._call(partial(
+            op_claim, owner=self.owner, limit=limit, lease_sec=self.lease_sec,
+            task_pk=task_pk, max_attempts=self.max_attempts,
+        ))
+        for job in jobs:
+            held[job["token"]] = held.get(job["token"], 0) + 1
+        self.stats["claimed"] += len(jobs)
+        return jobs
+
+    async def _heartbeat(self, held: dict[str, int]) -> None:
+        while True:
+            await asyncio.sleep(self.lease_sec / 3)
+            if held:
+                try:
+                    await self._call(partial(op_heartbeat, owner=self.owner, tokens=list(held), lease_sec=self.lease_sec))
+                except Exception as e:
+                    # 续不上就等租约过期被别人重领，结算时 token 对不上会被丢弃，不会重复写
+                    logger.warning("续租失败: %s", e)
+
+    async def _run_job(self, job: dict, held: dict[str, int]) -> None:
+        item = job["item"]
+        out = dict(job)
+        try:
+            pipeline = self.get_pipeline(job["model_id"])
+            if pipeline is None:
+                raise RuntimeError(f"未知 model_id: {job['model_id']}")
+            limiter = self.executor.limiter(job["model_id"] or "default")
+            await limiter.acquire(job["task_uuid"])
+            try:
+                out["result"] = await pipeline.aprocess(
+                    image_path=item.get("image_path"),
+                    question=item.get("question", ""),
+                    image_base64=item.get("image_base64"),
+                    answer_type=job["answer_type"],
+                )
+            finally:
+                limiter.release()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("作业 %s（task_id=%s 第 %d 次）失败: %s", job["id"], job["task_uuid"], job["attempts"], e)
+            out["error"] = f"{type(e).__name__}: {e}"
+            self.stats["errors"] += 1
+        changed = await self._call(partial(op_settle, outcomes=[out], max_attempts=self.max_attempts))
+        _forget(held, job["token"])
+        if "result" in out:
+            self.stats["done"] += 1
+        if self.on_change is not None:
+            for task_id in changed:
+                self.on_change(task_id)
+
+    async def _release(self, held: dict[str, int]) -> None:
+        # 把手上还没结算的作业放回队列，不算一次尝试
+        tokens = list(held)
+        held.clear()
+        if tokens:
+            try:
+                await self._call(partial(op_release, tokens=tokens))
+            except Exception as e:
+                logger.warning("释放租约失败（等过期后会被重领）: %s", e)
+
+
+def _forget(held: dict[str, int], token: str) -> None:
+    left = held.get(token, 0) - 1
+    if left > 0:
+        held[token] = left
+    else:
+        held.pop(token, None)
+
+
+#======命令行入口======
+def _run_worker(args: argparse.Namespace) -> None:
+    from .database import SessionLocal, init_db
+    from .persistence import create_writer
+
+    init_db()
+    pipelines, _, _ = load_pipelines()
+    if not pipelines:
+        raise SystemExit("没有可用模型，请检查 .env 里的 API_KEY")
+    writer = create_writer(SessionLocal)
+    runner = JobRunner(writer, lambda mid: pipelines.get(mid or "default"), lease_sec=args.lease, max_in_flight=args.concurrency)
+
+    async def go() -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        try:
+            if args.once:
+                await runner.drain(poll_sec=args.poll)
+            else:
+                await runner.serve(stop, poll_sec=args.poll)
+        finally:
+            await aclose_async_client()
+
+    logger.info("worker %s 启动（在飞上限 %d，租约 %.0fs）", runner.owner, runner.max_in_flight, runner.lease_sec)
+    asyncio.run(go())
+    writer.close()
+    logger.info("worker %s 退出: %s", runner.owner, runner.stats)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="MM-TrustBench 批量作业 worker：从数据库队列领作业跑模型")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="单进程同时持有的作业数")
+    parser.add_argument("--lease", type=float, default=LEASE_SEC, help="租约秒数，超时未续的作业可被重领")
+    parser.add_argument("--poll", type=float, default=DEFAULT_POLL_SEC, help="队列空时的轮询间隔（秒）")
+    parser.add_argument("--processes", type=int, default=1, help="起几个 worker 进程")
+    parser.add_argument("--once", action="store_true", help="跑空队列就退出，不常驻")
+    args = parser.parse_args(argv)
+
+    if args.processes <= 1:
+        _run_worker(args)
+        return
+    procs = [multiprocessing.Process(target=_run_worker, args=(args,), name=f"mm-trustbench-worker-{i}") for i in range(args.processes)]
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,50 @@
 import os
-import base64
+import json
+import time
+import random
+import asyncio
+import threading
+from typing import AsyncIterator
+from email.utils import parsedate_to_datetime
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+# 既会被 src.api 当包内模块导入，也会被 main.py 按顶层模块导入，两种都兼容
+try:
+    from .cache import ImageCache, default_image_cache, image_digest
+    from .cassette import Cassette
+    from .ratelimit import RateLimiter, get_rate_limiter
+    from .telemetry import MODEL_REQUEST_SECONDS, MODEL_IN_FLIGHT, MODEL_REQUEST_BYTES, MODEL_RESPONSE_CHARS, add_stats, set_stats
+except ImportError:
+    from cache import ImageCache, default_image_cache, image_digest
+    from cassette import Cassette
+    from ratelimit import RateLimiter, get_rate_limiter
+    from telemetry import MODEL_REQUEST_SECONDS, MODEL_IN_FLIGHT, MODEL_REQUEST_BYTES, MODEL_RESPONSE_CHARS, add_stats, set_stats
+
 # 从项目根目录的 .env 里读 API_KEY、API_URL、MODEL_NAME
 load_dotenv()
 
 #======配置区======
-# 请求超时秒数，不设的话服务端卡住会一直等
-REQUEST_TIMEOUT = 60
+# 没配 MODEL_NAME 时用的模型
+DEFAULT_MODEL = "Pro/Qwen/Qwen2.5-VL-7B-Instruct"
+# 请求超时秒数，不设的话服务端卡住会一直等；REQUEST_TIMEOUT_SEC 可改（压测时配合模拟服务端的卡死注入）
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT_SEC") or 60)
 # 视觉接口里图片的 detail：low 省 token，high 更细
 IMAGE_DETAIL = "low"
+# 共享异步客户端的连接池上限：同时在飞的请求数 / 空闲保活连接数
+ASYNC_MAX_CONNECTIONS = 500
+ASYNC_MAX_KEEPALIVE = 100
+# 每个 wrapper 自己的 keep-alive 会话连接池大小，配合 main.py --concurrency 用，建议不小于并发数
+POOL_SIZE = 16
+# 429/5xx/超时/连不上 时的最大重试次数（不含首次）；超过仍失败才返回 "Error"
+MAX_RETRIES = 3
+# 指数退避：第 n 次重试等 uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**n)) 秒（full jitter）
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# 这些状态码视为临时故障，值得重试；其余 4xx 直接失败
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
 
 
 #======模型调用层======
@@ -18,7 +52,11 @@ class ModelWrapper:
     """
     封装视觉模型的 HTTP 调用。
     可传 api_key/url/model 构造，不传则从环境变量读默认一组。
-    图片读本地文件转 base64 塞进消息。
+    图片读本地文件转 base64 塞进消息，编码结果走 image_cache（默认进程内共享的那份），同一张图只读一次盘。
+    可挂 preprocessor（见 preprocess.ImagePreprocessor），上传前先缩放、去元数据、重新编码。
+    同步请求走自己的 keep-alive 会话（连接池大小 pool_size），临时故障按 max_retries 带抖动退避重试。
+    每次发请求前过一遍 rate_limiter（见 ratelimit.RateLimiter，默认按 (api_url, model) 取共享的那个）：限速排队、熔断时直接失败。
+    可挂 cassette（见 cassette.Cassette）回放录好的回复：命中就不编码图片、不发请求、不占限速配额。
     """
 
     def __init__(
@@ -26,43 +64,118 @@ class ModelWrapper:
         api_key: str | None = None,
         api_url: str | None = None,
         model: str | None = None,
+        pool_size: int = POOL_SIZE,
+        max_retries: int = MAX_RETRIES,
+        image_cache: ImageCache | None = None,
+        preprocessor=None,
+        rate_limiter: RateLimiter | None = None,
+        cassette: Cassette | None = None,
+        rate_limit_group: str = "default",
     ) -> None:
         self.api_key = api_key or os.getenv("API_KEY")
         self.api_url = api_url or os.getenv("API_URL")
-        self.model = model or os.getenv("MODEL_NAME", "Pro/Qwen/Qwen2.5-VL-7B-Instruct")
+        self.model = model or os.getenv("MODEL_NAME", DEFAULT_MODEL)
         if not self.api_key:
             raise ValueError("未找到 API_KEY，请在 .env 中配置或传入构造参数")
+        self.max_retries = max(0, int(max_retries))
+        self.image_cache = image_cache or default_image_cache
+        self.preprocessor = preprocessor
+        # 没传限速器时按解析后的 (api_url, model) 取共享的那个，限速参数读 rate_limit_group 这组的环境变量
+        self.rate_limiter = rate_limiter or get_rate_limiter(self.api_url, self.model, rate_limit_group)
+        self.cassette = cassette
+        # 复用 TCP+TLS 连接，省掉每次握手；urllib3 自带的重试关掉，统一走下面自己的重试
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, int(pool_size)), max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # 重试统计：多线程/协程共用，改的时候加锁
+        self._stats_lock = threading.Lock()
+        self._stats = {"calls": 0, "succeeded": 0, "failed": 0, "retries": 0, "replayed": 0, "cancelled": 0, "retry_reasons": {}}
 
-    def predict(self, image_path: str | None = None, question: str = "", image_base64: str | None = None) -> str:
+    @property
+    def retry_stats(self) -> dict:
         """
-        传入图片（路径或 base64 二选一）和问题，请求视觉模型，返回模型回复的文本。
-        图片会按 base64 塞进 content，符合硅基流动视觉接口格式。
-        请求失败或解析异常时返回 "Error"，不抛异常，避免整服务挂掉。
+        重试统计快照：calls 调用数、succeeded/failed 最终成败、retries 总重试次数、retry_reasons 按原因（状态码/timeout/connect）计数。
+        replayed 是从磁带回放、没真调接口的次数，不算进 calls。
+        """
+        with self._stats_lock:
+            snap = dict(self._stats)
+            snap["retry_reasons"] = dict(self._stats["retry_reasons"])
+        return snap
+
+    def _count(self, field: str, reason: str | None = None) -> None:
+        with self._stats_lock:
+            self._stats[field] += 1
+            if reason is not None:
+                reasons = self._stats["retry_reasons"]
+                reasons[reason] = reasons.get(reason, 0) + 1
+
+    def close(self) -> None:
+        """
+        关掉同步会话的连接池。
+        """
+        self.session.close()
+
+    def _replay(self, image_path: str | None, image_base64: str | None, question: str) -> tuple[tuple | None, str | None]:
+        """
+        挂了磁带时按 模型+图片指纹+prompt 查，返回 (留给 _record 的 (key, 图片指纹), 录好的回复)；没挂磁带都是 None。
+        没录到且磁带是 fail 模式时抛 CassetteMiss，不吞成 "Error"，免得回放结果里混进假失败。
         """
-        # 1. 决定 image_url：有 base64 直接用，没有则读本地文件转 base64
+        if self.cassette is None:
+            return None, None
+        image_sha = image_digest(image_path, image_base64, self.image_cache)
+        key, raw = self.cassette.lookup(self.model, image_sha, question)
+        if raw is not None:
+            self._count("replayed")
+        return (key, image_sha), raw
+
+    async def _areplay(self, image_path: str | None, image_base64: str | None, question: str) -> tuple[tuple | None, str | None]:
+        if self.cassette is not None and image_path and not image_base64:
+            # 算指纹要读盘，同 _abuild_image_url 放线程里
+            return await asyncio.to_thread(self._replay, image_path, None, question)
+        return self._replay(image_path, image_base64, question)
+
+    def _record(self, tag: tuple | None, question: str, content: str) -> None:
+        if tag is not None:
+            key, image_sha = tag
+            self.cassette.record(key, self.model, image_sha, question, content)
+
+    def _build_image_url(self, image_path: str | None = None, image_base64: str | None = None) -> str | None:
+        """
+        决定 image_url：有 base64 直接用，没有则取本地文件的 base64（有缓存）。都没有返回 None。
+        """
+        pre = self.preprocessor
         if image_base64:
             # 网络传过来的 base64 通常不带前缀，手动拼
             raw = image_base64.strip()
             if raw.startswith("data:"):
-                image_url = raw
+                if pre is None:
+                    return raw
+                header, raw = raw.split(",", 1)
+                mime = header[5:].split(";", 1)[0] or "image/jpeg"
             else:
-                image_url = f"data:image/jpeg;base64,{raw}"
+                mime = "image/jpeg"
+                if pre is None:
+                    return f"data:image/jpeg;base64,{raw}"
+            enc = self.image_cache.get_base64(raw, pre, mime=mime)
         elif image_path:
-            with open(image_path, "rb") as f:
-                img_b64 = base64.b64encode(f.read()).decode("utf-8")
-            ext = os.path.splitext(image_path)[1].lower()
-            mime = "image/png" if ext == ".png" else "image/jpeg"
-            image_url = f"data:{mime};base64,{img_b64}"
+            enc = self.image_cache.get(image_path, pre)
         else:
-            return "Error"
+            return None
+        if pre is not None:
+            pre.record_upload(enc.file_bytes, enc.payload_bytes)
+        return enc.data_url
 
-        # 2. 请求头：json + Bearer 鉴权
+    def _build_request(self, image_url: str, question: str, stream: bool = False) -> tuple[dict, dict]:
+        """
+        拼请求头与请求体，同步/异步/流式几条路共用。stream 为真时让服务端按 SSE 逐段推 delta。
+        """
+        # 请求头：json + Bearer 鉴权
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}",
         }
-
-        # 3. 请求体：视觉接口要求 content 为数组，先图后文
+        # 请求体：视觉接口要求 content 为数组，先图后文
         user_content = [
             {"type": "image_url", "image_url": {"url": image_url, "detail": IMAGE_DETAIL}},
             {"type": "text", "text": question},
@@ -72,46 +185,377 @@ class ModelWrapper:
             "messages": [
                 {"role": "user", "content": user_content},
             ],
-            "stream": False,
+            "stream": stream,
         }
+        return headers, payload
+
+    def predict(self, image_path: str | None = None, question: str = "", image_base64: str | None = None) -> str:
+        """
+        传入图片（路径或 base64 二选一）和问题，请求视觉模型，返回模型回复的文本。
+        图片会按 base64 塞进 content，符合硅基流动视觉接口格式。
+        请求失败或解析异常时返回 "Error"，不抛异常，避免整服务挂掉（磁带 fail 模式没录到的 CassetteMiss 除外）；
+        TrustPipeline 见到 "Error" 抛 ModelCallError，不会把它记成拒答。
+        """
+        tag, replayed = self._replay(image_path, image_base64, question)
+        if replayed is not None:
+            return replayed
+        t0 = time.perf_counter()
+        image_url = self._build_image_url(image_path, image_base64)
+        add_stats(encode_sec=time.perf_counter() - t0)
+        if not image_url:
+            return "Error"
+        headers, payload = self._build_request(image_url, question)
 
+        self._count("calls")
+        inflight = self._begin_call(image_url, question)
         try:
-            # 4. 发 POST，必须带 timeout，否则服务端卡死会假死
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=payload,
-                timeout=REQUEST_TIMEOUT,
-            )
-            response.raise_for_status()
-
-            # 5. 从返回 JSON 里抠出 content
-            data = response.json()
-            content = data["choices"][0]["message"]["content"]
+            content = self._post_with_retry(headers, payload)
+            self._count("succeeded")
+            MODEL_RESPONSE_CHARS.labels(self.model).observe(len(content or ""))
+            self._record(tag, question, content)
             return content
         except Exception as e:
-            # 401/429/超时/解析错等，打日志，返回固定字符串，不崩进程
+            # 401/重试耗尽的 429/超时/解析错等，打日志，返回固定字符串，不崩进程
+            self._count("failed")
             print(f"Error calling model API: {e}")
             return "Error"
+        finally:
+            inflight.dec()
+
+    def _begin_call(self, image_url: str, question: str):
+        """
+        记一次调用的请求大小，在飞数 +1，返回在飞计数器，调用方结束时 dec。
+        """
+        size = len(image_url) + len(question.encode("utf-8"))
+        MODEL_REQUEST_BYTES.labels(self.model).observe(size)
+        set_stats(request_bytes=size)
+        inflight = MODEL_IN_FLIGHT.labels(self.model)
+        inflight.inc()
+        return inflight
+
+    def _observe_attempt(self, status: str, t0: float) -> None:
+        # 每次尝试的耗时进直方图；本条评测的上游耗时按各次尝试相加（不含退避与限速排队）
+        elapsed = time.perf_counter() - t0
+        MODEL_REQUEST_SECONDS.labels(self.model, status).observe(elapsed)
+        add_stats(upstream_sec=elapsed)
+
+    def _post_with_retry(self, headers: dict, payload: dict) -> str:
+        """
+        发 POST 并抠出 content；临时故障按退避重试，重试耗尽或非临时错误直接抛。
+        """
+        limiter = self.rate_limiter
+        for attempt in range(self.max_retries + 1):
+            # 限速排队；熔断中直接抛 CircuitOpenError，不重试
+            limiter.acquire()
+            t0 = time.perf_counter()
+            try:
+                # 必须带 timeout，否则服务端卡死会假死
+                response = self.session.post(
+                    self.api_url,
+                    headers=headers,
+                    json=payload,
+                    timeout=REQUEST_TIMEOUT,
+                )
+            except (requests.Timeout, requests.ConnectionError) as e:
+                reason = "timeout" if isinstance(e, requests.Timeout) else "connect"
+                self._observe_attempt(reason, t0)
+                limiter.record("fail")
+                if attempt >= self.max_retries:
+                    raise
+                delay = retry_delay(attempt)
+            else:
+                self._observe_attempt(str(response.status_code), t0)
+                outcome, hint = _limiter_outcome(response.status_code, response.headers.get("Retry-After"))
+                limiter.record(outcome, hint)
+                if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                    reason = str(response.status_code)
+                    delay = _own_delay(limiter, outcome, retry_delay(attempt, response.headers.get("Retry-After")))
+                    response.close()
+                else:
+                    response.raise_for_status()
+                    # 从返回 JSON 里抠出 content
+                    data = response.json()
+                    _note_usage(data)
+                    return data["choices"][0]["message"]["content"]
+            self._count("retries", reason)
+            time.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    async def _abuild_image_url(self, image_path: str | None, image_base64: str | None) -> str | None:
+        if image_path and not image_base64:
+            # 缓存未命中时要读盘 + base64，放线程里做，别卡事件循环
+            return await asyncio.to_thread(self._build_image_url, image_path, None)
+        return self._build_image_url(image_path, image_base64)
+
+    async def apredict(self, image_path: str | None = None, question: str = "", image_base64: str | None = None) -> str:
+        """
+        predict 的协程版：走进程内共享的连接池异步客户端，等待模型时不占线程。
+        入参与返回约定同 predict，失败返回 "Error"。
+        """
+        tag, replayed = await self._areplay(image_path, image_base64, question)
+        if replayed is not None:
+            return replayed
+        t0 = time.perf_counter()
+        image_url = await self._abuild_image_url(image_path, image_base64)
+        add_stats(encode_sec=time.perf_counter() - t0)
+        if not image_url:
+            return "Error"
+        headers, payload = self._build_request(image_url, question)
+
+        self._count("calls")
+        inflight = self._begin_call(image_url, question)
+        try:
+            content = await self._apost_with_retry(headers, payload)
+            self._count("succeeded")
+            MODEL_RESPONSE_CHARS.labels(self.model).observe(len(content or ""))
+            self._record(tag, question, content)
+            return content
+        except Exception as e:
+            self._count("failed")
+            print(f"Error calling model API: {e}")
+            return "Error"
+        finally:
+            inflight.dec()
+
+    async def _apost_with_retry(self, headers: dict, payload: dict) -> str:
+        """
+        _post_with_retry 的协程版，重试规则一致，退避用 asyncio.sleep 不占线程。
+        """
+        client = get_async_client()
+        limiter = self.rate_limiter
+        for attempt in range(self.max_retries + 1):
+            await limiter.aacquire()
+            t0 = time.perf_counter()
+            try:
+                response = await client.post(self.api_url, headers=headers, json=payload)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                reason = "timeout" if isinstance(e, httpx.TimeoutException) else "connect"
+                self._observe_attempt(reason, t0)
+                await limiter.arecord("fail")
+                if attempt >= self.max_retries:
+                    raise
+                delay = retry_delay(attempt)
+            else:
+                self._observe_attempt(str(response.status_code), t0)
+                outcome, hint = _limiter_outcome(response.status_code, response.headers.get("Retry-After"))
+                await limiter.arecord(outcome, hint)
+                if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                    reason = str(response.status_code)
+                    delay = _own_delay(limiter, outcome, retry_delay(attempt, response.headers.get("Retry-After")))
+                else:
+                    response.raise_for_status()
+                    data = response.json()
+                    _note_usage(data)
+                    return data["choices"][0]["message"]["content"]
+            self._count("retries", reason)
+            await asyncio.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    async def astream(
+        self, image_path: str | None = None, question: str = "", image_base64: str | None = None
+    ) -> AsyncIterator[str]:
+        """
+        流式请求（"stream": true），模型每吐一段就产出一段文本，首字节不用等整段生成完。
+        重试规则同 apredict，但只在还没收到任何内容前重试；中途断流就到此为止，已产出的部分保留。
+        一个字都没拿到就失败时产出一个 "Error"，与 predict 的失败约定一致。调用方可随时 aclose 提前断开。
+        磁带命中时把录好的回复当一整段产出；完整收完的流才录进磁带，中途断开的不录。
+        """
+        tag, replayed = await self._areplay(image_path, image_base64, question)
+        if replayed is not None:
+            yield replayed
+            return
+        t0 = time.perf_counter()
+        image_url = await self._abuild_image_url(image_path, image_base64)
+        add_stats(encode_sec=time.perf_counter() - t0)
+        if not image_url:
+            yield "Error"
+            return
+        headers, payload = self._build_request(image_url, question, stream=True)
+
+        self._count("calls")
+        client = get_async_client()
+        limiter = self.rate_limiter
+        got_any = False
+        parts = []
+        inflight = self._begin_call(image_url, question)
+        try:
+            for attempt in range(self.max_retries + 1):
+                await limiter.aacquire()
+                t0 = time.perf_counter()
+                try:
+                    async with client.stream("POST", self.api_url, headers=headers, json=payload) as response:
+                        # 流式只记到响应头，首字节延迟；整段耗时看 HTTP 层的直方图
+                        self._observe_attempt(str(response.status_code), t0)
+                        outcome, hint = _limiter_outcome(response.status_code, response.headers.get("Retry-After"))
+                        # 200 的「成功」等流收完再记：中途断流算失败，调用方提前断开不算成败
+                        if outcome != "ok":
+                            await limiter.arecord(outcome, hint)
+                        if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                            reason = str(response.status_code)
+                            delay = _own_delay(limiter, outcome, retry_delay(attempt, response.headers.get("Retry-After")))
+                        else:
+                            response.raise_for_status()
+                            async for delta in iter_stream_deltas(response):
+                                got_any = True
+                                parts.append(delta)
+                                yield delta
+                            await limiter.arecord("ok")
+                            self._count("succeeded")
+                            content = "".join(parts)
+                            MODEL_RESPONSE_CHARS.labels(self.model).observe(len(content))
+                            self._record(tag, question, content)
+                            return
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    if not got_any:
+                        self._observe_attempt("timeout" if isinstance(e, httpx.TimeoutException) else "connect", t0)
+                    await limiter.arecord("fail")
+                    if got_any or attempt >= self.max_retries:
+                        raise
+                    reason = "timeout" if isinstance(e, httpx.TimeoutException) else "connect"
+                    delay = retry_delay(attempt)
+                self._count("retries", reason)
+                await asyncio.sleep(delay)
+        except (GeneratorExit, asyncio.CancelledError):
+            # 调用方拿够了主动断开（或任务被取消）：不算成功也不算失败，只把熔断的探测名额放回去
+            self._count("cancelled")
+            limiter.record("cancel")
+            raise
+        except Exception as e:
+            self._count("failed")
+            print(f"Error calling model API: {e}")
+            if not got_any:
+                yield "Error"
+        finally:
+            inflight.dec()
+
+
+async def iter_stream_deltas(response: httpx.Response) -> AsyncIterator[str]:
+    """
+    从 OpenAI 兼容的 SSE 流里逐条抠 choices[0].delta.content，读到 [DONE] 结束。
+    有的服务端忽略 stream 参数直接回整段 JSON，这时把 message.content 当一整段产出。
+    """
+    if response.headers.get("content-type", "").startswith("application/json"):
+        data = json.loads(await response.aread())
+        _note_usage(data)
+        yield data["choices"][0]["message"]["content"]
+        return
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        if not data:
+            continue
+        chunk = json.loads(data)
+        # usage 只有服务端主动带（如 OpenAI 的 stream_options.include_usage）才有，通常在最后一块
+        _note_usage(chunk)
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue
+        content = (choices[0].get("delta") or {}).get("content")
+        if content:
+            yield content
+
+
+def _note_usage(data: dict) -> None:
+    usage = data.get("usage") or {}
+    set_stats(prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+
+
+#======重试退避======
+def retry_delay(attempt: int, retry_after: str | None = None) -> float:
+    """
+    第 attempt 次（从 0 起）重试前要等的秒数。
+    服务端给了 Retry-After（秒数或 HTTP 日期）就听它的，否则 full jitter 指数退避；都不超过 BACKOFF_MAX。
+    """
+    if retry_after:
+        try:
+            wait = float(retry_after)
+        except ValueError:
+            try:
+                wait = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                wait = None
+        if wait is not None:
+            return min(BACKOFF_MAX, max(0.0, wait))
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def _limiter_outcome(status_code: int, retry_after: str | None) -> tuple[str, float | None]:
+    """
+    把一次响应归给限速器：429 是被限流（带上服务端要求的等待），其余可重试的状态码算服务端故障，其他都说明服务是通的。
+    """
+    if status_code == 429:
+        return "throttled", retry_delay(0, retry_after) if retry_after else None
+    if status_code in RETRY_STATUS:
+        return "fail", None
+    return "ok", None
+
+
+def _own_delay(limiter: RateLimiter, outcome: str, delay: float) -> float:
+    # 被 429 且开了限速时，桶已经按 Retry-After 压住，下一次 acquire 自然会等够，这里不再重复睡
+    if outcome == "throttled" and limiter.rate is not None:
+        return 0.0
+    return delay
+
+
+#======共享异步客户端======
+# 整个进程共用一个 httpx.AsyncClient（自带连接池 + keep-alive），所有 wrapper 的 apredict 都走它。
+# 客户端绑定在创建它的事件循环上，循环换了（如测试里每个请求一个循环）就重建。
+_async_client: httpx.AsyncClient | None = None
+_async_client_loop: asyncio.AbstractEventLoop | None = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    取当前事件循环上的共享异步客户端，没有就建。只能在协程里调。
+    """
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client.is_closed or _async_client_loop is not loop:
+        _async_client = httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_MAX_KEEPALIVE,
+            ),
+        )
+        _async_client_loop = loop
+    return _async_client
+
+
+async def aclose_async_client() -> None:
+    """
+    关闭共享异步客户端，服务退出时调，释放连接池。
+    """
+    global _async_client, _async_client_loop
+    if _async_client is not None and not _async_client.is_closed:
+        await _async_client.aclose()
+    _async_client = None
+    _async_client_loop = None
 
 
 #======多模型配置======
 # 从 env 读多组：默认 API_KEY/API_URL/MODEL_NAME；第二组 API_KEY_2/API_URL_2/MODEL_NAME_2，以此类推
-def get_available_wrappers() -> list[tuple[str, "ModelWrapper"]]:
+def get_available_wrappers(**wrapper_kwargs) -> list[tuple[str, "ModelWrapper"]]:
     """
     返回 [(model_id, wrapper), ...]，至少包含 default（若配置了 API_KEY）。
+    wrapper_kwargs 原样传给每个 ModelWrapper（如 preprocessor、pool_size）。
     """
     out: list[tuple[str, ModelWrapper]] = []
     # 默认一组
     if os.getenv("API_KEY"):
-        out.append(("default", ModelWrapper()))
+        out.append(("default", ModelWrapper(**wrapper_kwargs)))
     for i in range(2, 11):
         key = os.getenv(f"API_KEY_{i}")
         if not key:
             continue
-        url = os.getenv(f"API_URL_{i}") or os.getenv("API_URL")
-        name = os.getenv(f"MODEL_NAME_{i}") or os.getenv("MODEL_NAME", "")
-        out.append((str(i), ModelWrapper(api_key=key, api_url=url, model=name)))
+        url = os.getenv(f"API_URL_{i}")
+        name = os.getenv(f"MODEL_NAME_{i}")
+        # 没配的 url / 模型名由 ModelWrapper 按默认一组补齐，限速器按补齐后的 (api_url, model) 取，参数读 RATE_LIMIT_RPM_i
+        wrapper = ModelWrapper(api_key=key, api_url=url, model=name, rate_limit_group=str(i), **wrapper_kwargs)
+        out.append((str(i), wrapper))
     return out
 
 
@@ -52,3 +52,90 @@ def test_normalize_label_no():
 def test_normalize_label_unknown():
     assert normalize_label("") == "unknown"
     assert normalize_label("other") == "unknown"
+
+
+#====== 流式阅卷：多文件、gzip、逐行写明细 ======
+def _write_jsonl(path, rows, gz=False):
+    import gzip
+    import json
+
+    opener = gzip.open if gz else open
+    with opener(path, "wt", encoding="utf-8") as f:
+        for r in rows:
+            f.write(json.dumps(r) + "\n")
+
+
+def test_run_analysis_streams_multiple_and_gzip_inputs(tmp_path):
+    from src.analysis import run_analysis, iter_jsonl
+
+    a = tmp_path / "a.jsonl"
+    b = tmp_path / "b.jsonl.gz"
+    _write_jsonl(a, [
+        {"question_id": 1, "label": "no", "final_answer": "yes"},
+        {"question_id": 2, "label": "yes", "final_answer": "yes"},
+    ])
+    _write_jsonl(b, [
+        {"question_id": 3, "label": "yes", "final_answer": "no"},
+        {"question_id": 4, "label": "no", "final_answer": "refused"},
+        {"question_id": 5, "label": "no", "model_answer": "No, there is none."},
+    ], gz=True)
+    out = tmp_path / "detail.jsonl.gz"
+    summary = run_analysis([str(a), str(b)], output=str(out), charts=False)
+    assert summary["total"] == 5
+    assert summary["correct"] == 2
+    assert (summary["fp"], summary["fn"], summary["unknown"], summary["label_no"]) == (1, 1, 1, 3)
+    details = list(iter_jsonl(str(out)))
+    assert [d["question_id"] for d in details] == [1, 2, 3, 4, 5]
+    assert details[0]["is_fp"] and details[2]["is_fn"]
+
+
+def test_run_analysis_missing_input(tmp_path):
+    from src.analysis import run_analysis
+
+    assert run_analysis([str(tmp_path / "nope.jsonl")], output=str(tmp_path / "o.jsonl"), charts=False) is None
+
+
+def test_run_analysis_usage_percentiles(tmp_path):
+    from src.analysis import run_analysis, percentile
+
+    assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.5 and percentile([], 90) is None
+    a = tmp_path / "a.jsonl"
+    _write_jsonl(a, [
+        {"question_id": i, "label": "yes", "final_answer": "yes", "model": "m", "upstream_sec": float(i),
+         "encode_sec": 0.01, "parse_sec": 0.001, "request_bytes": 2048, "prompt_tokens": 100, "completion_tokens": 20}
+        for i in range(1, 11)
+    ] + [
+        # 旧结果没有统计项，不计入用量
+        {"question_id": 11, "label": "no", "final_answer": "no"},
+        # 缓存命中：没有上游耗时与 token
+        {"question_id": 12, "label": "no", "final_answer": "no", "model": "m", "parse_sec": 0.002},
+    ])
+    summary = run_analysis([str(a)], output=str(tmp_path / "o.jsonl"), charts=False)
+    usage = summary["usage"]
+    assert usage["overall"]["items"] == 11
+    m = usage["by"]["m / -"]
+    assert m["latency"]["upstream_sec"]["n"] == 10
+    assert m["latency"]["upstream_sec"]["p50"] == pytest.approx(5.5, rel=0.01)
+    assert m["latency"]["upstream_sec"]["p90"] == pytest.approx(9.1, rel=0.01)
+    assert m["latency"]["upstream_sec"]["mean"] == pytest.approx(5.5)
+    assert m["latency"]["parse_sec"]["n"] == 11
+    assert m["tokens_per_item"] == 120 and m["request_bytes_per_item"] == 2048
+
+
+def test_latency_histogram_is_bounded_and_close_to_exact():
+    import random
+    from src.analysis import LatencyHistogram, percentile
+
+    rnd = random.Random(1)
+    vals = [rnd.lognormvariate(0, 1.5) for _ in range(50000)]
+    hist = LatencyHistogram()
+    for v in vals:
+        hist.add(v)
+    exact = sorted(vals)
+    for q in (50, 90, 99):
+        assert hist.percentile(q) == pytest.approx(percentile(exact, q), rel=0.01)
+    # 桶数只跟取值跨度有关，不跟行数走
+    assert len(hist.buckets) < 1000
+    one = LatencyHistogram()
+    one.add(0.25)
+    assert one.percentile(99) == 0.25 and LatencyHistogram().percentile(50) is None
@@ -1,5 +1,5 @@
 # API 接口：evaluate、task 状态、history
-from unittest.mock import patch
+from unittest.mock import patch, AsyncMock
 import pytest
 from fastapi.testclient import TestClient
 
@@ -9,6 +9,12 @@ from src.api import app
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def _no_retry_backoff(monkeypatch):
+    # 批量条目失败会推迟重试，测试里不等
+    monkeypatch.setattr("src.job_queue.RETRY_BASE_SEC", 0.0)
+
+
 #====== ping ======
 def test_ping():
     resp = client.get("/ping")
@@ -29,11 +35,11 @@ def test_evaluate_missing_image():
 @patch("src.api._get_pipeline")
 def test_evaluate_success(mock_get_pipeline):
     mock_pipe = mock_get_pipeline.return_value
-    mock_pipe.process.return_value = {
+    mock_pipe.aprocess = AsyncMock(return_value={
         "answer": "yes",
         "evidence": "I see a cat.",
         "self_check": "Evidence supports yes.",
-    }
+    })
     mock_pipe.wrapper.model = "test-model"
     resp = client.post(
         "/api/v1/evaluate",
@@ -69,3 +75,255 @@ def test_models_list():
     data = resp.json()
     assert "models" in data
     assert isinstance(data["models"], list)
+
+
+#====== 批量评测：后台跑完后可查到全部记录 ======
+@patch("src.api._get_pipeline")
+def test_batch_evaluate_completes(mock_get_pipeline):
+    mock_pipe = mock_get_pipeline.return_value
+    mock_pipe.aprocess = AsyncMock(return_value={"answer": "no", "evidence": "e", "self_check": "s"})
+    mock_pipe.wrapper.model = "test-model"
+    items = [{"question": f"q{i}", "image_base64": "fake"} for i in range(3)]
+    resp = client.post("/api/v1/evaluate/batch", json={"items": items})
+    assert resp.status_code == 200
+    task_id = resp.json()["task_id"]
+    data = client.get(f"/api/v1/task/{task_id}").json()
+    assert data["status"] == "completed"
+    assert sorted(r["question"] for r in data["records"]) == ["q0", "q1", "q2"]
+
+
+#====== 任务轮询：since 游标只取新记录，ETag 未变返回 304 ======
+@patch("src.api._get_pipeline")
+def test_task_poll_cursor_and_etag(mock_get_pipeline):
+    mock_pipe = mock_get_pipeline.return_value
+    mock_pipe.aprocess = AsyncMock(return_value={"answer": "yes", "evidence": "e", "self_check": "s"})
+    mock_pipe.wrapper.model = "test-model"
+    items = [{"question": f"q{i}", "image_base64": "fake"} for i in range(4)]
+    task_id = client.post("/api/v1/evaluate/batch", json={"items": items}).json()["task_id"]
+
+    first = client.get(f"/api/v1/task/{task_id}", params={"limit": 3})
+    body = first.json()
+    assert body["record_count"] == 4 and len(body["records"]) == 3
+    rest = client.get(f"/api/v1/task/{task_id}", params={"since": body["next_since"]}).json()
+    assert len(rest["records"]) == 1
+    assert rest["records"][0]["id"] > body["next_since"] == body["records"][-1]["id"]
+    done = client.get(f"/api/v1/task/{task_id}", params={"since": rest["next_since"]}).json()
+    assert done["records"] == [] and done["next_since"] == rest["next_since"]
+
+    etag = first.headers["etag"]
+    resp = client.get(f"/api/v1/task/{task_id}", params={"limit": 3}, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.headers["etag"] == etag
+    # 任务跑完后拿上一页的 ETag 翻下一页：分页参数变了，照常返回剩下的记录
+    page = client.get(f"/api/v1/task/{task_id}", params={"since": body["next_since"]}, headers={"If-None-Match": etag})
+    assert page.status_code == 200 and len(page.json()["records"]) == 1
+    assert page.headers["etag"] != etag
+
+
+#====== 批量进度计数 + 事件流 ======
+@patch("src.api._get_pipeline")
+def test_batch_progress_counters_and_events(mock_get_pipeline):
+    mock_pipe = mock_get_pipeline.return_value
+
+    async def aprocess(image_path=None, question="", image_base64=None, answer_type="yes_no"):
+        if question == "bad":
+            raise RuntimeError("boom")
+        return {"answer": "yes", "evidence": "e", "self_check": "s"}
+
+    mock_pipe.aprocess = aprocess
+    mock_pipe.wrapper.model = "test-model"
+    items = [{"question": q, "image_base64": "fake"} for q in ("q0", "bad", "q2")]
+    task_id = client.post("/api/v1/evaluate/batch", json={"items": items}).json()["task_id"]
+
+    data = client.get(f"/api/v1/task/{task_id}").json()
+    assert (data["total_items"], data["done_items"], data["failed_items"], data["eta_sec"]) == (3, 2, 1, 0)
+
+    resp = client.get(f"/api/v1/task/{task_id}/events")
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    events = _parse_sse(resp.text)
+    names = [e for e, _ in events]
+    assert names == ["record", "record", "progress", "done"]
+    assert dict(events)["done"]["status"] == "completed"
+    # 断线重连：Last-Event-ID 之后的记录才补发
+    first_id = events[0][1]["id"]
+    again = _parse_sse(client.get(f"/api/v1/task/{task_id}/events", headers={"Last-Event-ID": str(first_id)}).text)
+    assert [e for e, _ in again] == ["record", "progress", "done"]
+    assert client.get("/api/v1/task/nope/events").status_code == 404
+
+
+#====== 模型调用失败（重试耗尽 / 熔断）不算拒答：重试后记 failed，不落记录 ======
+@patch("src.api._get_pipeline")
+def test_batch_model_error_is_failure_not_refusal(mock_get_pipeline):
+    from src.trust_pipeline import TrustPipeline
+
+    class Wrapper:
+        model = "test-model"
+        calls = 0
+
+        async def apredict(self, image_path=None, question="", image_base64=None):
+            Wrapper.calls += 1
+            if "Question: bad\n" in question:
+                return "Error"
+            return "Evidence: e\nSelf-check: ok\nAnswer: yes"
+
+    mock_get_pipeline.return_value = TrustPipeline(Wrapper())
+    items = [{"question": q, "image_base64": "fake"} for q in ("q0", "bad")]
+    task_id = client.post("/api/v1/evaluate/batch", json={"items": items}).json()["task_id"]
+    data = client.get(f"/api/v1/task/{task_id}").json()
+    assert (data["done_items"], data["failed_items"]) == (1, 1)
+    assert [r["final_answer"] for r in data["records"]] == ["yes"]
+    # 失败的那条按作业重试次数重跑过
+    from src.job_queue import MAX_ATTEMPTS
+    assert Wrapper.calls == 1 + MAX_ATTEMPTS
+
+
+#====== history：keyset 分页 + summary 计数；任务记录分页 ======
+@patch("src.api._get_pipeline")
+def test_history_keyset_summary_and_records_paging(mock_get_pipeline):
+    mock_pipe = mock_get_pipeline.return_value
+    answers = iter(["yes", "no", "yes", "refused", "3 people"])
+
+    async def aprocess(image_path=None, question="", image_base64=None, answer_type="yes_no"):
+        return {"answer": next(answers), "evidence": "e", "self_check": "s"}
+
+    mock_pipe.aprocess = aprocess
+    mock_pipe.wrapper.model = "test-model"
+    items = [{"question": f"q{i}", "image_base64": "fake"} for i in range(5)]
+    task_id = client.post("/api/v1/evaluate/batch", json={"items": items}).json()["task_id"]
+    for _ in range(3):
+        client.post("/api/v1/evaluate/batch", json={"items": items[:1]})
+
+    # 翻完所有页：不重不漏，顺序与一次取全一致
+    full = client.get("/api/v1/history", params={"limit": 100, "mode": "summary"}).json()["tasks"]
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, "mode": "summary"}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/api/v1/history", params=params).json()
+        seen += [t["task_id"] for t in page["tasks"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == [t["task_id"] for t in full]
+
+    mine = next(t for t in full if t["task_id"] == task_id)
+    assert mine["records"] == []
+    assert mine["answer_counts"] == {"yes": 2, "no": 1, "refused": 1, "open": 1}
+    assert mine["record_count"] == 5
+
+    first = client.get(f"/api/v1/task/{task_id}/records", params={"limit": 3}).json()
+    assert len(first["records"]) == 3 and first["next_after"] == first["records"][-1]["id"]
+    rest = client.get(f"/api/v1/task/{task_id}/records", params={"after": first["next_after"], "limit": 3}).json()
+    assert len(rest["records"]) == 2 and rest["next_after"] is None
+    assert client.get("/api/v1/history", params={"cursor": "garbage"}).status_code == 400
+
+
+#====== 单条评测：写后队列落库，flush 后历史里可见 ======
+@patch("src.api._get_pipeline")
+def test_evaluate_persists_via_writer(mock_get_pipeline):
+    from src.api import _writer
+
+    mock_pipe = mock_get_pipeline.return_value
+    mock_pipe.aprocess = AsyncMock(return_value={"answer": "no", "evidence": "e", "self_check": "s"})
+    mock_pipe.wrapper.model = "writer-model"
+    resp = client.post("/api/v1/evaluate", json={"question": "写队列？", "image_path": "x.jpg"})
+    assert resp.status_code == 200
+    _writer.flush()
+    tasks = client.get("/api/v1/history", params={"limit": 100}).json()["tasks"]
+    assert any(t["model_name"] == "writer-model" and t["records"][0]["question"] == "写队列？" for t in tasks)
+
+
+#====== evaluate/stream：SSE 按段推送 ======
+def _parse_sse(text):
+    import json
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n") if not line.startswith(":"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@patch("src.api._get_pipeline")
+def test_evaluate_stream_pushes_sections(mock_get_pipeline):
+    from src.trust_pipeline import TrustPipeline
+
+    class StreamingWrapper:
+        model = "test-model"
+
+        async def astream(self, image_path=None, question="", image_base64=None):
+            for c in ["Evidence: a cat", "\nSelf-check: ok", "\nAnswer: yes."]:
+                yield c
+
+    mock_get_pipeline.return_value = TrustPipeline(StreamingWrapper())
+    resp = client.post("/api/v1/evaluate/stream", json={"question": "图里有猫吗？", "image_base64": "fake"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    events = _parse_sse(resp.text)
+    names = [e for e, _ in events]
+    assert names[0] == "delta"
+    assert names.index("evidence") < names.index("self_check") < names.index("answer") < names.index("done")
+    assert dict(events)["done"] == {"final_answer": "yes", "evidence": "a cat", "self_check": "ok"}
+
+
+def test_evaluate_stream_missing_image():
+    resp = client.post("/api/v1/evaluate/stream", json={"question": "q"})
+    assert resp.status_code == 400
+
+
+#====== 多模型对比：并发发给各模型，stream 先答完的先推 ======
+@patch("src.api._get_pipeline")
+def test_evaluate_compare(mock_get_pipeline):
+    import asyncio
+    from src.trust_pipeline import TrustPipeline
+
+    class Wrapper:
+        def __init__(self, model, delay, answer):
+            self.model, self.delay, self.answer = model, delay, answer
+
+        async def apredict(self, image_path=None, question="", image_base64=None):
+            await asyncio.sleep(self.delay)
+            if self.answer is None:
+                return "Error"
+            return f"Evidence: e\nSelf-check: ok\nAnswer: {self.answer}"
+
+    pipes = {
+        "default": TrustPipeline(Wrapper("slow-model", 0.3, "yes")),
+        "2": TrustPipeline(Wrapper("fast-model", 0.0, "no")),
+        "3": TrustPipeline(Wrapper("broken-model", 0.0, None)),
+    }
+    mock_get_pipeline.side_effect = pipes.get
+    body = {"question": "猫？", "image_base64": "fake", "model_ids": ["default", "2", "3"]}
+    data = client.post("/api/v1/evaluate/compare", json=body).json()
+    assert [r["model_id"] for r in data["results"]] == ["default", "2", "3"]
+    assert [r["final_answer"] for r in data["results"]] == ["yes", "no", None]
+    assert data["results"][2]["error"]
+    # 并发：整体耗时约等于最慢的，不是相加
+    assert data["results"][0]["latency_sec"] >= 0.3 and data["elapsed_sec"] < 0.6
+
+    events = _parse_sse(client.post("/api/v1/evaluate/compare/stream", json=body).text)
+    assert [e for e, _ in events][-1] == "done"
+    assert [d["model_id"] for e, d in events if e == "result"][-1] == "default"
+    assert client.post("/api/v1/evaluate/compare", json={**body, "model_ids": ["nope"]}).status_code == 400
+
+
+#====== 没有进度计数器的老任务：记录数回退到 COUNT ======
+def test_task_summary_legacy_task_without_counters():
+    import uuid
+    from src.database import SessionLocal
+    from src.models import EvaluationTask, EvaluationRecord
+
+    task_id = str(uuid.uuid4())
+    db = SessionLocal()
+    try:
+        task = EvaluationTask(task_id=task_id, status="completed")
+        db.add(task)
+        db.flush()
+        db.add_all([EvaluationRecord(task_id=task.id, question="q", final_answer="yes") for _ in range(2)])
+        # 老库里这两列是空的（列的 default 会把 None 补成 0，直接改回去）
+        db.query(EvaluationTask).filter(EvaluationTask.id == task.id).update({"done_items": None, "failed_items": None})
+        db.commit()
+    finally:
+        db.close()
+    body = client.get(f"/api/v1/task/{task_id}").json()
+    assert body["record_count"] == 2 and len(body["records"]) == 2
@@ -0,0 +1,53 @@
+# 批量执行器：按模型限并发、多任务公平轮转
+import asyncio
+from src.batch_executor import BatchExecutor, FairLimiter, get_batch_limit
+
+
+def test_fair_limiter_round_robin():
+    order = []
+
+    async def go():
+        lim = FairLimiter(1)
+        await lim.acquire("hold")
+
+        async def one(owner, n):
+            await lim.acquire(owner)
+            order.append(f"{owner}{n}")
+            lim.release()
+
+        tasks = [asyncio.create_task(one("a", n)) for n in range(3)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(one("b", n)) for n in range(3)]
+        await asyncio.sleep(0)
+        lim.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(go())
+    assert order == ["a0", "b0", "a1", "b1", "a2", "b2"]
+
+
+def test_executor_limiter_per_model_and_backlog():
+    ex = BatchExecutor(limit_for=lambda mid: 2 if mid == "a" else 3)
+    assert ex.limiter("a") is ex.limiter("a")
+    assert ex.limiter("b").limit == 3
+
+    async def go():
+        lim = ex.limiter("a")
+        for _ in range(2):
+            await lim.acquire("t")
+        waiter = asyncio.create_task(lim.acquire("t"))
+        await asyncio.sleep(0)
+        snap = ex.backlog()["a"]
+        lim.release()
+        await waiter
+        return snap
+
+    assert asyncio.run(go()) == {"active": 2, "waiting": 1}
+
+
+def test_get_batch_limit_from_env(monkeypatch):
+    monkeypatch.setenv("BATCH_CONCURRENCY", "5")
+    monkeypatch.setenv("BATCH_CONCURRENCY_2", "3")
+    assert get_batch_limit("default") == 5
+    assert get_batch_limit("2") == 3
+    assert get_batch_limit("3") == 5
@@ -0,0 +1,164 @@
+# 回复缓存：内存 LRU、SQLite 持久层、流水线接入
+import base64
+import time
+import pytest
+from src.cache import LRUBytesCache, SQLiteCache, ResponseCache, image_digest
+from src.trust_pipeline import TrustPipeline, ModelCallError
+
+
+class CountingWrapper:
+    model = "m"
+
+    def __init__(self, raw: str = "Evidence: cat\nSelf-check: ok\nAnswer: yes") -> None:
+        self.raw = raw
+        self.calls = 0
+
+    def predict(self, image_path=None, question="", image_base64=None):
+        self.calls += 1
+        return self.raw
+
+
+def test_lru_evicts_by_bytes():
+    c = LRUBytesCache(max_bytes=10)
+    c.set("a", "xxxx")
+    c.set("b", "yyyy")
+    c.get("a")  # a 变成最近用过
+    c.set("c", "zzzz")
+    assert c.get("b") is None
+    assert c.get("a") == "xxxx" and c.get("c") == "zzzz"
+    assert c.size_bytes <= 10
+
+
+def test_sqlite_ttl_and_size_eviction(tmp_path):
+    d = SQLiteCache(str(tmp_path / "c.db"), max_bytes=25, ttl_sec=60)
+    for i in range(5):
+        d.set(f"k{i}", "v" * 10)
+    assert d.size_bytes <= 25
+    assert d.get("k4") == "v" * 10
+    assert d.get("k0") is None
+    d.ttl_sec = 0
+    time.sleep(0.01)
+    assert d.get("k4") is None
+
+
+def test_image_digest_same_for_path_and_base64(tmp_path):
+    img = tmp_path / "a.jpg"
+    img.write_bytes(b"\xff\xd8fakejpeg")
+    b64 = base64.b64encode(img.read_bytes()).decode()
+    assert image_digest(str(img)) == image_digest(image_base64=b64)
+    assert image_digest(str(img)) == image_digest(image_base64="data:image/jpeg;base64," + b64)
+
+
+def test_pipeline_cache_hit_skips_model_and_persists(tmp_path):
+    path = str(tmp_path / "cache.db")
+    wr = CountingWrapper()
+    pipe = TrustPipeline(wr, cache=ResponseCache(path))
+    first = pipe.process(image_base64="aGVsbG8=", question="cat?")
+    second = pipe.process(image_base64="aGVsbG8=", question="cat?")
+    assert wr.calls == 1
+    # stats 里是耗时，两次不一定相等，只比解析结果
+    first.pop("stats"), second.pop("stats")
+    assert first == second
+    assert pipe.cache.stats["memory_hits"] == 1
+    # 换个答案类型就是另一条
+    pipe.process(image_base64="aGVsbG8=", question="cat?", answer_type="open")
+    assert wr.calls == 2
+    # 新进程（新实例）从磁盘层命中
+    pipe2 = TrustPipeline(CountingWrapper(), cache=ResponseCache(path))
+    pipe2.process(image_base64="aGVsbG8=", question="cat?")
+    assert pipe2.wrapper.calls == 0
+    assert pipe2.cache.stats["disk_hits"] == 1
+
+
+def test_pipeline_does_not_cache_error():
+    wr = CountingWrapper(raw="Error")
+    pipe = TrustPipeline(wr, cache=ResponseCache())
+    # 调用失败不当拒答返回，也不进缓存
+    for _ in range(2):
+        with pytest.raises(ModelCallError):
+            pipe.process(image_base64="aGVsbG8=", question="q")
+    assert wr.calls == 2
+
+
+#====== 图片编码缓存 ======
+def test_image_cache_hits_and_invalidates_on_change(tmp_path):
+    from src.cache import ImageCache
+
+    img = tmp_path / "a.png"
+    img.write_bytes(b"png-one")
+    c = ImageCache()
+    first = c.get(str(img))
+    assert first.data_url.startswith("data:image/png;base64,")
+    assert c.get(str(img)) is first
+    assert c.stats["hits"] == 1 and c.stats["misses"] == 1
+    img.write_bytes(b"png-two-changed")
+    assert c.get(str(img)).data_url != first.data_url
+
+
+def test_image_cache_byte_budget(tmp_path):
+    from src.cache import ImageCache
+
+    c = ImageCache(max_bytes=100)
+    for i in range(5):
+        p = tmp_path / f"{i}.jpg"
+        p.write_bytes(bytes([i]) * 30)
+        c.get(str(p))
+    assert c.stats["bytes"] <= 100
+    assert c.stats["evictions"] > 0
+
+
+def test_image_digest_does_not_encode(tmp_path, monkeypatch):
+    import hashlib
+    from src import cache as cache_mod
+
+    img = tmp_path / "a.jpg"
+    img.write_bytes(b"jpeg-bytes")
+    monkeypatch.setattr(cache_mod, "encode_image_file", lambda *a, **kw: pytest.fail("只算指纹不该编码"))
+    c = cache_mod.ImageCache()
+    sha = cache_mod.image_digest(str(img), image_cache=c)
+    assert sha == hashlib.sha256(b"jpeg-bytes").hexdigest()
+    assert c.stats["items"] == 0 and c.stats["misses"] == 0
+    # 文件变了指纹跟着变
+    img.write_bytes(b"other-jpeg-bytes")
+    assert c.digest(str(img)) == hashlib.sha256(b"other-jpeg-bytes").hexdigest()
+
+
+def test_wrapper_uses_image_cache(tmp_path):
+    from src.cache import ImageCache
+    from src.wrapper import ModelWrapper
+
+    img = tmp_path / "a.jpg"
+    img.write_bytes(b"jpeg-bytes")
+    cache = ImageCache()
+    wr = ModelWrapper(api_key="k", api_url="http://mock", model="m", image_cache=cache)
+    url1 = wr._build_image_url(str(img))
+    url2 = wr._build_image_url(str(img))
+    assert url1 == url2 == "data:image/jpeg;base64," + base64.b64encode(b"jpeg-bytes").decode()
+    assert cache.stats["hits"] == 1
+
+
+def test_image_cache_single_flight(tmp_path, monkeypatch):
+    import threading
+    from src import cache as cache_mod
+
+    img = tmp_path / "a.jpg"
+    img.write_bytes(b"\xff\xd8fake")
+    builds = []
+    real = cache_mod.encode_image_file
+
+    def slow_encode(path, pre=None):
+        builds.append(path)
+        time.sleep(0.05)
+        return real(path, pre)
+
+    monkeypatch.setattr(cache_mod, "encode_image_file", slow_encode)
+    c = cache_mod.ImageCache()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(c.get(str(img)).data_url)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # 8 个线程同时要同一张图，只编码一次
+    assert len(builds) == 1 and len(set(results)) == 1
+    assert c.stats["misses"] == 1 and c.stats["hits"] == 7
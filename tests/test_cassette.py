@@ -0,0 +1,82 @@
+# 回放磁带：从结果文件建磁带、命中不调接口、没录到时 fail / record 的行为
+import json
+import asyncio
+from unittest.mock import patch
+import httpx
+import pytest
+
+from src.cassette import Cassette, CassetteMiss, cassette_key
+from src.main import build_cassette_from_results
+from src.wrapper import ModelWrapper
+from src.trust_pipeline import TrustPipeline
+from src.ratelimit import RateLimiter, MemoryStateStore
+
+URL = "http://mock/v1/chat/completions"
+RAW = "1) Evidence: a cat on a sofa\n2) Self-check: supported\n3) Answer: yes"
+
+
+def _wrapper(cassette, model="replay-m"):
+    lim = RateLimiter("replay", store=MemoryStateStore(), breaker_failures=0)
+    return ModelWrapper(api_key="k", api_url=URL, model=model, rate_limiter=lim, max_retries=0, cassette=cassette)
+
+
+def _row(tmp_path, **kw):
+    img = tmp_path / "a.jpg"
+    img.write_bytes(b"fake image")
+    return {"question_id": 1, "local_path": str(img), "text": "Is there a cat in the image?", "model_answer": RAW, **kw}
+
+
+def _write_results(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        for r in rows:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+
+def test_build_then_replay_without_http(tmp_path):
+    results = tmp_path / "pred.jsonl"
+    tape = tmp_path / "cassette.jsonl"
+    _write_results(results, [_row(tmp_path, model="replay-m"), _row(tmp_path, question_id=2, model_answer="Error")])
+    counts = build_cassette_from_results(str(results), str(tape))
+    assert counts["added"] == 1 and counts["error"] == 1
+    # 再建一次不重复
+    assert build_cassette_from_results(str(results), str(tape))["duplicate"] == 1
+
+    wr = _wrapper(Cassette(str(tape)))
+    with patch.object(wr.session, "post", side_effect=AssertionError("不该调接口")):
+        out = TrustPipeline(wr).process(image_path=_row(tmp_path)["local_path"], question="Is there a cat in the image?")
+    assert out["answer"] == "yes" and out["raw"] == RAW
+    assert wr.retry_stats["replayed"] == 1 and wr.retry_stats["calls"] == 0
+    assert wr.cassette.stats["hits"] == 1
+
+
+def test_miss_fails_loudly(tmp_path):
+    wr = _wrapper(Cassette(str(tmp_path / "empty.jsonl")))
+    with pytest.raises(CassetteMiss):
+        TrustPipeline(wr).process(image_base64="abc", question="Is there a dog?")
+    with pytest.raises(CassetteMiss):
+        asyncio.run(wr.apredict(image_base64="abc", question="Is there a dog?"))
+
+
+def test_record_mode_appends_live_replies(tmp_path):
+    tape = tmp_path / "cassette.jsonl"
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json={"choices": [{"message": {"content": RAW}}]})
+
+    async def go(wr):
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            with patch("src.wrapper.get_async_client", return_value=client):
+                first = await wr.apredict(image_base64="abc", question="q")
+                second = await wr.apredict(image_base64="abc", question="q")
+                return first, second
+
+    wr = _wrapper(Cassette(str(tape), on_miss="record"))
+    assert asyncio.run(go(wr)) == (RAW, RAW)
+    assert len(calls) == 1
+    assert wr.cassette.stats == {"hits": 1, "misses": 1, "recorded": 1, "entries": 1}
+    # 换个进程重新读盘，key 一致
+    entry = json.loads(tape.read_text(encoding="utf-8"))
+    assert entry["key"] == cassette_key("replay-m", entry["image_sha256"], "q")
+    assert Cassette(str(tape)).lookup("replay-m", entry["image_sha256"], "q")[1] == RAW
@@ -0,0 +1,51 @@
+# 数据库：SQLite 性能参数、老库原地升级
+import sqlite3
+from sqlalchemy import inspect, text
+from src.database import create_sqlite_engine, upgrade_schema, init_db
+from src import models  # noqa: F401  注册表
+
+# 加索引之前的老表结构
+_OLD_SCHEMA = """
+CREATE TABLE evaluation_tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, task_id VARCHAR(36) NOT NULL UNIQUE,
+    started_at DATETIME, status VARCHAR(32) NOT NULL, model_name VARCHAR(128), total_duration_sec INTEGER
+);
+CREATE TABLE evaluation_records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, task_id INTEGER REFERENCES evaluation_tasks(id),
+    question VARCHAR(512) NOT NULL, image_base64 TEXT, final_answer VARCHAR(32) NOT NULL,
+    evidence TEXT, self_check TEXT, created_at DATETIME
+);
+INSERT INTO evaluation_tasks (task_id, started_at, status) VALUES ('t-1', '2026-01-01 00:00:00', 'completed');
+"""
+
+
+def test_pragmas_applied(tmp_path):
+    engine = create_sqlite_engine(str(tmp_path / "a.db"))
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+
+
+def test_upgrade_adds_missing_indexes_in_place(tmp_path):
+    path = str(tmp_path / "old.db")
+    con = sqlite3.connect(path)
+    con.executescript(_OLD_SCHEMA)
+    con.close()
+    engine = create_sqlite_engine(path)
+    changes = upgrade_schema(engine)
+    assert any("started_at" in c for c in changes)
+    assert any("evaluation_records_task_id" in c for c in changes)
+    insp = inspect(engine)
+    cols = {tuple(i["column_names"]) for i in insp.get_indexes("evaluation_records")}
+    assert ("task_id",) in cols
+    # 旧数据还在，再跑一次无变更
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT task_id FROM evaluation_tasks")).scalar() == "t-1"
+    assert upgrade_schema(engine) == []
+
+
+def test_init_db_fresh(tmp_path):
+    engine = create_sqlite_engine(str(tmp_path / "new.db"))
+    assert init_db(engine) == []
+    assert {"evaluation_tasks", "evaluation_records"} <= set(inspect(engine).get_table_names())
@@ -0,0 +1,144 @@
+# 持久化作业队列：领取 / 租约过期重领 / 迟到结果丢弃 / 重试后失败 / 释放；多个 runner 共享一个库各条只写一次
+import asyncio
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from src.database import Base, create_sqlite_engine
+from src.models import EvaluationTask, EvaluationRecord, EvaluationJob
+from src.persistence import WriteBehindQueue
+from src.batch_executor import BatchExecutor
+from src.worker import JobRunner
+from src import job_queue as jq
+
+
+@pytest.fixture
+def factory(tmp_path, monkeypatch):
+    monkeypatch.setattr(jq, "RETRY_BASE_SEC", 0.0)
+    # 落盘的库，多个连接互相看得见，和多进程 worker 的情形一致
+    engine = create_sqlite_engine(str(tmp_path / "queue.db"))
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def _run(factory, op):
+    db = factory()
+    try:
+        out = op(db)
+        db.commit()
+        return out
+    finally:
+        db.close()
+
+
+def _new_task(factory, n, model_id="default"):
+    def op(db):
+        task = EvaluationTask(task_id=f"t-{id(db)}", status="processing", total_items=n, done_items=0, failed_items=0)
+        db.add(task)
+        db.flush()
+        items = [{"question": f"q{i}", "image_base64": "b64", "image_stored": "[base64, len=3]"} for i in range(n)]
+        jq.op_enqueue(db, task.id, items, model_id, "yes_no")
+        return task.id
+    return _run(factory, op)
+
+
+def _task(factory, pk):
+    db = factory()
+    try:
+        task = db.get(EvaluationTask, pk)
+        records = db.query(EvaluationRecord).filter(EvaluationRecord.task_id == pk).all()
+        return task, records
+    finally:
+        db.close()
+
+
+def _ok(job, answer="yes"):
+    return dict(job, result={"answer": answer, "evidence": "e", "self_check": "s"})
+
+
+def test_claim_settle_completes_task(factory):
+    pk = _new_task(factory, 3)
+    a = _run(factory, lambda db: jq.op_claim(db, "w1", 2))
+    b = _run(factory, lambda db: jq.op_claim(db, "w2", 5))
+    assert [j["item"]["question"] for j in a + b] == ["q0", "q1", "q2"]
+    assert _run(factory, lambda db: jq.op_claim(db, "w3", 5)) == []
+
+    changed = _run(factory, lambda db: jq.op_settle(db, [_ok(j) for j in a + b]))
+    assert changed == [a[0]["task_uuid"]]
+    task, records = _task(factory, pk)
+    assert (task.status, task.done_items, task.failed_items, task.eta_sec) == ("completed", 3, 0, 0)
+    assert {r.image_base64 for r in records} == {"[base64, len=3]"}
+
+
+def test_expired_lease_reclaimed_and_stale_result_dropped(factory):
+    pk = _new_task(factory, 1)
+    stale = _run(factory, lambda db: jq.op_claim(db, "crashed", 1, lease_sec=-1))
+    fresh = _run(factory, lambda db: jq.op_claim(db, "w2", 1))
+    assert fresh[0]["id"] == stale[0]["id"] and fresh[0]["attempts"] == 2
+    # 原 worker 活过来交结果：租约已归别人，丢弃
+    assert _run(factory, lambda db: jq.op_settle(db, [_ok(stale[0])])) == []
+    _run(factory, lambda db: jq.op_settle(db, [_ok(fresh[0], "no")]))
+    task, records = _task(factory, pk)
+    assert task.done_items == 1 and [r.final_answer for r in records] == ["no"]
+
+
+def test_error_retries_then_fails(factory):
+    pk = _new_task(factory, 1)
+    for attempt in (1, 2):
+        job = _run(factory, lambda db: jq.op_claim(db, "w", 1, max_attempts=2))[0]
+        assert job["attempts"] == attempt
+        _run(factory, lambda db: jq.op_settle(db, [dict(job, error="boom")], max_attempts=2))
+    task, records = _task(factory, pk)
+    assert (task.status, task.done_items, task.failed_items, records) == ("completed", 0, 1, [])
+    assert _run(factory, lambda db: jq.op_claim(db, "w", 1, max_attempts=2)) == []
+
+
+def test_exhausted_expired_lease_marked_failed(factory):
+    pk = _new_task(factory, 1)
+    _run(factory, lambda db: jq.op_claim(db, "crashed", 1, lease_sec=-1, max_attempts=1))
+    assert _run(factory, lambda db: jq.op_claim(db, "w", 1, max_attempts=1)) == []
+    task, _ = _task(factory, pk)
+    assert (task.status, task.failed_items) == ("completed", 1)
+
+
+def test_release_and_heartbeat(factory):
+    _new_task(factory, 2)
+    jobs = _run(factory, lambda db: jq.op_claim(db, "w", 2, lease_sec=-1))
+    token = jobs[0]["token"]
+    assert _run(factory, lambda db: jq.op_heartbeat(db, "w", [token], lease_sec=60)) == 2
+    # 续过租就不会被别人领走
+    assert _run(factory, lambda db: jq.op_claim(db, "other", 2)) == []
+    assert _run(factory, lambda db: jq.op_release(db, [token])) == 2
+    again = _run(factory, lambda db: jq.op_claim(db, "other", 2))
+    assert [j["attempts"] for j in again] == [1, 1]
+
+
+def test_runners_share_queue_each_item_once(factory):
+    class Pipe:
+        async def aprocess(self, image_path=None, question="", image_base64=None, answer_type="yes_no"):
+            await asyncio.sleep(0.001)
+            if question == "q3":
+                raise RuntimeError("flaky")
+            return {"answer": "yes", "evidence": question, "self_check": "s"}
+
+    pk = _new_task(factory, 30)
+    writers = [WriteBehindQueue(factory, interval_sec=0.005) for _ in range(2)]
+    runners = [
+        JobRunner(w, lambda mid: Pipe(), executor=BatchExecutor(lambda mid: 4), owner=f"w{i}", max_in_flight=5)
+        for i, w in enumerate(writers)
+    ]
+
+    async def go():
+        await asyncio.gather(*(r.drain(poll_sec=0.01) for r in runners))
+
+    asyncio.run(go())
+    for w in writers:
+        w.close()
+    task, records = _task(factory, pk)
+    assert (task.status, task.done_items, task.failed_items) == ("completed", 29, 1)
+    assert sorted(r.evidence for r in records) == sorted(f"q{i}" for i in range(30) if i != 3)
+    assert sum(r.stats["claimed"] for r in runners) == 29 + jq.MAX_ATTEMPTS
+    db = factory()
+    try:
+        assert db.query(EvaluationJob).filter(EvaluationJob.status.in_(("queued", "leased"))).count() == 0
+    finally:
+        db.close()
@@ -0,0 +1,216 @@
+# 离线批量评测：并发、顺序落盘、断点续传
+import json
+import random
+import time
+import threading
+import pytest
+from src.main import run_benchmark, load_done_keys, item_key
+
+
+class FakePipeline:
+    """按题目随机睡一会儿，模拟网络延迟；记下被调过的问题。"""
+
+    def __init__(self, fail_on: str | None = None) -> None:
+        self.calls = []
+        self.fail_on = fail_on
+
+    def process(self, image_path, question):
+        self.calls.append(question)
+        time.sleep(random.uniform(0, 0.02))
+        if question == self.fail_on:
+            raise RuntimeError("boom")
+        return {"answer": "yes", "evidence": "e", "self_check": "s", "raw": f"Answer: yes ({question})"}
+
+
+@pytest.fixture
+def items(tmp_path):
+    img = tmp_path / "a.jpg"
+    img.write_bytes(b"fake")
+    return [{"question_id": i, "local_path": str(img), "text": f"q{i}", "label": "yes"} for i in range(20)]
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_run_benchmark_ordered_output(tmp_path, items):
+    out = tmp_path / "pred.jsonl"
+    written = run_benchmark(FakePipeline(), items, str(out), concurrency=8, ordered=True)
+    assert written == 20
+    assert [r["question_id"] for r in _read(out)] == list(range(20))
+
+
+def test_run_benchmark_unordered_writes_every_item(tmp_path, items):
+    out = tmp_path / "pred.jsonl"
+    run_benchmark(FakePipeline(), items, str(out), concurrency=8)
+    rows = _read(out)
+    assert sorted(r["question_id"] for r in rows) == list(range(20))
+    assert all(r["final_answer"] == "yes" for r in rows)
+
+
+def test_run_benchmark_resume_skips_done(tmp_path, items):
+    out = tmp_path / "pred.jsonl"
+    run_benchmark(FakePipeline(), items[:5], str(out), concurrency=4)
+    pipe = FakePipeline()
+    written = run_benchmark(pipe, items, str(out), concurrency=4, ordered=True)
+    assert written == 15
+    assert sorted(pipe.calls) == sorted(f"q{i}" for i in range(5, 20))
+    assert load_done_keys(str(out)) == {item_key(it) for it in items}
+
+
+def test_run_benchmark_failed_item_not_written(tmp_path, items):
+    out = tmp_path / "pred.jsonl"
+    run_benchmark(FakePipeline(fail_on="q3"), items, str(out), concurrency=4, ordered=True)
+    ids = [r["question_id"] for r in _read(out)]
+    assert 3 not in ids
+    assert ids == [i for i in range(20) if i != 3]
+
+
+def test_run_benchmark_duplicate_items_run_once(tmp_path, items):
+    out = tmp_path / "pred.jsonl"
+    pipe = FakePipeline()
+    written = run_benchmark(pipe, items[:3] + [dict(items[1])] + items[3:5], str(out), concurrency=4, ordered=True)
+    assert written == 5
+    assert [r["question_id"] for r in _read(out)] == [0, 1, 2, 3, 4]
+    assert sorted(pipe.calls) == [f"q{i}" for i in range(5)]
+
+
+def test_run_benchmark_ordered_slow_head_does_not_stall_workers(tmp_path, items):
+    others = threading.Semaphore(0)
+
+    class SlowHead(FakePipeline):
+        def process(self, image_path, question):
+            if question == "q0":
+                # 第一题等其余 19 题都做完才返回；缓冲占着提交窗口的话这里会一直等到超时
+                for _ in range(19):
+                    assert others.acquire(timeout=5), "后面的题被慢题卡住了"
+            result = super().process(image_path, question)
+            if question != "q0":
+                others.release()
+            return result
+
+    out = tmp_path / "pred.jsonl"
+    assert run_benchmark(SlowHead(), items, str(out), concurrency=2, ordered=True) == 20
+    assert [r["question_id"] for r in _read(out)] == list(range(20))
+
+
+def test_run_benchmark_model_error_not_written_and_retried_on_resume(tmp_path, items):
+    from src.trust_pipeline import TrustPipeline
+
+    class FlakyWrapper:
+        model = "m"
+
+        def __init__(self, broken: bool) -> None:
+            self.broken = broken
+
+        def predict(self, image_path=None, question="", image_base64=None):
+            if self.broken and "Question: q2\n" in question:
+                return "Error"
+            return "Evidence: e\nSelf-check: ok\nAnswer: yes"
+
+    out = tmp_path / "pred.jsonl"
+    # 重试耗尽 / 熔断返回的 "Error" 不写成拒答，也不算做过
+    assert run_benchmark(TrustPipeline(FlakyWrapper(True)), items[:4], str(out), concurrency=2) == 3
+    assert sorted(r["question_id"] for r in _read(out)) == [0, 1, 3]
+    assert run_benchmark(TrustPipeline(FlakyWrapper(False)), items[:4], str(out), concurrency=2) == 1
+    assert all(r["final_answer"] == "yes" for r in _read(out))
+
+
+def test_run_benchmark_ordered_buffer_is_capped(tmp_path, items, monkeypatch):
+    import src.main as main_mod
+
+    monkeypatch.setattr(main_mod, "REORDER_BUFFER_WINDOWS", 1)
+    release = threading.Event()
+    done_while_stuck = []
+
+    class StuckHead(FakePipeline):
+        def process(self, image_path, question):
+            if question == "q0":
+                release.wait(0.5)
+                done_while_stuck.append(len(self.calls))
+            return super().process(image_path, question)
+
+    out = tmp_path / "pred.jsonl"
+    assert run_benchmark(StuckHead(), items, str(out), concurrency=2, ordered=True) == 20
+    # 窗口 4、缓冲上限 4：头一题卡住时，后面最多做完 上限 + 窗口内在飞的 那几题就停止提交
+    assert done_while_stuck[0] <= 4 + 3
+    assert [r["question_id"] for r in _read(out)] == list(range(20))
+
+
+#====== 多模型对比：每题并发发给各模型，各自一行，断点续传按模型补 ======
+class SlowPipeline(FakePipeline):
+    def __init__(self, delay: float, fail_on: str | None = None) -> None:
+        super().__init__(fail_on)
+        self.delay = delay
+
+    def process(self, image_path, question):
+        time.sleep(self.delay)
+        return super().process(image_path, question)
+
+
+def test_run_compare_fans_out_and_resumes(tmp_path, items):
+    from src.main import run_compare
+
+    out = tmp_path / "compare.jsonl"
+    fast, slow = FakePipeline(), SlowPipeline(0.02, fail_on="q3")
+    t0 = time.perf_counter()
+    written = run_compare({"default": fast, "2": slow}, items[:10], str(out), concurrency=5)
+    # 两个模型并发：总耗时跟着慢模型走，不是两者相加
+    assert time.perf_counter() - t0 < 10 * 0.02
+    assert written == 19
+    rows = _read(out)
+    assert sorted(r["question_id"] for r in rows if r["model_id"] == "default") == list(range(10))
+    assert sorted(r["question_id"] for r in rows if r["model_id"] == "2") == [i for i in range(10) if i != 3]
+
+    fast, slow = FakePipeline(), SlowPipeline(0)
+    assert run_compare({"default": fast, "2": slow}, items[:10], str(out), concurrency=5) == 1
+    assert fast.calls == [] and slow.calls == ["q3"]
+
+
+#====== 分片：按 key 稳定哈希拆题，各片各自续跑，合并回题库顺序并去重 ======
+def test_shards_partition_items_stably(items):
+    import argparse
+    from src.main import parse_shard, shard_of
+
+    assert parse_shard("1/4") == (1, 4)
+    for bad in ("4/4", "x", "1/0"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(bad)
+    keys = [item_key(it) for it in items]
+    owners = [shard_of(k, 3) for k in keys]
+    # 每题恰好归一片，且与进程无关（sha1，不是内置 hash）
+    assert owners == [shard_of(k, 3) for k in keys]
+    assert set(owners) == {0, 1, 2}
+
+
+def test_sharded_runs_merge_in_input_order(tmp_path, items):
+    from src.main import shard_of, shard_path, find_shards, merge_shards
+
+    out = tmp_path / "pred.jsonl"
+    for i in range(3):
+        mine = [it for it in items if shard_of(item_key(it), 3) == i]
+        run_benchmark(FakePipeline(), mine, shard_path(str(out), i, 3), concurrency=4)
+    assert find_shards(str(out)) == [shard_path(str(out), i, 3) for i in range(3)]
+    # 某片重跑时重复写了一行，合并时去掉
+    with open(shard_path(str(out), 0, 3), "a", encoding="utf-8") as f:
+        f.write(json.dumps(_read(shard_path(str(out), 0, 3))[0]) + "\n")
+
+    counts = merge_shards(items, str(out))
+    assert counts["written"] == 20 and counts["duplicate"] == 1
+    assert [r["question_id"] for r in _read(out)] == list(range(20))
+    # 再合并一次结果不变
+    before = out.read_text(encoding="utf-8")
+    merge_shards(items, str(out))
+    assert out.read_text(encoding="utf-8") == before
+
+
+def test_merge_compare_rows_keep_each_model(tmp_path, items):
+    from src.main import run_compare, shard_path, merge_shards
+
+    out = tmp_path / "compare.jsonl"
+    run_compare({"default": FakePipeline(), "2": FakePipeline()}, items[5:10], shard_path(str(out), 1, 2), concurrency=3)
+    run_compare({"default": FakePipeline(), "2": FakePipeline()}, items[:5], shard_path(str(out), 0, 2), concurrency=3)
+    merge_shards(items[:10], str(out))
+    rows = _read(out)
+    assert [(r["question_id"], r["model_id"]) for r in rows] == [(i, m) for i in range(10) for m in ("2", "default")]
@@ -0,0 +1,76 @@
+# 向量化指标：编码、分组混淆矩阵、bootstrap 置信区间
+import random
+import pytest
+
+np = pytest.importorskip("numpy")
+from src.analysis import score_row
+from src.metrics import MetricsCollector, compute_metrics, group_value, encode_pred, REFUSED
+
+
+def _rows(n=400, seed=0):
+    rnd = random.Random(seed)
+    objs = ["cat", "dog", "traffic light"]
+    out = []
+    for i in range(n):
+        gt = rnd.choice(["yes", "no"])
+        fa = rnd.choices(["yes", "no", "refused"], weights=[5, 5, 1])[0]
+        out.append({
+            "question_id": i,
+            "text": f"Is there a {rnd.choice(objs)} in the image?",
+            "label": gt,
+            "final_answer": fa,
+            "model_name": rnd.choice(["m1", "m2"]),
+        })
+    return out
+
+
+def test_overall_matches_scalar_analysis():
+    rows = _rows()
+    col = MetricsCollector()
+    for r in rows:
+        col.add(r)
+    m = compute_metrics(col)["overall"]
+    details = [score_row(r) for r in rows]
+    correct = sum(d["correct"] for d in details)
+    fp = sum(d["is_fp"] for d in details)
+    label_no = sum(r["label"] == "no" for r in rows)
+    assert m["n"] == len(rows)
+    assert m["accuracy"] == pytest.approx(correct / len(rows), abs=1e-6)
+    assert m["hallucination_rate"] == pytest.approx(fp / label_no, abs=1e-6)
+    assert m["refusal_rate"] == pytest.approx(sum(r["final_answer"] == "refused" for r in rows) / len(rows), abs=1e-6)
+
+
+def test_grouped_breakdown_matches_naive():
+    rows = _rows()
+    col = MetricsCollector(group_by=("object", "model"))
+    for r in rows:
+        col.add(r)
+    by = compute_metrics(col)["by"]
+    assert set(by["object"]) == {"cat", "dog", "traffic light"}
+    for model in ("m1", "m2"):
+        sub = [r for r in rows if r["model_name"] == model]
+        yes_ratio = sum(r["final_answer"] == "yes" for r in sub) / len(sub)
+        assert by["model"][model]["n"] == len(sub)
+        assert by["model"][model]["yes_ratio"] == pytest.approx(yes_ratio, abs=1e-6)
+
+
+def test_bootstrap_ci_brackets_estimate_and_shrinks():
+    small, big = MetricsCollector(), MetricsCollector()
+    for r in _rows(100, seed=1):
+        small.add(r)
+    for r in _rows(5000, seed=1):
+        big.add(r)
+    ms = compute_metrics(small, n_boot=500)["overall"]
+    mb = compute_metrics(big, n_boot=500)["overall"]
+    lo, hi = ms["accuracy_ci"]
+    assert lo <= ms["accuracy"] <= hi
+    assert (mb["accuracy_ci"][1] - mb["accuracy_ci"][0]) < (hi - lo)
+
+
+def test_group_value_and_encoding():
+    assert group_value({"text": "Is there an apple in the image?"}, "object") == "apple"
+    assert group_value({}, "split", source="/x/coco_pope_adversarial.jsonl") == "adversarial"
+    assert group_value({"split": "popular"}, "split") == "popular"
+    assert encode_pred({"final_answer": "refused"}) == REFUSED
+    with pytest.raises(ValueError):
+        MetricsCollector(group_by=("nope",))
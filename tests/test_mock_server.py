@@ -0,0 +1,60 @@
+# 压测用的模拟视觉接口：回复形状与 ModelWrapper / TrustPipeline 对得上，流式、usage、故障注入可用
+import asyncio
+from unittest.mock import patch
+import httpx
+
+from benchmarks.mock_server import create_app
+from src.wrapper import ModelWrapper
+from src.trust_pipeline import TrustPipeline
+from src.ratelimit import RateLimiter, MemoryStateStore
+
+URL = "http://mock/v1/chat/completions"
+
+
+def _run(app, coro_fn):
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app)) as client:
+            with patch("src.wrapper.get_async_client", return_value=client), patch("src.wrapper.BACKOFF_BASE", 0.0):
+                return await coro_fn(client)
+
+    return asyncio.run(go())
+
+
+def _wrapper(**kw):
+    lim = RateLimiter("mock", store=MemoryStateStore(), breaker_failures=0)
+    return ModelWrapper(api_key="k", api_url=URL, model="mock-vl", rate_limiter=lim, **kw)
+
+
+def test_pipeline_parses_mock_reply_with_usage():
+    app = create_app(latency_ms=1, yes_ratio=1.0, refuse_ratio=0.0, seed=0)
+    pipe = TrustPipeline(_wrapper())
+    out = _run(app, lambda c: pipe.aprocess(image_base64="abc", question="Is there a cat in the image?"))
+    assert out["answer"] == "yes" and "cat" in out["evidence"]
+    assert out["stats"]["prompt_tokens"] > 85 and out["stats"]["completion_tokens"] > 0
+
+
+def test_stream_chunks_and_usage():
+    app = create_app(latency_ms=1, chunk_chars=8, stream_usage=True, yes_ratio=0.0, refuse_ratio=0.0)
+    pipe = TrustPipeline(_wrapper())
+
+    async def go(client):
+        events = [e async for e in pipe.astream(image_base64="abc", question="Is there a dog in the image?", stop_at_answer=False)]
+        return events
+
+    events = _run(app, go)
+    assert sum(1 for name, _ in events if name == "delta") > 5
+    done = events[-1][1]
+    assert done["answer"] == "no" and done["stats"]["completion_tokens"] > 0
+
+
+def test_fault_injection_counts_and_retries():
+    app = create_app(latency_ms=1, rate_429=1.0, retry_after_sec=0)
+    wr = _wrapper(max_retries=2)
+
+    async def go(client):
+        out = await wr.apredict(image_base64="abc", question="hi")
+        return out, (await client.get("http://mock/stats")).json()
+
+    out, stats = _run(app, go)
+    assert out == "Error"
+    assert stats["requests"] == 3 and stats["429"] == 3 and stats["ok"] == 0
@@ -0,0 +1,89 @@
+# 写后落库队列：攒批提交、单条失败隔离、关闭时落盘
+import pytest
+from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import StaticPool
+from src.persistence import WriteBehindQueue
+
+_Base = declarative_base()
+
+
+class Row(_Base):
+    __tablename__ = "rows"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(32), nullable=False, unique=True)
+
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine(
+        "sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    _Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def _names(factory):
+    db = factory()
+    try:
+        return sorted(r.name for r in db.query(Row).all())
+    finally:
+        db.close()
+
+
+def test_group_commit(session_factory):
+    w = WriteBehindQueue(session_factory, max_ops=100, interval_sec=0.2)
+    for i in range(50):
+        w.submit(lambda db, i=i: db.add(Row(name=f"r{i}")))
+    w.flush()
+    assert len(_names(session_factory)) == 50
+    # 50 条 + flush 屏障，远少于 51 次提交
+    assert w.stats["commits"] <= 3
+    w.close()
+
+
+def test_failed_op_does_not_poison_group(session_factory):
+    w = WriteBehindQueue(session_factory, max_ops=100, interval_sec=0.2)
+    ok1 = w.submit(lambda db: db.add(Row(name="a")))
+
+    def bad(db):
+        raise ValueError("bad op")
+
+    failed = w.submit(bad)
+    ok2 = w.submit(lambda db: db.add(Row(name="b")))
+    ok2.result(timeout=5)
+    assert ok1.exception() is None
+    with pytest.raises(ValueError):
+        failed.result()
+    assert _names(session_factory) == ["a", "b"]
+    assert w.stats["failed_ops"] == 1
+    w.close()
+
+
+def test_close_flushes_pending(session_factory):
+    w = WriteBehindQueue(session_factory, max_ops=1000, interval_sec=10)
+    for i in range(10):
+        w.submit(lambda db, i=i: db.add(Row(name=f"r{i}")))
+    w.close()
+    assert len(_names(session_factory)) == 10
+    with pytest.raises(RuntimeError):
+        w.submit(lambda db: None)
+
+
+def test_session_factory_failure_fails_group_and_keeps_writer(session_factory):
+    calls = {"n": 0}
+
+    def flaky():
+        calls["n"] += 1
+        if calls["n"] == 1:
+            raise RuntimeError("database is locked")
+        return session_factory()
+
+    w = WriteBehindQueue(flaky, max_ops=100, interval_sec=0.05)
+    fut = w.submit(lambda db: db.add(Row(name="a")))
+    with pytest.raises(RuntimeError, match="locked"):
+        fut.result(timeout=2)
+    # 写线程还活着，后面的照常落库
+    assert w.submit(lambda db: db.add(Row(name="b"))).result(timeout=2) is None
+    w.close()
+    assert _names(session_factory) == ["b"]
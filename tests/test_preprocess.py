@@ -0,0 +1,66 @@
+# 上传前图片预处理：缩放、去元数据、重新编码、统计
+import base64
+import io
+import pytest
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image
+from src.cache import ImageCache
+from src.preprocess import ImagePreprocessor
+from src.wrapper import ModelWrapper
+
+
+def _png_bytes(w=1600, h=1200, mode="RGBA") -> bytes:
+    img = Image.new(mode, (w, h), (200, 30, 30, 255) if mode == "RGBA" else (200, 30, 30))
+    # 加点噪声，避免纯色图压缩得比缩略图还小
+    for x in range(0, w, 7):
+        img.putpixel((x, x % h), (x % 255, 0, 0, 255) if mode == "RGBA" else (x % 255, 0, 0))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_process_resizes_and_reencodes():
+    pre = ImagePreprocessor(detail="low")
+    out, mime = pre.process(_png_bytes(), "image/png")
+    assert mime == "image/jpeg"
+    with Image.open(io.BytesIO(out)) as img:
+        assert max(img.size) == 512
+        assert img.format == "JPEG"
+        assert "exif" not in img.info
+
+
+def test_process_keeps_original_when_not_smaller():
+    pre = ImagePreprocessor(detail="low")
+    tiny = _png_bytes(4, 4, mode="RGB")
+    out, mime = pre.process(tiny, "image/png")
+    assert (out, mime) == (tiny, "image/png")
+
+
+def test_process_passes_through_undecodable():
+    pre = ImagePreprocessor()
+    assert pre.process(b"not an image", "image/jpeg") == (b"not an image", "image/jpeg")
+
+
+def test_wrapper_preprocesses_and_reports_savings(tmp_path):
+    img = tmp_path / "big.png"
+    img.write_bytes(_png_bytes())
+    pre = ImagePreprocessor(detail="low", fmt="WEBP")
+    wr = ModelWrapper(api_key="k", api_url="http://mock", model="m", image_cache=ImageCache(), preprocessor=pre)
+    url = wr._build_image_url(str(img))
+    assert url.startswith("data:image/webp;base64,")
+    wr._build_image_url(str(img))
+    # 两次上传都记账，但只真正处理一次
+    stats = pre.stats
+    assert stats["uploads"] == 2 and stats["processed"] == 1
+    assert stats["bytes_saved"] > 0
+    assert "saved" in pre.report()
+
+
+def test_wrapper_preprocesses_base64_upload():
+    raw = base64.b64encode(_png_bytes()).decode()
+    pre = ImagePreprocessor(detail="low")
+    wr = ModelWrapper(api_key="k", api_url="http://mock", model="m", image_cache=ImageCache(), preprocessor=pre)
+    url = wr._build_image_url(image_base64="data:image/png;base64," + raw)
+    assert url.startswith("data:image/jpeg;base64,")
+    assert len(url) < len(raw)
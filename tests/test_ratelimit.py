@@ -0,0 +1,127 @@
+# 限速与熔断：预约式令牌桶、跨进程共享（SQLite）、429 压桶、熔断快速失败与探测恢复
+import asyncio
+import time
+from unittest.mock import patch
+import httpx
+import pytest
+
+from src.ratelimit import RateLimiter, MemoryStateStore, SQLiteStateStore, CircuitOpenError
+from src.wrapper import ModelWrapper
+
+
+def test_bucket_reserves_in_order():
+    lim = RateLimiter("k", rpm=600, burst=2, store=MemoryStateStore(), breaker_failures=0)
+    waits = [lim.reserve() for _ in range(4)]
+    # 10 个/秒、突发 2：前两个立即发，后面的按 0.1s 间隔排
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(0.1, abs=0.01) and waits[3] == pytest.approx(0.2, abs=0.01)
+
+
+def test_sqlite_store_shared_between_instances(tmp_path):
+    path = str(tmp_path / "rl.db")
+    # 两个存储实例各自连库，等同于两个进程
+    a = RateLimiter("u|m", rpm=60, burst=1, store=SQLiteStateStore(path), breaker_failures=0)
+    b = RateLimiter("u|m", rpm=60, burst=1, store=SQLiteStateStore(path), breaker_failures=0)
+    assert a.reserve() == 0.0
+    assert b.reserve() == pytest.approx(1.0, abs=0.05)
+    assert a.reserve() == pytest.approx(2.0, abs=0.05)
+
+
+def test_throttled_pushes_bucket_back():
+    lim = RateLimiter("k", rpm=6000, burst=5, store=MemoryStateStore(), breaker_failures=0)
+    lim.record("throttled", retry_after=0.5)
+    assert lim.reserve() == pytest.approx(0.5, abs=0.02)
+
+
+def test_breaker_opens_probes_and_recovers():
+    lim = RateLimiter("k", store=MemoryStateStore(), breaker_failures=2, breaker_cooldown=0.1)
+    lim.record("fail")
+    assert lim.reserve() == 0.0
+    lim.record("fail")
+    with pytest.raises(CircuitOpenError):
+        lim.reserve()
+    time.sleep(0.12)
+    # 冷却到点只放一个探测，其余继续快速失败
+    assert lim.reserve() == 0.0
+    with pytest.raises(CircuitOpenError):
+        lim.reserve()
+    lim.record("ok")
+    assert lim.reserve() == 0.0 and not lim.state()["open"]
+
+
+def test_cancelled_probe_frees_slot():
+    lim = RateLimiter("k", store=MemoryStateStore(), breaker_failures=1, breaker_cooldown=0.05)
+    lim.record("fail")
+    time.sleep(0.06)
+    assert lim.reserve() == 0.0
+    with pytest.raises(CircuitOpenError):
+        lim.reserve()
+    # 探测请求被调用方放弃：不算成败，下一个请求接着探，熔断计数不动
+    lim.record("cancel")
+    assert lim.reserve() == 0.0
+    assert lim.state()["failures"] == 1
+
+
+def test_wrapper_fails_fast_while_open():
+    lim = RateLimiter("mock|m", store=MemoryStateStore(), breaker_failures=2, breaker_cooldown=60)
+    wr = ModelWrapper(api_key="k", api_url="http://mock/v1/chat/completions", model="m", max_retries=1, rate_limiter=lim)
+    calls = {"n": 0}
+
+    def handler(request):
+        calls["n"] += 1
+        return httpx.Response(503)
+
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            with patch("src.wrapper.get_async_client", return_value=client), patch("src.wrapper.BACKOFF_BASE", 0.0):
+                return [await wr.apredict(image_base64="abc", question="hi") for _ in range(3)]
+
+    assert asyncio.run(go()) == ["Error"] * 3
+    # 第一次调用的两次尝试把熔断打开，后面两次没再打到服务端
+    assert calls["n"] == 2
+    assert wr.retry_stats["failed"] == 3
+
+
+def test_sqlite_store_skips_write_lock_when_unchanged(tmp_path):
+    store = SQLiteStateStore(str(tmp_path / "rl.db"))
+    lim = RateLimiter("u|m", store=store, breaker_failures=3)
+    lim.record("fail")
+    changes = store._conn.total_changes
+    lim.reserve()
+    lim.record("fail")
+    lim.record("ok")
+    assert store._conn.total_changes == changes + 2
+    # 成功请求在熔断计数为 0 时不写库
+    for _ in range(5):
+        lim.reserve()
+        lim.record("ok")
+    assert store._conn.total_changes == changes + 2
+
+
+def test_default_store_is_memory_unless_configured(tmp_path, monkeypatch):
+    import src.ratelimit as rl
+
+    monkeypatch.setattr(rl, "_default_store", None)
+    monkeypatch.delenv("MM_TRUSTBENCH_RATELIMIT_DB", raising=False)
+    assert isinstance(rl.get_state_store(), MemoryStateStore)
+    monkeypatch.setattr(rl, "_default_store", None)
+    monkeypatch.setenv("MM_TRUSTBENCH_RATELIMIT_DB", str(tmp_path / "rl.db"))
+    assert isinstance(rl.get_state_store(), SQLiteStateStore)
+    monkeypatch.setattr(rl, "_default_store", None)
+
+
+def test_wrapper_groups_key_limiter_on_resolved_model(monkeypatch):
+    from src.wrapper import get_available_wrappers, DEFAULT_MODEL
+
+    monkeypatch.setenv("API_URL", "http://shared/v1")
+    monkeypatch.delenv("MODEL_NAME", raising=False)
+    monkeypatch.setenv("API_KEY_2", "k2")
+    monkeypatch.setenv("RATE_LIMIT_RPM_3", "120")
+    monkeypatch.setenv("API_KEY_3", "k3")
+    monkeypatch.setenv("MODEL_NAME_3", "other-m")
+    wrappers = dict(get_available_wrappers())
+    # 第 2 组没配 url / 模型名：和默认一组是同一个 (api_url, model)，共用一个桶
+    assert wrappers["2"].rate_limiter is wrappers["default"].rate_limiter
+    assert wrappers["2"].rate_limiter.key == f"http://shared/v1|{DEFAULT_MODEL}"
+    assert wrappers["3"].rate_limiter.key == "http://shared/v1|other-m"
+    assert wrappers["3"].rate_limiter.rate == 2.0
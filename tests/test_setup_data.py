@@ -0,0 +1,126 @@
+# 数据准备：多 split 抽样、同图只取一次、目录 / file:// / tar / HTTP 几种来源、校验和
+import json
+import tarfile
+import threading
+import functools
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import pytest
+import requests
+
+import setup_data
+from setup_data import sample_items, main
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    """本地镜像：两个 split 的题库，每 split 20 题、10 张图（每张图两道题，一 yes 一 no）。"""
+    root = tmp_path / "mirror"
+    (root / "val2014").mkdir(parents=True)
+    for split in ("random", "popular"):
+        with open(root / f"coco_pope_{split}.json", "w", encoding="utf-8") as f:
+            for i in range(20):
+                item = {"question_id": i + 1, "image": f"img{i // 2}.jpg", "text": f"Is there a thing{i} in the image?",
+                        "label": "yes" if i % 2 == 0 else "no"}
+                f.write(json.dumps(item) + "\n")
+    for k in range(10):
+        (root / "val2014" / f"img{k}.jpg").write_bytes(b"jpeg-bytes-%d" % k)
+    return root
+
+
+def _run(tmp_path, *extra):
+    out = tmp_path / "out" / "pope.jsonl"
+    img_dir = tmp_path / "out" / "images"
+    # 不传 --checksums：清单默认跟着 --img-dir 走
+    code = main(["--output", str(out), "--img-dir", str(img_dir), *extra])
+    rows = [json.loads(line) for line in out.read_text(encoding="utf-8").splitlines()]
+    return code, rows, img_dir
+
+
+def test_stratified_sampling_is_balanced_and_stable():
+    items = [{"label": "yes" if i < 30 else "no", "i": i} for i in range(100)]
+    picked = sample_items(items, 10, "stratified", seed=3)
+    assert sum(1 for it in picked if it["label"] == "yes") == 3
+    assert [it["i"] for it in picked] == sorted(it["i"] for it in picked)
+    assert picked == sample_items(items, 10, "stratified", seed=3)
+    assert sample_items(items, 5, "head") == items[:5]
+    assert len(sample_items(items, 0, "random")) == 100
+
+
+def test_all_splits_from_mirror_dir(tmp_path, mirror):
+    code, rows, img_dir = _run(tmp_path, "--splits", "random,popular", "--n", "0",
+                               "--pope-source", str(mirror), "--image-source", str(mirror))
+    assert code == 0 and len(rows) == 40
+    # 多 split 时 question_id 带前缀，不撞 key
+    assert len({r["question_id"] for r in rows}) == 40
+    assert {r["split"] for r in rows} == {"random", "popular"}
+    assert sorted(p.name for p in img_dir.glob("*.jpg")) == [f"img{k}.jpg" for k in range(10)]
+    assert len((img_dir / "SHA256SUMS").read_text().splitlines()) == 10
+
+
+def test_file_url_and_tarball_sources(tmp_path, mirror):
+    tarball = tmp_path / "val2014.tar.gz"
+    with tarfile.open(tarball, "w:gz") as tf:
+        tf.add(mirror / "val2014", arcname="val2014")
+    code, rows, img_dir = _run(tmp_path, "--n", "6", "--sample", "stratified",
+                               "--pope-source", mirror.as_uri(), "--image-source", str(tarball))
+    assert code == 0 and len(rows) == 6
+    assert sum(r["label"] == "yes" for r in rows) == 3
+    assert all((img_dir / r["image"]).exists() for r in rows)
+
+
+def test_checksum_mismatch_drops_item(tmp_path, mirror):
+    img_dir = tmp_path / "out" / "images"
+    img_dir.mkdir(parents=True)
+    (img_dir / "SHA256SUMS").write_text("0" * 64 + "  img0.jpg\n")
+    code, rows, _ = _run(tmp_path, "--n", "4", "--pope-source", str(mirror), "--image-source", str(mirror))
+    assert code == 1
+    assert [r["image"] for r in rows] == ["img1.jpg", "img1.jpg"]
+    assert not (img_dir / "img0.jpg").exists()
+
+
+def test_http_source_pooled_download(tmp_path, mirror, monkeypatch):
+    class Quiet(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    handler = functools.partial(Quiet, directory=str(mirror / "val2014"))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(setup_data, "DOWNLOAD_RETRIES", 0)
+    try:
+        code, rows, img_dir = _run(tmp_path, "--n", "0", "--workers", "4", "--pope-source", str(mirror),
+                                   "--image-source", f"http://127.0.0.1:{server.server_port}/")
+    finally:
+        server.shutdown()
+    assert code == 0 and len(rows) == 20
+    assert (img_dir / "img9.jpg").read_bytes() == b"jpeg-bytes-9"
+    assert not list(img_dir.glob("*.part"))
+
+
+def test_http_fetch_retries_broken_chunked_body(tmp_path, monkeypatch):
+    class Broken:
+        status_code = 200
+        headers = {}
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def iter_content(self, chunk_size):
+            yield b"half"
+            raise requests.exceptions.ChunkedEncodingError("connection broken")
+
+    class Whole(Broken):
+        def iter_content(self, chunk_size):
+            yield b"whole image"
+
+    responses = [Broken(), Whole()]
+    source = setup_data.HttpSource("http://mirror/")
+    monkeypatch.setattr(source.session, "get", lambda url, **kw: responses.pop(0))
+    monkeypatch.setattr(setup_data.time, "sleep", lambda s: None)
+    save_path = tmp_path / "img0.jpg"
+    source.fetch("img0.jpg", str(save_path))
+    assert save_path.read_bytes() == b"whole image" and not responses
+    assert not (tmp_path / "img0.jpg.part").exists()
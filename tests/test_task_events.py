@@ -0,0 +1,22 @@
+# 任务事件通知：跨线程唤醒订阅方、退订后不再持有
+import asyncio
+import threading
+from src.task_events import TaskEventHub
+
+
+def test_notify_from_other_thread_wakes_subscriber():
+    hub = TaskEventHub()
+
+    async def go():
+        with hub.subscribe("t1") as wake:
+            assert hub.subscribers("t1") == 1
+            threading.Thread(target=hub.notify, args=("t1",)).start()
+            await asyncio.wait_for(wake.wait(), 2)
+            # 别的任务的通知不唤醒
+            wake.clear()
+            hub.notify("t2")
+            await asyncio.sleep(0.01)
+            assert not wake.is_set()
+        assert hub.subscribers("t1") == 0
+
+    asyncio.run(go())
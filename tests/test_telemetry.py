@@ -0,0 +1,84 @@
+# 指标：文本格式、直方图累计桶、抓取时现算的 gauge、/metrics 接口与热路径埋点
+import asyncio
+from unittest.mock import patch, AsyncMock
+import httpx
+from fastapi.testclient import TestClient
+
+from src.telemetry import Registry, Counter, Gauge, Histogram, answer_bucket
+from src.wrapper import ModelWrapper
+from src.api import app
+
+client = TestClient(app)
+
+
+def _metrics_text() -> str:
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    return resp.text
+
+
+def test_render_counter_and_histogram():
+    reg = Registry()
+    c = Counter("t_total", "计数", ("kind",), registry=reg)
+    c.labels("a").inc()
+    c.labels("a").inc(2)
+    h = Histogram("t_seconds", "耗时", buckets=(0.1, 1.0), registry=reg)
+    for v in (0.05, 0.5, 5):
+        h.observe(v)
+    text = reg.render()
+    assert "# TYPE t_total counter" in text
+    assert 't_total{kind="a"} 3' in text
+    # 桶是累计的，+Inf 等于总数
+    assert 't_seconds_bucket{le="0.1"} 1' in text
+    assert 't_seconds_bucket{le="1"} 2' in text
+    assert 't_seconds_bucket{le="+Inf"} 3' in text
+    assert "t_seconds_count 3" in text and "t_seconds_sum 5.55" in text
+
+
+def test_gauge_function_and_failure():
+    reg = Registry()
+    g = Gauge("t_backlog", "积压", ("model",), registry=reg)
+    g.set_function(lambda: {("m",): 4})
+    assert 't_backlog{model="m"} 4' in reg.render()
+    g.set_function(lambda: 1 / 0)
+    # 现算失败只少这一项
+    assert "# TYPE t_backlog gauge" in reg.render()
+
+
+def test_answer_bucket():
+    assert answer_bucket("Error", "refused") == "error"
+    assert answer_bucket("Answer: yes", "yes") == "yes"
+    assert answer_bucket("Answer: 3", "3") == "open"
+
+
+def test_wrapper_records_attempt_status():
+    wr = ModelWrapper(api_key="k", api_url="http://mock/v1/chat/completions", model="telemetry-m", max_retries=0)
+
+    def handler(request):
+        return httpx.Response(200, json={"choices": [{"message": {"content": "Answer: yes"}}]})
+
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            with patch("src.wrapper.get_async_client", return_value=client):
+                return await wr.apredict(image_base64="abc", question="hi")
+
+    assert asyncio.run(go()) == "Answer: yes"
+    text = _metrics_text()
+    assert 'mm_trustbench_model_request_duration_seconds_count{model="telemetry-m",status="200"} 1' in text
+    assert 'mm_trustbench_model_requests_in_flight{model="telemetry-m"} 0' in text
+    assert 'mm_trustbench_model_response_chars_sum{model="telemetry-m"} 11' in text
+
+
+@patch("src.api._get_pipeline")
+def test_metrics_endpoint_after_evaluate(mock_get_pipeline):
+    mock_get_pipeline.return_value.aprocess = AsyncMock(return_value={
+        "answer": "yes", "evidence": "e", "self_check": "s", "raw": "Answer: yes",
+    })
+    mock_get_pipeline.return_value.wrapper.model = "m"
+    assert client.post("/api/v1/evaluate", json={"question": "q", "image_base64": "abc"}).status_code == 200
+    text = _metrics_text()
+    # 路由按模板记
+    assert 'route="/api/v1/evaluate",status="200"' in text
+    assert "mm_trustbench_db_writer_pending " in text
+    assert 'mm_trustbench_jobs{status="queued"}' in text
@@ -0,0 +1,128 @@
+# 回复解析：预编译单遍解析器与改写前实现逐条对拍、流式增量解析，外加几条关键行为
+import random
+import asyncio
+import pytest
+
+from src.trust_pipeline import TrustPipeline, StreamParser, parse_response
+from src.analysis import extract_yes_no
+from benchmarks.parser_corpus import build_corpus, synth_corpus, reference_parse_response, reference_extract_yes_no
+
+
+def _fuzz(n=3000, seed=7):
+    # 由标题碎片、空白、编号随机拼接，专门戳边界：标题贴在结尾、连续空行、重复标题
+    rnd = random.Random(seed)
+    atoms = ["Evidence:", "evidence:", "SELF-CHECK:", "Self-check:", "Answer:", "answer:", "ANSWER:",
+             "yes", "No", "Unsupported", " ", "\n", "\n\n", "\t", "1)", "2)", "3)", "cat", "ſelf-check:", "é"]
+    return ["".join(rnd.choice(atoms) for _ in range(rnd.randint(0, 12))) for _ in range(n)]
+
+
+@pytest.mark.parametrize("answer_type", ["yes_no", "open"])
+def test_parse_matches_reference(answer_type):
+    for raw in build_corpus(3000, seed=1) + _fuzz() + ["", "Error", "  Error  ", "Answer:", "Answer:   "]:
+        assert parse_response(raw, answer_type) == reference_parse_response(raw, answer_type), repr(raw)
+
+
+def test_extract_yes_no_matches_reference():
+    for raw in build_corpus(3000, seed=2) + _fuzz(seed=8):
+        assert extract_yes_no(raw) == reference_extract_yes_no(raw), repr(raw)
+
+
+def test_parse_sections_and_answer():
+    raw = "1) Evidence: a cat on the sofa\n2) Self-check: supported\n3) Answer: Yes"
+    out = parse_response(raw)
+    assert out == {"answer": "yes", "evidence": "a cat on the sofa", "self_check": "supported", "raw": raw}
+    assert parse_response("Self-check: Unsupported claim\nAnswer: no")["answer"] == "refused"
+    assert parse_response("Answer: 3 people\n\nextra", "open")["answer"] == "3 people"
+    assert parse_response("Answer: unsupported", "open")["answer"] == "refused"
+
+
+def test_pipeline_uses_parser():
+    p = TrustPipeline(wrapper=None)
+    for raw in synth_corpus(200, seed=3):
+        assert p._parse_response(raw, "open") == parse_response(raw, "open")
+
+
+#====== 流式增量解析 ======
+def _chunks(raw, rnd):
+    i, out = 0, []
+    while i < len(raw):
+        j = i + rnd.randint(1, 8)
+        out.append(raw[i:j])
+        i = j
+    return out
+
+
+@pytest.mark.parametrize("answer_type", ["yes_no", "open"])
+def test_stream_parser_sections_match_full_parse(answer_type):
+    rnd = random.Random(5)
+    for raw in synth_corpus(800, seed=6):
+        parser = StreamParser(answer_type)
+        sections = {}
+        for chunk in _chunks(raw, rnd):
+            sections.update(parser.feed(chunk))
+        rest, parsed = parser.finish()
+        sections.update(rest)
+        assert parsed == parse_response(raw, answer_type)
+        expected = parse_response(raw, answer_type)
+        # 按标准顺序输出时，提前定稿的段与全文解析一致
+        lowered = raw.lower()
+        if 0 <= lowered.find("evidence:") < lowered.find("self-check:") < lowered.find("answer:"):
+            assert {k: sections[k] for k in ("evidence", "self_check", "answer")} == \
+                {k: expected[k] for k in ("evidence", "self_check", "answer")}, repr(raw)
+
+
+def test_stream_parser_scans_only_new_text():
+    from src.trust_pipeline import _find_heads
+
+    raw = "1) EVIDENCE: a cat\n2) Self-Check: supported, evidence: ok\n3) Answer: yes"
+    parser = StreamParser()
+    # 一次一个字符：标题全被切开，也要和整段一次扫出来的一样
+    sections = dict(section for ch in raw for section in parser.feed(ch))
+    assert parser._heads == _find_heads(raw)
+    sections.update(parser.finish()[0])
+    assert sections == {k: parse_response(raw)[k] for k in ("evidence", "self_check", "answer")}
+    # 扫描起点跟着文本往后走，不回头扫整段
+    assert parser._scan_from == len(raw) - len("self-check:") + 1
+
+
+class _StreamingWrapper:
+    model = "m"
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.sent = 0
+
+    async def astream(self, image_path=None, question="", image_base64=None):
+        for c in self.chunks:
+            self.sent += 1
+            yield c
+
+
+def _events(pipeline, **kw):
+    async def go():
+        return [e async for e in pipeline.astream(image_base64="abc", question="cat?", **kw)]
+    return asyncio.run(go())
+
+
+def test_astream_stops_after_answer():
+    wr = _StreamingWrapper(["Evidence: a cat", "\nSelf-check: ok\n", "Answer: yes", "\n", "and more text", " never read"])
+    events = _events(TrustPipeline(wr))
+    names = [e for e, _ in events]
+    assert names.index("evidence") < names.index("self_check") < names.index("answer") < names.index("done")
+    assert dict(events)["answer"] == "yes"
+    assert dict(events)["done"]["evidence"] == "a cat"
+    assert wr.sent == 4
+
+    wr = _StreamingWrapper(wr.chunks)
+    assert dict(_events(TrustPipeline(wr), stop_at_answer=False))["answer"] == "yes"
+    assert wr.sent == len(wr.chunks)
+
+
+def test_astream_without_streaming_wrapper():
+    class SyncOnly:
+        def predict(self, image_path=None, question="", image_base64=None):
+            return "Evidence: a cat\nSelf-check: supported\nAnswer: no"
+
+    events = dict(_events(TrustPipeline(SyncOnly())))
+    assert events["answer"] == "no"
+    assert events["done"]["self_check"] == "supported"
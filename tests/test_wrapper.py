@@ -0,0 +1,211 @@
+# 模型调用层：同步/异步请求、失败兜底
+import asyncio
+import json
+from unittest.mock import patch
+import httpx
+import pytest
+from src.wrapper import ModelWrapper
+from src.trust_pipeline import TrustPipeline
+
+
+def _ok_handler(request: httpx.Request) -> httpx.Response:
+    body = json.loads(request.content)
+    question = body["messages"][0]["content"][1]["text"]
+    return httpx.Response(200, json={"choices": [{"message": {"content": f"echo: {question}"}}]})
+
+
+def _mock_client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_apredict_returns_content():
+    wr = ModelWrapper(api_key="k", api_url="http://mock/v1/chat/completions", model="m")
+
+    async def go():
+        async with _mock_client(_ok_handler) as client:
+            with patch("src.wrapper.get_async_client", return_value=client):
+                return await wr.apredict(image_base64="abc", question="hi")
+
+    assert asyncio.run(go()) == "echo: hi"
+
+
+def test_apredict_http_error_returns_error():
+    wr = ModelWrapper(api_key="k", api_url="http://mock/v1/chat/completions", model="m", max_retries=0)
+
+    async def go():
+        async with _mock_client(lambda r: httpx.Response(500)) as client:
+            with patch("src.wrapper.get_async_client", return_value=client):
+                return await wr.apredict(image_base64="abc", question="hi")
+
+    assert asyncio.run(go()) == "Error"
+
+
+def test_apredict_without_image_returns_error():
+    wr = ModelWrapper(api_key="k", api_url="http://mock", model="m")
+    assert asyncio.run(wr.apredict(question="hi")) == "Error"
+
+
+def test_aprocess_falls_back_to_sync_predict():
+    class SyncOnly:
+        def predict(self, image_path=None, question="", image_base64=None):
+            return "Evidence: a cat\nSelf-check: supported\nAnswer: yes"
+
+    out = asyncio.run(TrustPipeline(SyncOnly()).aprocess(image_base64="abc", question="cat?"))
+    assert out["answer"] == "yes"
+    assert out["evidence"] == "a cat"
+
+
+
+def test_aprocess_records_stage_stats():
+    wr = ModelWrapper(api_key="k", api_url="http://mock/v1/chat/completions", model="m", max_retries=1)
+    calls = {"n": 0}
+
+    def handler(request):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            return httpx.Response(503)
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "Answer: yes"}}],
+            "usage": {"prompt_tokens": 812, "completion_tokens": 9},
+        })
+
+    async def go():
+        async with _mock_client(handler) as client:
+            with patch("src.wrapper.get_async_client", return_value=client), patch("src.wrapper.BACKOFF_BASE", 0.0):
+                return await TrustPipeline(wr).aprocess(image_base64="abc", question="cat?")
+
+    stats = asyncio.run(go())["stats"]
+    assert (stats["prompt_tokens"], stats["completion_tokens"]) == (812, 9)
+    assert stats["request_bytes"] > len("data:image/jpeg;base64,abc")
+    # 两次尝试的耗时都算进上游耗时
+    assert stats["upstream_sec"] > 0 and stats["parse_sec"] >= 0 and stats["encode_sec"] >= 0
+
+
+#====== 重试与退避 ======
+def test_apredict_retries_429_then_succeeds():
+    wr = ModelWrapper(api_key="k", api_url="http://mock/v1/chat/completions", model="m", max_retries=3)
+    calls = {"n": 0}
+
+    def handler(request):
+        calls["n"] += 1
+        if calls["n"] < 3:
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        return _ok_handler(request)
+
+    async def go():
+        async with _mock_client(handler) as client:
+            with patch("src.wrapper.get_async_client", return_value=client):
+                return await wr.apredict(image_base64="abc", question="hi")
+
+    assert asyncio.run(go()) == "echo: hi"
+    stats = wr.retry_stats
+    assert stats["retries"] == 2
+    assert stats["retry_reasons"] == {"429": 2}
+    assert stats["succeeded"] == 1 and stats["failed"] == 0
+
+
+def test_predict_retries_exhausted_returns_error():
+    import requests
+
+    wr = ModelWrapper(api_key="k", api_url="http://mock", model="m", max_retries=2)
+
+    def fake_post(*args, **kwargs):
+        raise requests.Timeout("slow")
+
+    with patch.object(wr.session, "post", side_effect=fake_post) as p, patch("src.wrapper.BACKOFF_BASE", 0.0):
+        assert wr.predict(image_base64="abc", question="hi") == "Error"
+    assert p.call_count == 3
+    assert wr.retry_stats["retry_reasons"] == {"timeout": 2}
+    assert wr.retry_stats["failed"] == 1
+
+
+def test_predict_does_not_retry_client_error():
+    wr = ModelWrapper(api_key="k", api_url="http://mock", model="m", max_retries=3)
+
+    class Resp:
+        status_code = 401
+        headers = {}
+
+        def raise_for_status(self):
+            raise RuntimeError("401 Unauthorized")
+
+    with patch.object(wr.session, "post", return_value=Resp()) as p:
+        assert wr.predict(image_base64="abc", question="hi") == "Error"
+    assert p.call_count == 1
+    assert wr.retry_stats["retries"] == 0
+
+
+def test_retry_delay_honors_retry_after():
+    from src.wrapper import retry_delay, BACKOFF_MAX
+
+    assert retry_delay(0, "2") == 2.0
+    assert retry_delay(0, "100000") == BACKOFF_MAX
+    assert 0 <= retry_delay(3) <= BACKOFF_MAX
+
+
+#====== 流式 ======
+def _sse_handler(chunks):
+    def handler(request):
+        assert json.loads(request.content)["stream"] is True
+        body = "".join(
+            "data: " + json.dumps({"choices": [{"delta": {"content": c}}]}) + "\n\n" for c in chunks
+        ) + "data: [DONE]\n\n"
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, text=body)
+    return handler
+
+
+def _collect(wr, handler):
+    async def go():
+        async with _mock_client(handler) as client:
+            with patch("src.wrapper.get_async_client", return_value=client):
+                return [c async for c in wr.astream(image_base64="abc", question="hi")]
+    return asyncio.run(go())
+
+
+def test_astream_yields_deltas():
+    wr = ModelWrapper(api_key="k", api_url="http://mock/v1/chat/completions", model="m")
+    assert _collect(wr, _sse_handler(["Evidence: a", " cat\n", "Answer: yes"])) == ["Evidence: a", " cat\n", "Answer: yes"]
+    assert wr.retry_stats["succeeded"] == 1
+
+
+def test_astream_retries_before_first_chunk_and_accepts_plain_json():
+    wr = ModelWrapper(api_key="k", api_url="http://mock/v1/chat/completions", model="m", max_retries=2)
+    calls = {"n": 0}
+
+    def handler(request):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            return httpx.Response(503, headers={"Retry-After": "0"})
+        # 服务端忽略 stream 直接回整段 JSON
+        return _ok_handler(request)
+
+    assert _collect(wr, handler) == ["echo: hi"]
+    assert wr.retry_stats["retry_reasons"] == {"503": 1}
+
+
+def test_astream_failure_yields_error():
+    wr = ModelWrapper(api_key="k", api_url="http://mock/v1/chat/completions", model="m", max_retries=0)
+    assert _collect(wr, lambda r: httpx.Response(500)) == ["Error"]
+    assert wr.retry_stats["failed"] == 1
+
+
+def test_astream_early_close_is_neither_success_nor_failure():
+    from src.ratelimit import RateLimiter, MemoryStateStore
+
+    lim = RateLimiter("mock|m", store=MemoryStateStore(), breaker_failures=3)
+    lim.record("fail")
+    wr = ModelWrapper(api_key="k", api_url="http://mock/v1/chat/completions", model="m", rate_limiter=lim)
+
+    async def go():
+        async with _mock_client(_sse_handler(["Answer: yes", " because", " ..."])) as client:
+            with patch("src.wrapper.get_async_client", return_value=client):
+                stream = wr.astream(image_base64="abc", question="hi")
+                first = await stream.__anext__()
+                await stream.aclose()
+                return first
+
+    assert asyncio.run(go()) == "Answer: yes"
+    stats = wr.retry_stats
+    assert stats["cancelled"] == 1 and stats["succeeded"] == 0 and stats["failed"] == 0
+    # 没收完的流不清熔断计数
+    assert lim.state()["failures"] == 1